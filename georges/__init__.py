@@ -2,6 +2,9 @@ __version__ = "2019.1"
 from .beam import Beam
 from .beamline import Beamline
 from .beamline_builder import BeamlineBuilder
+from .beamline_cache import BeamlineCache
 from .model import Model, ManzoniModel
+from .store import TrackingStore
+from . import beam_io
 from . import physics
 from . import statistics
@@ -1,7 +1,8 @@
 from ..lib import pybdsim
 from .bdsim import BDSim
 from .bdsim import sequence_to_bdsim
-from .tracking import read_tracking
+from .tracking import read_tracking, samplers_to_beams
+from .sampler import read_samplers, iter_sampler_chunks, select_particles
 from .tracking import track
 from .beam_bdsim import BeamBdsim
 from .material_database import get_bdsim_material
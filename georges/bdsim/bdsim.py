@@ -1,5 +1,5 @@
-import subprocess as sub
-import re
+import os
+import tempfile
 import pandas as pd
 import numpy as np
 from .material_database import  get_bdsim_material
@@ -7,6 +7,7 @@ from ..simulator import Simulator
 from ..simulator import SimulatorException
 from georges.lib.pybdsim import pybdsim
 from .. import physics
+from ..particle_files import ParticleFileWriter
 from . material_database import get_bdsim_material
 
 
@@ -309,6 +310,7 @@ class BDSim(Simulator):
     """
 
     EXECUTABLE_NAME = 'bdsim'
+    PROGRESS_PATTERN = r'Begin of event|Event \d+'
 
     def __init__(self, **kwargs):
         self._bdsim_machine = None
@@ -336,53 +338,67 @@ class BDSim(Simulator):
 
         self._bdsim_machine = sequence_to_bdsim(beamline.line, context=context)
 
-    def run(self, **kwargs):
-        """Run bdsim as a subprocess."""
+    def _prepare_run(self, **kwargs):
+        """Prepare a bdsim run (in the working directory given by the `cwd` keyword argument, default to '.')."""
+        cwd = kwargs.get('cwd', '.')
 
         # Write the file
-        self._bdsim_machine.Write(kwargs.get("input_filename", 'input')+".gmad",
+        self._bdsim_machine.Write(os.path.join(cwd, kwargs.get("input_filename", 'input')+".gmad"),
                                   kwargs.get("single_file", False)
                                   )
 
-        if kwargs.get('run_simulations', True):
-            # not working for the time not self_exec ?
-            # if self._get_exec() is None:
-            #     raise BdsimException("Can't run BDSim if no valid path and executable are defined.")
-            input_filename = kwargs.get("input_filename", 'input')
-            p = sub.Popen(f"{BDSim.EXECUTABLE_NAME} --file={input_filename}.gmad "
-                          f"--batch --ngenerate={self._nparticles} "
-                          f"--outfile={self._outputname}",
-                          stdin=sub.PIPE,
-                          stdout=sub.PIPE,
-                          stderr=sub.STDOUT,
-                          cwd=".",
-                          shell=True
-                          )
-
-            self._output = p.communicate()[0].decode()
-            self._warnings = [line for line in self._output.split('\n') if re.search('warning|fatal', line)]
-            self._fatals = [line for line in self._output.split('\n') if re.search('fatal', line)]
-            self._last_context = kwargs.get("context", {})
-            if kwargs.get('debug', False):
-                print(self._output)
-        return self
+        if not kwargs.get('run_simulations', True):
+            return None
+        # not working for the time not self_exec ?
+        # if self._get_exec() is None:
+        #     raise BdsimException("Can't run BDSim if no valid path and executable are defined.")
+        input_filename = kwargs.get("input_filename", 'input')
+        return {
+            'cmd': f"{BDSim.EXECUTABLE_NAME} --file={input_filename}.gmad "
+                   f"--batch --ngenerate={self._nparticles} "
+                   f"--outfile={self._outputname}",
+            'cwd': cwd,
+        }
+
+    def _cache_input(self, context=None) -> str:
+        """Return the content of the GMAD files of the machine (used for the cache key)."""
+        with tempfile.TemporaryDirectory() as tmp:
+            self._bdsim_machine.Write(os.path.join(tmp, 'input') + '.gmad')
+            return ''.join(
+                open(os.path.join(tmp, f)).read().replace(tmp, '') for f in sorted(os.listdir(tmp))
+            ) + f"{self._nparticles}:{self._outputname}"
 
     def track(self, particles, p0, **kwargs):
+        """
+        Write the particles file (in a background thread, see `ParticleFileWriter`) and use it as the beam.
+
+        The total energy of the particles (in GeV) is computed chunk by chunk from the momentum offsets: the
+        distribution is not modified.
+        :param particles: the distribution (X, PX, Y, PY, DPP)
+        :param p0: the reference momentum [MeV/c]
+        :param kwargs: `beam_path`, `beam_filename` and `background` (write the file in the calling thread if False)
+        """
         if len(particles) == 0:
             print("No particles to track... Doing nothing.")
             return
 
-        particles['E'] = physics.momentum_to_energy(p0 * (particles['DPP'] + 1))
-        particles['E'] = (particles['E']+physics.PROTON_MASS)/1000  # total energy in GeV
-        beampath = kwargs.get("beam_path", '.')
+        beampath = kwargs.get("beam_path", kwargs.get('cwd', '.'))
         beamfilename = kwargs.get("beam_filename", 'input_beam.dat')
 
-        particles.to_csv(f"{beampath}/{beamfilename}", header=None,
-                         index=False,
-                         sep='\t',
-                         columns=['X', 'PX', 'Y', 'PY', 'E'])
+        def total_energy(chunk):
+            return physics.momentum_to_total_energy(p0 * (chunk['DPP'] + 1)) / 1000
+
+        writer = ParticleFileWriter(f"{beampath}/{beamfilename}",
+                                    columns=[('X', 'X'), ('PX', 'PX'), ('Y', 'Y'), ('PY', 'PY'), ('E', total_energy)],
+                                    separator='\t',
+                                    )
+        if kwargs.get('background', True):
+            writer.start(particles)
+        else:
+            writer.write(particles)
 
         # Add the beam to the simulation
+        self._add_input_file(f"{beampath}/{beamfilename}", writer)
         self.beam_from_file(physics.momentum_to_energy(p0), beamfilename)
         self._nparticles = len(particles)
 
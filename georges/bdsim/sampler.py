@@ -0,0 +1,233 @@
+"""Bulk extraction of the BDSIM samplers data.
+
+All the branches of all the samplers are read in a single pass over the events (by chunks of events), either with
+uproot (pure Python, ROOT is not required) or with root_numpy. For each sampler and each event, only the first entry
+of the (jagged) branches is kept; it is extracted from the flattened content with the offsets of the events. The
+result is a single long dataframe with one row per sampler and per event (column SAMPLER, categorical), on which the
+species and aperture selections are applied with boolean masks.
+"""
+from typing import Optional, List, Dict, Tuple, Iterator
+import numpy as np
+import pandas as pd
+from .. import physics
+
+try:
+    import uproot as _uproot
+    import awkward as _ak
+except ModuleNotFoundError:
+    _uproot = None
+    _ak = None
+
+try:
+    import ROOT as _ROOT
+    import root_numpy as _root_numpy
+except ModuleNotFoundError:
+    _ROOT = None
+    _root_numpy = None
+
+SAMPLER_BRANCHES = {
+    'x': 'X',
+    'xp': 'PX',
+    'y': 'Y',
+    'yp': 'PY',
+    'energy': 'E',
+    'parentID': 'ParentID',
+    'partID': 'PDG_ID',
+    'weight': 'Weight',
+}
+SAMPLER_COLUMNS = ['X', 'PX', 'Y', 'PY', 'P', 'E', 'ParentID', 'PDG_ID', 'Weight']
+NON_SAMPLER_TYPES = ['MARKER', 'SOLIDS', 'DEGRADER', 'SROTATION', 'SCATTERER']
+DEFAULT_STEP_SIZE = 100000
+
+
+class SamplerException(Exception):
+    """Exception raised for errors in the Sampler module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def first_entries(counts: np.ndarray, content: np.ndarray) -> np.ndarray:
+    """
+    Extract the first entry of each event from a flattened jagged array.
+    :param counts: number of entries of each event
+    :param content: flattened entries of all the events
+    :return: the first entry of each event (NaN for the events without entries)
+    """
+    counts = np.asarray(counts)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    values = np.full(len(counts), np.nan)
+    hit = counts > 0
+    values[hit] = np.asarray(content)[offsets[hit]]
+    return values
+
+
+def _flatten_objects(column: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the counts and the flattened content of an array of arrays."""
+    counts = np.fromiter(map(len, column), dtype=np.int64, count=len(column))
+    if counts.sum() == 0:
+        return counts, np.zeros(0)
+    return counts, np.concatenate(column)
+
+
+def _iter_uproot(filename: str, names: List[str], tree: str, step_size: int) -> Iterator[Dict]:
+    with _uproot.open(filename) as f:
+        for chunk in f[tree].iterate(names, step_size=step_size, library='ak', how=dict):
+            yield {n: (np.asarray(_ak.num(a)), np.asarray(_ak.flatten(a))) for n, a in chunk.items()}
+
+
+def _iter_root_numpy(tree, names: List[str], step_size: int) -> Iterator[Dict]:
+    n_events = tree.GetEntries()
+    for start in range(0, n_events, step_size):
+        data = _root_numpy.tree2array(tree, branches=names, start=start, stop=start + step_size)
+        yield {n: _flatten_objects(data[n]) for n in names}
+
+
+def iter_sampler_chunks(source,
+                        samplers: List[str],
+                        step_size: int = DEFAULT_STEP_SIZE,
+                        backend: Optional[str] = None,
+                        tree: str = 'Event') -> Iterator[pd.DataFrame]:
+    """
+    Read the first entries of the branches of the samplers, by chunks of events.
+    :param source: path to the BDSIM output file (or an opened ROOT tree with the root_numpy backend)
+    :param samplers: names of the samplers
+    :param step_size: number of events per chunk
+    :param backend: 'uproot' or 'root_numpy' (default: uproot if available)
+    :param tree: name of the events tree
+    :return: an iterator over long dataframes (columns SAMPLER, EVENT and the raw sampler variables)
+    """
+    names = [f"{s}.{b}" for s in samplers for b in SAMPLER_BRANCHES.keys()]
+    if backend is None:
+        backend = 'uproot' if _uproot is not None else 'root_numpy'
+    if backend == 'uproot':
+        if _uproot is None:
+            raise SamplerException("uproot (and awkward) are required to read the BDSIM output with this backend.")
+        chunks = _iter_uproot(source, names, tree, step_size)
+    elif backend == 'root_numpy':
+        if _root_numpy is None:
+            raise SamplerException("ROOT and root_numpy are required to read the BDSIM output with this backend.")
+        if isinstance(source, str):
+            f = _ROOT.TFile(source)
+            source = f.Get(tree)
+        chunks = _iter_root_numpy(source, names, step_size)
+    else:
+        raise SamplerException(f"Invalid backend '{backend}'.")
+    first_event = 0
+    for chunk in chunks:
+        yield sampler_frame(chunk, samplers, first_event)
+        first_event += len(next(iter(chunk.values()))[0])
+
+
+def sampler_frame(chunk: Dict, samplers: List[str], first_event: int = 0) -> pd.DataFrame:
+    """
+    Build the long dataframe of the first entries of a chunk of events.
+    :param chunk: a dictionary of (counts, content) for each sampler branch ('<sampler>.<branch>')
+    :param samplers: names of the samplers
+    :param first_event: number of the first event of the chunk
+    :return: a dataframe with one row per sampler and per event with at least one entry
+    """
+    sampler_codes = []
+    events = []
+    columns = {c: [] for c in SAMPLER_BRANCHES.values()}
+    for i, s in enumerate(samplers):
+        # All the branches of a sampler share the same offsets
+        counts = np.asarray(chunk[f"{s}.x"][0])
+        hit = np.flatnonzero(counts > 0)
+        first = (np.cumsum(counts) - counts)[hit]
+        sampler_codes.append(np.full(len(hit), i, dtype=np.int32))
+        events.append(first_event + hit)
+        for branch, column in SAMPLER_BRANCHES.items():
+            columns[column].append(np.asarray(chunk[f"{s}.{branch}"][1])[first])
+    df = pd.DataFrame({c: np.concatenate(v) if len(v) else np.zeros(0) for c, v in columns.items()})
+    df.insert(0, 'EVENT', np.concatenate(events) if len(events) else np.zeros(0, dtype=np.int64))
+    df.insert(0, 'SAMPLER', pd.Categorical.from_codes(
+        np.concatenate(sampler_codes) if len(sampler_codes) else np.zeros(0, dtype=np.int32), categories=samplers))
+    return df
+
+
+def aperture_mask(data: pd.DataFrame, line: pd.DataFrame, context: Optional[Dict] = None) -> np.ndarray:
+    """
+    Return the mask of the particles inside the aperture of the element of their sampler.
+    :param data: long dataframe of the samplers data
+    :param line: the beamline table (APERTYPE and APERTURE columns, SLITS openings taken from the context)
+    :param context: the context (for the openings of the slits, keys `w<NAME>X` and `w<NAME>Y`)
+    :return: a boolean array
+    """
+    context = context or {}
+    samplers = list(data['SAMPLER'].cat.categories)
+    radius = np.full(len(samplers), np.inf)
+    half_x = np.full(len(samplers), np.inf)
+    half_y = np.full(len(samplers), np.inf)
+    for i, s in enumerate(samplers):
+        if s not in line.index:
+            continue
+        element = line.loc[s]
+        if element.get('APERTYPE') == 'CIRCLE':
+            radius[i] = float(element['APERTURE'])
+        elif element.get('APERTYPE') == 'RECTANGLE':
+            if element.get('TYPE') == 'SLITS':
+                half_x[i] = context.get(f"w{s}X", 0.1)
+                half_y[i] = context.get(f"w{s}Y", 0.1)
+            else:
+                aperture = str(element['APERTURE']).split(",")
+                half_x[i] = 0.5 * float(aperture[0])
+                half_y[i] = 0.5 * float(aperture[1])
+    codes = data['SAMPLER'].cat.codes.values
+    x = data['X'].values
+    y = data['Y'].values
+    return (np.hypot(x, y) < radius[codes]) & (np.abs(x) < half_x[codes]) & (np.abs(y) < half_y[codes])
+
+
+def select_particles(data: pd.DataFrame,
+                     line: Optional[pd.DataFrame] = None,
+                     pdg_id: Optional[int] = 2212,
+                     with_aperture: bool = True,
+                     context: Optional[Dict] = None) -> pd.DataFrame:
+    """
+    Select the particles of a species inside the apertures and convert the energies and momenta.
+    :param data: long dataframe of the samplers data
+    :param line: the beamline table (required for the aperture selection)
+    :param pdg_id: PDG code of the particles to keep (None to keep all particles)
+    :param with_aperture: keep only the particles inside the aperture of the elements
+    :param context: the context (for the openings of the slits)
+    :return: the selected particles, with the kinetic energy E [MeV] and the momentum P [MeV/c]
+    """
+    mask = np.isfinite(data['X'].values)
+    if pdg_id is not None:
+        mask &= data['PDG_ID'].values == pdg_id
+    if with_aperture and line is not None:
+        mask &= aperture_mask(data, line, context)
+    data = data[mask].copy()
+    data['E'] = 1000 * data['E'] - physics.PROTON_MASS
+    data['P'] = physics.energy_to_momentum(data['E'])
+    return data
+
+
+def read_samplers(source,
+                  line: pd.DataFrame,
+                  samplers: Optional[List[str]] = None,
+                  pdg_id: Optional[int] = 2212,
+                  with_aperture: bool = True,
+                  context: Optional[Dict] = None,
+                  step_size: int = DEFAULT_STEP_SIZE,
+                  backend: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read and select the particles of all the samplers of a BDSIM output file.
+    :param source: path to the BDSIM output file (or an opened ROOT tree with the root_numpy backend)
+    :param line: the beamline table
+    :param samplers: names of the samplers (default: all the elements except the ones listed in NON_SAMPLER_TYPES)
+    :param pdg_id: PDG code of the particles to keep (None to keep all particles)
+    :param with_aperture: keep only the particles inside the aperture of the elements
+    :param context: the context (for the openings of the slits)
+    :param step_size: number of events read at once
+    :param backend: 'uproot' or 'root_numpy' (default: uproot if available)
+    :return: a long dataframe with one row per sampler and per selected particle
+    """
+    if samplers is None:
+        samplers = list(line.index[~line['TYPE'].isin(NON_SAMPLER_TYPES)])
+    chunks = list(iter_sampler_chunks(source, samplers, step_size, backend))
+    if len(chunks) == 0:
+        chunks = [sampler_frame({f"{s}.{b}": (np.zeros(0), np.zeros(0)) for s in samplers for b in SAMPLER_BRANCHES},
+                                samplers)]
+    return pd.concat([select_particles(c, line, pdg_id, with_aperture, context) for c in chunks], ignore_index=True)
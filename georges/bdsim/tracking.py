@@ -1,15 +1,11 @@
-import os, re, io
+import os
 import pandas as pd
 import numpy as np
-import ROOT
-import root_numpy
-import multiprocessing
-from joblib import Parallel
-from joblib import delayed
 from .. import beamline
 from .bdsim import BDSim
 from .. import physics
 from . import beam_bdsim
+from . import sampler
 
 
 class TrackException(Exception):
@@ -19,71 +15,35 @@ class TrackException(Exception):
         self.message = m
 
 
-def get_array_value(x):
-
-    # TODO : optimize using the function from records of dataframe.
-
-    if len(x) > 0:
-        return x[0]
-    else:
+def read_tracking(element, evttree, **kwargs):
+    """Read the data of the sampler of an element from a BDSIM events tree (opened with ROOT)."""
+    if element['TYPE'] in sampler.NON_SAMPLER_TYPES:
         return None
+    chunks = list(sampler.iter_sampler_chunks(evttree, [element.name], backend='root_numpy'))
+    data = sampler.select_particles(pd.concat(chunks, ignore_index=True),
+                                    line=element.to_frame().T,
+                                    with_aperture=kwargs.get("with_aperture", True),
+                                    context=kwargs.get('context', {}),
+                                    )
+    return beam_bdsim.BeamBdsim(data[sampler.SAMPLER_COLUMNS].reset_index(drop=True))
 
 
-def read_tracking(element, evttree, **kwargs):
-    """Read a BDSIM Tracking 'one' file to a dataframe."""
-
-    if element['TYPE'] not in ['MARKER', 'SOLIDS', 'DEGRADER', 'SROTATION', 'SCATTERER']:
-        data_element = root_numpy.tree2array(evttree, branches=[element.name + ".x",
-                                                                element.name + ".y",
-                                                                element.name + ".xp",
-                                                                element.name + ".yp",
-                                                                element.name + ".energy",
-                                                                element.name + ".parentID",
-                                                                element.name + ".partID",
-                                                                element.name + ".weight"])
-        df = pd.DataFrame(data=data_element)
-        m = df.applymap(lambda x: get_array_value(x))
-
-        bdsim_beam = pd.DataFrame(columns=['X', 'PX', 'Y', 'PY', 'P', 'E', 'ParentID', 'PDG_ID', 'Weight'])
-        bdsim_beam['X'] = m[element.name + ".x"].values
-        bdsim_beam['PX'] = m[element.name + ".xp"].values
-        bdsim_beam['Y'] = m[element.name + ".y"].values
-        bdsim_beam['PY'] = m[element.name + ".yp"].values
-        bdsim_beam['E'] = m[element.name + ".energy"].values
-        bdsim_beam['ParentID'] = m[element.name + ".parentID"].values
-        bdsim_beam['PDG_ID'] = m[element.name + ".partID"].values
-        bdsim_beam['Weight'] = m[element.name + ".weight"].values
-        bdsim_beam.query('X == X', inplace=True)  # Remove None entries
-        bdsim_beam.query("PDG_ID == 2212", inplace=True) # Keep protons
-        bdsim_beam['E'] = 1000*bdsim_beam['E'] - physics.PROTON_MASS
-        bdsim_beam['P'] = physics.energy_to_momentum(bdsim_beam['E'])
-
-        # Query particles inside the aperture
-        # TODO make a kwargs if we want to have an aperture (if using_collimators == TRUE)
-        if kwargs.get("with_aperture", True):
-            bdsim_beam["R"] = np.sqrt(bdsim_beam['X']**2 + bdsim_beam['Y']**2)
-
-            if kwargs.get("with_aperture", True):
-                if element['APERTYPE'] == 'CIRCLE':
-                    aperture = float(element['APERTURE'])
-                    bdsim_beam.query("R < @aperture", inplace=True)
-
-                if element['APERTYPE'] == 'RECTANGLE':
-
-                    if element['TYPE'] == 'SLITS':
-                        context = kwargs.get('context', {})
-                        aper1 = context.get(f"w{element.name}X", 0.1)
-                        aper2 = context.get(f"w{element.name}Y", 0.1)
-
-                    else:  # TODO Other case than bend ?
-                        aperture = element['APERTURE'].split(",")
-                        aper1 = 0.5*float(aperture[0])
-                        aper2 = 0.5*float(aperture[1])
-
-                    bdsim_beam.query("abs(X) < @aper1 and abs(Y) < @aper2", inplace=True)
-
-        tmp = beam_bdsim.BeamBdsim(bdsim_beam[['X', 'PX', 'Y', 'PY', 'P', 'E', 'ParentID', 'PDG_ID', 'Weight']])
-        return tmp
+def samplers_to_beams(data: pd.DataFrame, line: pd.DataFrame) -> pd.Series:
+    """
+    Split the long dataframe of the samplers data in a beam per element.
+    :param data: the selected particles of all the samplers (see `sampler.read_samplers`)
+    :param line: the beamline table
+    :return: a series of BeamBdsim objects indexed as the beamline (None for the elements without sampler)
+    """
+    codes = data['SAMPLER'].cat.codes.values
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(data['SAMPLER'].cat.categories) + 1))
+    values = data[sampler.SAMPLER_COLUMNS].values[order]
+    beams = {
+        s: beam_bdsim.BeamBdsim(pd.DataFrame(values[bounds[i]:bounds[i + 1]], columns=sampler.SAMPLER_COLUMNS))
+        for i, s in enumerate(data['SAMPLER'].cat.categories)
+    }
+    return pd.Series([beams.get(n) for n in line.index], index=line.index)
 
 
 def track(**kwargs):
@@ -91,6 +51,8 @@ def track(**kwargs):
     :param kwargs: parameters are:
         - line: the beamline on which twiss will be run
         - context: the associated context on which MAD-X is run
+        - cache: a SimulatorCache (optional)
+        - backend: reader of the BDSIM output, 'uproot' or 'root_numpy' (default: uproot if available)
     """
     # Process arguments
     line = kwargs.get('line', None)
@@ -106,39 +68,37 @@ def track(**kwargs):
 
     bd = BDSim(beamlines=[line], **kwargs)
 
-    # Write the input file for bdsim
-    bd_beam = b.distribution.copy()
+    # Write the input file for bdsim (in the background, while the input deck is prepared)
     p0 = physics.energy_to_momentum(b.energy)
 
-    bd.track(bd_beam, p0, **kwargs)
+    bd.track(b.distribution, p0, **kwargs)
 
     # Add options for Bdsim
     bd.set_options(options)
 
-    # Run bdsim
-    errors = bd.run(**kwargs).fatals
-
     # Create a new beamline to include the results
     l = line.line.copy()
 
-    # TODO Make the extraction of the beam in MT : make with a kwargs
-    #
-    #
-
-    if kwargs.get("extract_beam", True):
-        # Open the ROOT file and get the events
-
-        f = ROOT.TFile(bd._outputname+'.root')
-        evttree = f.Get("Event")
+    def collect(cwd):
+        if not kwargs.get("extract_beam", True):
+            return None
+        data = sampler.read_samplers(os.path.join(cwd, bd._outputname + '.root'),
+                                     l,
+                                     with_aperture=kwargs.get("with_aperture", True),
+                                     context=context,
+                                     step_size=kwargs.get("step_size", sampler.DEFAULT_STEP_SIZE),
+                                     backend=kwargs.get("backend"),
+                                     )
+        return samplers_to_beams(data, l)
 
-        if kwargs.get("enable_mt", False):
-            num_cores = multiprocessing.cpu_count()
-            l['BEAM'] = Parallel(n_jobs=num_cores - 1)(delayed(read_tracking)(g, evttree) for _, g in l.iterrows())
+    # Run bdsim
+    beams = bd.run_cached(collect, **kwargs)
 
-        # Add columns which contains datas
-        print("WRITE BEAM FILE")
-        l['BEAM'] = l.apply(lambda g: read_tracking(g, evttree, **kwargs), axis=1)
+    if kwargs.get("extract_beam", True):
+        l['BEAM'] = beams
 
         # not a beautiful method
+        bd_beam = b.distribution.copy()
+        bd_beam['E'] = physics.momentum_to_total_energy(p0 * (bd_beam['DPP'] + 1)) / 1000
         l['BEAM'].iloc[0] = beam_bdsim.BeamBdsim(bd_beam)
     return beamline.Beamline(l)
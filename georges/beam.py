@@ -1,6 +1,8 @@
+import os
 import pandas as pd
 import numpy as np
 from . import physics
+from . import beam_io
 from scipy.optimize import curve_fit
 
 PARTICLE_TYPES = {'proton', 'antiproton', 'electron', 'positron'}
@@ -217,17 +219,38 @@ class Beam:
         return self.__distribution[item]
 
     def from_csv(self, fname):
-        """Read a beam distribution from a csv file."""
-        self.__initialize_distribution(distribution=pd.read_csv(fname)[['X', 'PX', 'Y', 'PY', 'DPP']])
+        """Read a beam distribution from a csv file (only the phase-space columns are parsed)."""
+        self.__initialize_distribution(distribution=pd.DataFrame(beam_io.load(fname, PHASE_SPACE_DIMENSIONS[:5],
+                                                                              fmt='csv')))
         self.__distribution.columns = PHASE_SPACE_DIMENSIONS[:self.__dims]
         return self
 
     def from_parquet(self, fname):
-        """Read a beam distribution from a parquet file."""
-        self.__initialize_distribution(distribution=pd.read_parquet(fname)[['X', 'PX', 'Y', 'PY', 'DPP']])
+        """Read a beam distribution from a parquet file (only the phase-space columns are read)."""
+        self.__initialize_distribution(distribution=pd.DataFrame(beam_io.load(fname, PHASE_SPACE_DIMENSIONS[:5],
+                                                                              fmt='parquet')))
         self.__distribution.columns = PHASE_SPACE_DIMENSIONS[:self.__dims]
         return self
 
+    def from_beam_file(self, fname):
+        """Read a beam distribution from a (memory-mapped) binary beam file."""
+        self.__initialize_distribution(distribution=pd.DataFrame(beam_io.read_beam_file(fname)))
+        self.__distribution.columns = PHASE_SPACE_DIMENSIONS[:self.__dims]
+        return self
+
+    def to_beam_file(self, fname, dtype=np.float64):
+        """Write the beam distribution to a binary beam file."""
+        beam_io.write_beam_file(fname,
+                                self.__distribution,
+                                dtype=dtype,
+                                metadata={'particle': self.__particle, 'energy': self.__energy})
+        return self
+
+    @staticmethod
+    def from_file(filename, path='', columns=None):
+        """Return a distribution (DataFrame) read from a binary, parquet or csv beam file."""
+        return pd.DataFrame(beam_io.load(os.path.join(path, filename), columns or PHASE_SPACE_DIMENSIONS[:5]))
+
     def __initialize_distribution(self, distribution=None, *args, **kwargs):
         """Try setting the internal pandas.DataFrame with a distribution."""
         if distribution is not None:
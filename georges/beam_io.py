@@ -0,0 +1,305 @@
+from typing import Optional, List, Iterator
+import os
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet as _pq
+except ModuleNotFoundError:
+    _pq = None
+
+BEAM_FILE_MAGIC = b'GEORGESB'
+BEAM_FILE_VERSION = 1
+BEAM_FILE_EXTENSION = '.beam'
+BEAM_FILE_ALIGNMENT = 64
+DEFAULT_COLUMNS = ['X', 'PX', 'Y', 'PY', 'DPP']
+DEFAULT_CHUNK_SIZE = 1000000
+BEAM_FILE_FORMATS = {
+    'beam': (BEAM_FILE_EXTENSION,),
+    'parquet': ('.parquet', '.pq'),
+    'csv': ('.csv', '.txt', '.dat'),
+}
+
+
+class BeamIOException(Exception):
+    """Exception raised for errors in the BeamIO module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+class BeamFile:
+    """Memory-mapped binary beam file.
+
+    The file contains a small header (magic string, header length and a JSON description of the columns) followed by
+    the raw columns (float64 or float32), one after the other. Opening a file does not read the particles: the columns
+    are memory-mapped (copy-on-write) and only the pages actually used are loaded.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename: path to the beam file
+        """
+        self._filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(BEAM_FILE_MAGIC)) != BEAM_FILE_MAGIC:
+                raise BeamIOException(f"'{filename}' is not a beam file.")
+            header_length = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+            self._header = json.loads(f.read(header_length).decode())
+        if self._header['version'] > BEAM_FILE_VERSION:
+            raise BeamIOException("Unsupported beam file version.")
+        self._data = np.memmap(filename,
+                               dtype=np.dtype(self._header['dtype']),
+                               mode='c',
+                               offset=self._header['offset'],
+                               shape=(len(self._header['columns']), self._header['n']),
+                               )
+
+    @property
+    def columns(self) -> List[str]:
+        """Return the names of the columns."""
+        return self._header['columns']
+
+    @property
+    def n_particles(self) -> int:
+        """Return the number of particles in the file."""
+        return self._header['n']
+
+    @property
+    def dtype(self):
+        """Return the floating point type of the columns."""
+        return self._data.dtype
+
+    @property
+    def metadata(self) -> dict:
+        """Return the user metadata (particle type, energy, etc.) stored in the header."""
+        return self._header.get('metadata', {})
+
+    def column(self, name: str) -> np.ndarray:
+        """Return a single (memory-mapped) column."""
+        return self._data[self.columns.index(name)]
+
+    def array(self, columns: Optional[List[str]] = None) -> np.ndarray:
+        """Return a (n_particles, n_columns) view on the memory-mapped columns, without copy if all columns are used."""
+        if columns is None or list(columns) == self.columns:
+            return self._data.T
+        return self._data[[self.columns.index(c) for c in columns]].T
+
+    def iter_chunks(self,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    columns: Optional[List[str]] = None,
+                    dtype=np.float64,
+                    ) -> Iterator[np.ndarray]:
+        """Iterate over contiguous (chunk_size, n_columns) arrays, ready to be tracked."""
+        indices = [self.columns.index(c) for c in (columns or self.columns)]
+        for start in range(0, self.n_particles, chunk_size):
+            stop = min(start + chunk_size, self.n_particles)
+            chunk = np.empty((stop - start, len(indices)), dtype=dtype)
+            for j, i in enumerate(indices):
+                chunk[:, j] = self._data[i, start:stop]
+            yield chunk
+
+
+def _header(n: int, columns: List[str], dtype, metadata: Optional[dict]) -> bytes:
+    description = {
+        'version': BEAM_FILE_VERSION,
+        'n': int(n),
+        'columns': list(columns),
+        'dtype': np.dtype(dtype).str,
+        'metadata': metadata or {},
+        'offset': 0,
+    }
+    # The offset depends on the header length: iterate once to get a stable, aligned value
+    for _ in range(2):
+        length = len(json.dumps(description).encode())
+        offset = len(BEAM_FILE_MAGIC) + 4 + length
+        description['offset'] = offset + (-offset) % BEAM_FILE_ALIGNMENT
+    encoded = json.dumps(description).encode()
+    padding = description['offset'] - len(BEAM_FILE_MAGIC) - 4
+    return BEAM_FILE_MAGIC + np.array([padding], dtype='<u4').tobytes() + encoded.ljust(padding)
+
+
+def write_beam_file(filename: str,
+                    data,
+                    columns: Optional[List[str]] = None,
+                    dtype=np.float64,
+                    metadata: Optional[dict] = None,
+                    ):
+    """
+    Write particles to a binary beam file.
+    :param filename: path to the beam file
+    :param data: a Beam, a DataFrame or a (n_particles, n_columns) array
+    :param columns: names of the columns (default: the DataFrame columns or X, PX, Y, PY, DPP)
+    :param dtype: floating point type of the columns on disk (float64 or float32)
+    :param metadata: optional dictionary (JSON serializable) stored in the header
+    """
+    if hasattr(data, 'distribution'):
+        data = data.distribution
+    if isinstance(data, pd.DataFrame):
+        columns = list(columns or data.columns)
+        data = data[columns].values
+    columns = list(columns or DEFAULT_COLUMNS[:data.shape[1]])
+    if data.shape[1] != len(columns):
+        raise BeamIOException("Invalid number of columns.")
+    write_beam_file_from_chunks(filename, [data], data.shape[0], columns, dtype, metadata)
+
+
+def write_beam_file_from_chunks(filename: str,
+                                chunks,
+                                n: int,
+                                columns: List[str],
+                                dtype=np.float64,
+                                metadata: Optional[dict] = None,
+                                ):
+    """
+    Write a binary beam file from an iterable of (chunk_size, n_columns) arrays; memory usage is bounded by the chunk size.
+    :param filename: path to the beam file
+    :param chunks: iterable of arrays
+    :param n: total number of particles
+    :param columns: names of the columns
+    :param dtype: floating point type of the columns on disk (float64 or float32)
+    :param metadata: optional dictionary (JSON serializable) stored in the header
+    """
+    header = _header(n, columns, dtype, metadata)
+    with open(filename, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + n * len(columns) * np.dtype(dtype).itemsize)
+    mm = np.memmap(filename, dtype=dtype, mode='r+', offset=len(header), shape=(len(columns), n))
+    start = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        stop = start + chunk.shape[0]
+        if stop > n:
+            raise BeamIOException("More particles than announced.")
+        mm[:, start:stop] = chunk.T
+        start = stop
+    if start != n:
+        raise BeamIOException("Less particles than announced.")
+    mm.flush()
+    del mm
+
+
+def read_beam_file(filename: str, columns: Optional[List[str]] = None) -> np.ndarray:
+    """Return a memory-mapped (n_particles, n_columns) array from a binary beam file."""
+    return BeamFile(filename).array(columns)
+
+
+def iter_parquet(filename: str,
+                 columns: Optional[List[str]] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 dtype=np.float64,
+                 ) -> Iterator[np.ndarray]:
+    """Stream record batches of a Parquet file as (chunk_size, n_columns) arrays; only the given columns are read."""
+    if _pq is None:
+        raise BeamIOException("The 'pyarrow' package is required to stream Parquet files.")
+    columns = list(columns or DEFAULT_COLUMNS)
+    for batch in _pq.ParquetFile(filename).iter_batches(batch_size=chunk_size, columns=columns):
+        chunk = np.empty((batch.num_rows, len(columns)), dtype=dtype)
+        for j, c in enumerate(columns):
+            chunk[:, j] = batch.column(batch.schema.get_field_index(c)).to_numpy(zero_copy_only=False)
+        yield chunk
+
+
+def iter_csv(filename: str,
+             columns: Optional[List[str]] = None,
+             chunk_size: int = DEFAULT_CHUNK_SIZE,
+             dtype=np.float64,
+             sep: str = ',',
+             ) -> Iterator[np.ndarray]:
+    """Stream a CSV file as (chunk_size, n_columns) arrays; only the given columns are parsed."""
+    columns = list(columns or DEFAULT_COLUMNS)
+    for df in pd.read_csv(filename,
+                          sep=sep,
+                          usecols=columns,
+                          dtype={c: dtype for c in columns},
+                          chunksize=chunk_size):
+        yield df[columns].values
+
+
+def file_format(filename: str, fmt: Optional[str] = None) -> str:
+    """
+    Return the format of a beam file ('beam', 'parquet' or 'csv').
+    :param filename: path to the beam file
+    :param fmt: explicit format (default: inferred from the extension)
+    """
+    if fmt is not None:
+        if fmt not in BEAM_FILE_FORMATS:
+            raise BeamIOException(f"Unknown beam file format '{fmt}'.")
+        return fmt
+    extension = os.path.splitext(filename)[1].lower()
+    for f, extensions in BEAM_FILE_FORMATS.items():
+        if extension in extensions:
+            return f
+    raise BeamIOException(f"Unknown beam file format '{extension}'.")
+
+
+def iter_beam_chunks(filename: str,
+                     columns: Optional[List[str]] = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     dtype=np.float64,
+                     fmt: Optional[str] = None,
+                     **kwargs) -> Iterator[np.ndarray]:
+    """
+    Stream a beam file (binary, Parquet or CSV) as contiguous arrays.
+
+    The chunks can be fed directly to the tracking (see `manzoni.track_chunks`).
+    :param filename: path to the beam file
+    :param columns: columns to be read (default: X, PX, Y, PY, DPP)
+    :param chunk_size: number of particles per chunk
+    :param dtype: floating point type of the chunks
+    :param fmt: format of the file ('beam', 'parquet' or 'csv', default: inferred from the extension)
+    :param kwargs: additional parameters passed to the CSV reader
+    """
+    fmt = file_format(filename, fmt)
+    if fmt == 'beam':
+        return BeamFile(filename).iter_chunks(chunk_size, columns or DEFAULT_COLUMNS, dtype)
+    elif fmt == 'parquet':
+        return iter_parquet(filename, columns, chunk_size, dtype)
+    return iter_csv(filename, columns, chunk_size, dtype, **kwargs)
+
+
+def count_particles(filename: str, fmt: Optional[str] = None) -> int:
+    """Return the number of particles in a beam file, without parsing it."""
+    fmt = file_format(filename, fmt)
+    if fmt == 'beam':
+        return BeamFile(filename).n_particles
+    elif fmt == 'parquet':
+        if _pq is None:
+            raise BeamIOException("The 'pyarrow' package is required to read Parquet files.")
+        return _pq.ParquetFile(filename).metadata.num_rows
+    lines = 0
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            lines += block.count(b'\n')
+        if f.tell() == 0:
+            return 0
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            lines += 1
+    return max(lines - 1, 0)  # Header line
+
+
+def load(filename: str,
+         columns: Optional[List[str]] = None,
+         dtype=np.float64,
+         chunk_size: int = DEFAULT_CHUNK_SIZE,
+         fmt: Optional[str] = None,
+         **kwargs) -> np.ndarray:
+    """
+    Load a beam file in a single preallocated (n_particles, n_columns) array.
+
+    Binary beam files are memory-mapped; other formats are streamed chunk by chunk so that the peak memory is the size
+    of the final array plus one chunk.
+    :param fmt: format of the file ('beam', 'parquet' or 'csv', default: inferred from the extension)
+    """
+    fmt = file_format(filename, fmt)
+    if fmt == 'beam':
+        return read_beam_file(filename, columns)
+    columns = list(columns or DEFAULT_COLUMNS)
+    data = np.empty((count_particles(filename, fmt), len(columns)), dtype=dtype)
+    start = 0
+    for chunk in iter_beam_chunks(filename, columns, chunk_size, dtype, fmt, **kwargs):
+        data[start:start + chunk.shape[0]] = chunk
+        start += chunk.shape[0]
+    return data[:start]
@@ -2,7 +2,7 @@ import numpy as np
 import numpy.linalg as npl
 import pandas as pd
 
-from georges.sequence_geometry import compute_derived_data
+from georges.sequence_geometry import expand_sequence_data
 
 
 class BeamlineException(Exception):
@@ -86,14 +86,8 @@ class Beamline:
             self.__create(beamline.line)
 
     def __expand_sequence_data(self):
-        """Apply sequence transformation until a fixed point is reached."""
-        tmp = self.__beamline.apply(compute_derived_data, axis=1)
-        tmp2 = tmp
-        while True:
-            tmp, tmp2 = tmp2, tmp.apply(compute_derived_data, axis=1)
-            if tmp.equals(tmp2):
-                break
-        self.__beamline = tmp2
+        """Apply sequence transformation until a fixed point is reached (column-wise)."""
+        self.__beamline = expand_sequence_data(self.__beamline)
 
     def __convert_survey_to_sequence(self):
         s = self.__beamline
@@ -2,6 +2,7 @@ import functools
 import itertools
 import collections
 import os
+import numpy as np
 import pandas as pd
 from .beamline import Beamline
 
@@ -17,7 +18,10 @@ def flatten(iterable, ltypes=collections.Iterable):
     """
     remainder = iter(iterable)
     while True:
-        first = next(remainder)
+        try:
+            first = next(remainder)
+        except StopIteration:
+            return
         if isinstance(first, ltypes) and not isinstance(first, (str, bytes)):
             remainder = itertools.chain(first, remainder)
         else:
@@ -32,17 +36,24 @@ class BeamlineBuilderException(Exception):
 
 
 class BeamlineBuilder:
-    def __init__(self, path='.', prefix='', elements=None):
+    def __init__(self, path='.', prefix='', elements=None, cache=None):
         """
         BeamlineBuilder class used for the generation of georges.Beamline objects.
         :param path: path for file lookup (default to '.')
         :param prefix: default prefix for file lookup (default to '')
         :param elements: name of the elements file (default to None)
+        :param cache: a BeamlineCache; if defined, the files are only read (and the sequence expanded) on a cache miss
         """
         self.__path = path
         self.__prefix = prefix
         self.__elements = None
         self.__beamline = pd.DataFrame()
+        self.__records = []
+        self.__files = []
+        self.__files_sep = None
+        self.__elements_file = None
+        self.__elements_sep = None
+        self.__cache = cache
         self.__name = ""
         self.__from_survey = False
         if elements is not None:
@@ -53,6 +64,20 @@ class BeamlineBuilder:
         """
         :return: beamline object being built ('snapshot' during the creation phase).
         """
+        return self.__materialize()
+
+    def __materialize(self):
+        """Convert the accumulated records into a DataFrame (a single concatenation for all the pending records)."""
+        if self.__files and self.__beamline.empty:
+            self.__read_files()
+        if self.__records:
+            labels, records = zip(*self.__records)
+            self.__records = []
+            new = pd.DataFrame(list(records), index=list(labels))
+            if self.__beamline.empty and len(self.__beamline.columns) == 0:
+                self.__beamline = new
+            else:
+                self.__beamline = pd.concat([self.__beamline, new], sort=False)
         return self.__beamline
 
     def add_from_files(self, names, path=None, prefix=None, sep=None):
@@ -64,25 +89,33 @@ class BeamlineBuilder:
         files = [
             os.path.splitext(n)[0] + (os.path.splitext(n)[1] or f".{DEFAULT_EXTENSION}") for n in names
         ]
+        self.__records = []
+        self.__beamline = pd.DataFrame()
+        self.__files = [os.path.join(self.__path, self.__prefix, f) for f in files]
+        self.__files_sep = sep
+        if self.__cache is None:
+            self.__read_files()
+        return self
+
+    def __read_files(self):
         sequences = []
-        for f in files:
-            if sep is None:
+        for f in self.__files:
+            if self.__files_sep is None:
                 try:
-                    sequences.append(pd.read_csv(os.path.join(self.__path, self.__prefix, f), index_col='NAME', sep=','))
+                    sequences.append(pd.read_csv(f, index_col='NAME', sep=','))
                 except ValueError:
-                    sequences.append(pd.read_csv(os.path.join(self.__path, self.__prefix, f), index_col='NAME', sep=';'))
+                    sequences.append(pd.read_csv(f, index_col='NAME', sep=';'))
             else:
-                sequences.append(pd.read_csv(os.path.join(self.__path, self.__prefix, f), index_col='NAME', sep=sep))
+                sequences.append(pd.read_csv(f, index_col='NAME', sep=self.__files_sep))
         if len(sequences) >= 2 and not self.__from_survey:
             sequences[1]['AT_CENTER'] += sequences[0].iloc[-1]['AT_CENTER']
             if sequences[0].index[-1] == sequences[1].index[0]:
                 self.__beamline = pd.concat([sequences[0][:-1], sequences[1][1:]])
             else:
                 self.__beamline = pd.concat(sequences)
-            return self
+            return
         self.__beamline = pd.concat(sequences)
         self.__beamline['PHYSICAL'] = True
-        return self
 
     def add_from_survey_files(self, names, path=None, prefix=None, sep=None):
         self.__from_survey = True
@@ -108,29 +141,69 @@ class BeamlineBuilder:
             raise BeamlineBuilderException("Invalid data type for 'elements'.")
 
     def define_elements_from_list(self, elements):
+        self.__elements_file = None
         self.__elements = pd.DataFrame(elements)
         return self
 
     def define_elements_from_file(self, file, sep=None):
         file = os.path.splitext(file)[0] + '.' + (os.path.splitext(file)[1] or DEFAULT_EXTENSION)
-        if sep is None:
+        self.__elements_file = os.path.join(self.__path, file)
+        self.__elements_sep = sep
+        self.__elements = None
+        if self.__cache is None:
+            self.__read_elements_file()
+        return self
+
+    def __read_elements_file(self):
+        if self.__elements_sep is None:
             try:
-                self.__elements = pd.read_csv(os.path.join(self.__path, file), sep=',')
+                self.__elements = pd.read_csv(self.__elements_file, sep=',')
             except ValueError:
-                self.__elements = pd.read_csv(os.path.join(self.__path, file), sep=';')
+                self.__elements = pd.read_csv(self.__elements_file, sep=';')
         else:
-            self.__elements = pd.read_csv(os.path.join(self.__path, file), sep=sep)
+            self.__elements = pd.read_csv(self.__elements_file, sep=self.__elements_sep)
         self.__elements = self.__elements.set_index('NAME')
-        return self
+
+    def __cache_key(self):
+        files = list(self.__files)
+        if self.__elements_file is not None:
+            files.append(self.__elements_file)
+        return self.__cache.key(
+            files=files,
+            options={
+                'files_sep': self.__files_sep,
+                'elements_sep': self.__elements_sep,
+                'from_survey': self.__from_survey,
+                'with_elements_file': self.__elements_file is not None,
+            },
+            data=[
+                self.__records,
+                self.__beamline if self.__beamline.size > 0 else None,
+                self.__elements if self.__elements_file is None else None,
+            ]
+        )
 
     def build(self, name=None, extra_length=0.0):
         if name is not None:
             self.__name = name
+        key = None
+        if self.__cache is not None:
+            key = self.__cache_key()
+            line = self.__cache.get_line(key)
+            if line is not None:
+                b = Beamline(line, name=self.__name, with_expansion=False)
+                b.add_extra_drift(extra_length)
+                return b
+        self.__materialize()
+        if self.__elements is None and self.__elements_file is not None:
+            self.__read_elements_file()
         if self.__elements is not None:
             self.__expand_elements_data()
         if 'PHYSICAL' not in self.__beamline:
             self.__beamline['PHYSICAL'] = True
         b = Beamline(self.__beamline, name=self.__name, from_survey=self.__from_survey)
+        if key is not None:
+            self.__cache.put_line(key, b.line)
         b.add_extra_drift(extra_length)
         return b
 
@@ -149,13 +222,14 @@ class BeamlineBuilder:
             return self.add_sequence(e)
 
     def add_element(self, e):
-        e = pd.Series(e)
-        e.name = e['NAME']
-        self.__beamline = self.__beamline.append(e)
+        """Add a single element (the record is only stored, the DataFrame is created once, when needed)."""
+        e = dict(e)
+        self.__records.append((e['NAME'], e))
         return self
 
     def add_sequence(self, s):
-        self.__beamline = self.__beamline.append(pd.DataFrame(s))
+        """Add a sequence of elements (list of records, the rows are labelled by their position in the sequence)."""
+        self.__records.extend((i, dict(e)) for i, e in enumerate(s))
         return self
 
     @staticmethod
@@ -182,25 +256,25 @@ class BeamlineBuilder:
         return list(flatten(sequence, ltypes=list))
 
     def flatten(self, using='LENGTH', offset=0):
-        elements_names = {}
-        at_entry_list = []
-        for i, e in self.__beamline.iterrows():
-            if elements_names.get(e['NAME']) is None:
-                elements_names[self.__beamline.iloc[i]['NAME']] = 0
-            else:
-                elements_names[self.__beamline.iloc[i]['NAME']] += 1
-            self.__beamline.loc[i, 'NAME'] = f"{self.__beamline.iloc[i]['NAME']}_{elements_names[e['NAME']]}"
-            at_entry_list.append(offset)
-            offset += e[using]
-        self.__beamline['AT_ENTRY'] = at_entry_list
-        if self.__beamline.iloc[-1]['TYPE'] is 'DRIFT':
-            self.__beamline = self.__beamline.append(
+        """
+        Give unique names to the elements (NAME_0, NAME_1, ...), compute their entry positions and remove the drifts.
+        :param using: column used to compute the positions of the elements
+        :param offset: position of the entry of the first element
+        """
+        b = self.__materialize().copy()
+        names = b['NAME'].astype(str)
+        b['NAME'] = names + '_' + names.groupby(names.values).cumcount().astype(str).values
+        lengths = np.cumsum(b[using].values.astype(float))
+        at_entry = offset + np.concatenate([[0.0], lengths[:-1]])
+        b['AT_ENTRY'] = at_entry
+        if b.iloc[-1]['TYPE'] == 'DRIFT':
+            b = b.append(
                 {
                     'NAME': 'END_BUILDER_MARKER',
                     'TYPE': 'MARKER',
-                    'AT_ENTRY': at_entry_list[-1] + self.__beamline.iloc[-1][using]
+                    'AT_ENTRY': offset + lengths[-1]
                 }
                 , ignore_index=True
             )
-        self.__beamline = self.__beamline.query("TYPE != 'DRIFT'")
+        self.__beamline = b.query("TYPE != 'DRIFT'")
         return self
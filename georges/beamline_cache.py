@@ -0,0 +1,174 @@
+from typing import Optional, List, Dict, Iterable
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'georges', 'beamlines')
+CONTEXT_ENERGY_KEYS = ['ENERGY', 'PC', 'BRHO']
+
+
+def hash_file(filename: str, block_size: int = 1 << 20) -> str:
+    """Return the sha256 digest of the content of a file."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_object(o) -> str:
+    """Return the sha256 digest of an in-memory object (pickled)."""
+    return hashlib.sha256(pickle.dumps(o, protocol=4)).hexdigest()
+
+
+def hash_table(line: pd.DataFrame) -> str:
+    """Return a digest of the content of a beamline table (values, index and column names)."""
+    h = hashlib.sha256()
+    h.update(json.dumps([str(c) for c in line.columns]).encode())
+    h.update(pd.util.hash_pandas_object(line.astype(str), index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def context_dependencies(line: pd.DataFrame) -> List[str]:
+    """
+    Return the context keys on which the manzoni conversion of a beamline table depends.
+
+    These are the circuits plugged into the elements (including the aperture circuits) and the reference energy keys
+    (unless the magnetic rigidity of each element is already defined in the table).
+    :param line: the beamline table
+    :return: the sorted list of context keys
+    """
+    keys = set()
+    if 'CIRCUIT' in line:
+        for c in line['CIRCUIT'].dropna().astype(str):
+            keys.update(k.strip() for k in c.strip('[{}]').split(',') if k.strip())
+    if 'BRHO' not in line.columns:
+        keys.update(CONTEXT_ENERGY_KEYS)
+    return sorted(keys)
+
+
+class BeamlineCache:
+    """Content-addressed on-disk cache of built beamlines.
+
+    Two kinds of entries are stored:
+        - the fully expanded beamline tables, keyed on the hashes of the input files (sequences and elements
+          definitions), of the in-memory records and of the builder options;
+        - the converted manzoni arrays, keyed on the content of the beamline table, on the values of the context keys
+          on which the conversion depends (see `context_dependencies`) and on the conversion parameters.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        """
+        :param path: directory of the cache (created if needed)
+        """
+        self._path = path
+        self._file_hashes = {}
+        for d in ('lines', 'manzoni'):
+            os.makedirs(os.path.join(path, d), exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        """Return the directory of the cache."""
+        return self._path
+
+    def file_hash(self, filename: str) -> str:
+        """Return the hash of a file (memoized on the file modification time and size)."""
+        stat = os.stat(filename)
+        signature = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+        if signature not in self._file_hashes:
+            self._file_hashes[signature] = hash_file(filename)
+        return self._file_hashes[signature]
+
+    def key(self, files: Iterable[str] = (), options: Optional[Dict] = None, data: Iterable = ()) -> str:
+        """
+        Compute the key of a beamline table.
+        :param files: input files (only their content is used)
+        :param options: builder options (JSON serializable)
+        :param data: in-memory inputs (picklable)
+        :return: the key (hexadecimal digest)
+        """
+        description = {
+            'version': CACHE_VERSION,
+            'files': [self.file_hash(f) for f in files],
+            'options': options or {},
+            'data': [hash_object(d) for d in data],
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _entry(self, kind: str, key: str, extension: str) -> str:
+        return os.path.join(self._path, kind, key + extension)
+
+    @staticmethod
+    def _write(filename: str, write):
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        write(tmp)
+        os.replace(tmp, filename)
+
+    def get_line(self, key: str) -> Optional[pd.DataFrame]:
+        """Return a cached beamline table, or None if the key is not in the cache."""
+        filename = self._entry('lines', key, '.pkl')
+        if not os.path.exists(filename):
+            return None
+        return pd.read_pickle(filename)
+
+    def put_line(self, key: str, line: pd.DataFrame):
+        """Store a beamline table."""
+        self._write(self._entry('lines', key, '.pkl'), lambda f: line.to_pickle(f))
+
+    def manzoni_key(self, line: pd.DataFrame, context: Optional[Dict] = None, fermi_params: Optional[Dict] = None) -> str:
+        """Compute the key of a converted manzoni array (the layout of the manzoni columns is part of the key)."""
+        from .manzoni.constants import INDEX
+        context = context or {}
+        dependencies = context_dependencies(line)
+        description = {
+            'version': CACHE_VERSION,
+            'index': list(INDEX),
+            'line': hash_table(line),
+            'context': {k: context.get(k) for k in dependencies},
+            'fermi_params': fermi_params or {},
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_manzoni(self, key: str) -> Optional[np.ndarray]:
+        """Return a cached manzoni array, or None if the key is not in the cache."""
+        filename = self._entry('manzoni', key, '.npy')
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename)
+
+    def put_manzoni(self, key: str, array: np.ndarray, dependencies: Optional[List[str]] = None):
+        """Store a manzoni array, with the list of context keys on which it depends."""
+        def write(filename):
+            with open(filename, 'wb') as f:
+                np.save(f, array)
+        self._write(self._entry('manzoni', key, '.npy'), write)
+        with open(self._entry('manzoni', key, '.json'), 'w') as f:
+            json.dump({'dependencies': dependencies or []}, f)
+
+    def convert_line(self, line, context: Optional[Dict] = None, fermi_params: Optional[Dict] = None) -> np.ndarray:
+        """
+        Cached equivalent of `manzoni.convert_line` (conversion to a numpy array).
+        :param line: a Beamline or a beamline table
+        :param context: the context (circuits and energy)
+        :param fermi_params: parameters of the Fermi-Eyges computations
+        :return: the manzoni array
+        """
+        from .manzoni.common import convert_line
+        if hasattr(line, 'line'):
+            line = line.line
+        key = self.manzoni_key(line, context, fermi_params)
+        array = self.get_manzoni(key)
+        if array is None:
+            array = convert_line(line, context, to_numpy=True, fermi_params=fermi_params)
+            self.put_manzoni(key, array, context_dependencies(line))
+        return array
+
+    def clear(self):
+        """Remove all the entries of the cache."""
+        for d in ('lines', 'manzoni'):
+            for f in os.listdir(os.path.join(self._path, d)):
+                os.remove(os.path.join(self._path, d, f))
@@ -8,3 +8,4 @@ from .fermi_eyges import compute_fermi_eyges
 from .mcs import DifferentialMoliere, FermiRossi, ICRUProtons, scattering_length
 from .propagation import propagate, track_energy
 from . import materials
+from .planner import plan_layers, fermi_eyges_parameters, residual_energies, PlannerException
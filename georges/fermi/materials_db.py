@@ -5,6 +5,7 @@ import numpy as np
 import scipy.interpolate
 
 STAR_COLUMNS: List[str] = ['K', 'eS', 'nS', 'tS', 'csda', 'prange', 'factor']
+INVERSE_RANGE_POINTS: int = 2000
 
 
 class MaterialsDB:
@@ -40,6 +41,7 @@ class MaterialsDB:
             'csda_ranges': csda_ranges,
             'pdg_data': pdg_data,
         }
+        self.__inverse_ranges = {}
 
     def _star_read_data(self, m) -> pd.DataFrame:
         return pd.read_table(os.path.join(self.db_path, "pstar", f"{m}.txt"),
@@ -106,6 +108,21 @@ class MaterialsDB:
     def projected_ranges(self):
         return self.__materials_db['projected_ranges']
 
+    def inverse_range(self, material, csda: bool = False) -> scipy.interpolate.CubicSpline:
+        """
+        Return the spline of log(energy) as a function of log(range) (the inverse of the range tables), for the
+        conversions of arrays of ranges. The splines are built on first use and cached.
+        :param material: the material
+        :param csda: use the CSDA ranges instead of the projected ranges
+        :return: a cubic spline
+        """
+        key = (str(material), csda)
+        if key not in self.__inverse_ranges:
+            spline = (self.csda_ranges if csda else self.projected_ranges)[str(material)]
+            log_energy = np.linspace(spline.x[0], spline.x[-1], INVERSE_RANGE_POINTS)
+            self.__inverse_ranges[key] = scipy.interpolate.CubicSpline(spline(log_energy), log_energy)
+        return self.__inverse_ranges[key]
+
     def density(self, material):
         return self.__materials_db['pdg_data'].at[str(material), 'rho']
 
@@ -0,0 +1,198 @@
+"""Batch planning of the energy layers of a degrader and energy selection system (ESS).
+
+For an array of target energies, the thickness of the degrader, the energies and magnetic rigidities along the line
+and the Fermi-Eyges parameters of the degraders and scatterers are computed for all the layers at once: the loop runs
+over the elements of the line only, each step being vectorized over the layers. The energies are obtained from the
+range tables (the inverse tables are cached in the materials database) and the Fermi-Eyges integrals are computed with
+a Gauss-Legendre quadrature on a (layers x nodes) grid instead of one adaptive integration per layer and per element.
+"""
+from typing import Optional, Dict, Iterable
+import numpy as np
+import pandas as pd
+from .. import Beamline
+from .. import physics
+from .materials_db import MaterialsDB
+from .stopping import get_range_from_energy, get_energy_from_range
+from .fermi_eyges import compute_energy_dispersion, compute_losses
+from .mcs import DifferentialMoliere
+
+PLANNER_QUADRATURE_NODES: int = 64
+PLANNER_ELEMENT_QUANTITIES = ['ENERGY_IN', 'ENERGY_OUT', 'BRHO', 'FE_A0', 'FE_A1', 'FE_A2', 'FE_DPP', 'FE_LOSS']
+
+_default_db: Optional[MaterialsDB] = None
+
+
+class PlannerException(Exception):
+    """Exception raised for errors in the Planner module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def _db(db: Optional[MaterialsDB]) -> MaterialsDB:
+    global _default_db
+    if db is not None:
+        return db
+    if _default_db is None:
+        _default_db = MaterialsDB()
+    return _default_db
+
+
+def residual_energies(material, thickness: np.ndarray, k_in: np.ndarray, db: MaterialsDB) -> np.ndarray:
+    """
+    Vectorized residual kinetic energy after a slab of material.
+    :param material: the material
+    :param thickness: thickness of the slab (cm)
+    :param k_in: incoming kinetic energy (MeV)
+    :param db: the materials database
+    :return: the residual energies (NaN if the particles stop in the slab)
+    """
+    k_in = np.asarray(k_in, dtype=float)
+    r = np.atleast_1d(get_range_from_energy(material, k_in, db=db) - thickness)
+    return get_energy_from_range(material, r, db=db).reshape(np.broadcast(k_in, thickness).shape)
+
+
+def fermi_eyges_parameters(material,
+                           energy: np.ndarray,
+                           thickness: np.ndarray,
+                           db: MaterialsDB,
+                           t=DifferentialMoliere,
+                           n_nodes: int = PLANNER_QUADRATURE_NODES) -> Dict[str, np.ndarray]:
+    """
+    Vectorized Fermi-Eyges parameters (same definitions as `compute_fermi_eyges`) for arrays of incoming energies and
+    thicknesses.
+    :param material: the material
+    :param energy: incoming kinetic energies (MeV)
+    :param thickness: thicknesses (cm)
+    :param db: the materials database
+    :param t: the scattering power model
+    :param n_nodes: number of nodes of the Gauss-Legendre quadrature
+    :return: a dictionary of arrays (A0, A1, A2, B, E_R, DPP, LOSS)
+    """
+    energy, thickness = np.broadcast_arrays(np.asarray(energy, dtype=float), np.asarray(thickness, dtype=float))
+    a = np.zeros((3,) + energy.shape)
+    slab = thickness > 0
+    if np.any(slab):
+        x, w = np.polynomial.legendre.leggauss(n_nodes)
+        u = 0.5 * thickness[slab][:, None] * (x + 1)
+        weights = 0.5 * thickness[slab][:, None] * w
+        residual = get_range_from_energy(material, energy[slab], db=db)[:, None] - u
+        pv = physics.energy_to_pv(get_energy_from_range(material, residual, db=db))
+        p1v1 = physics.energy_to_pv(energy[slab])[:, None]
+        scattering = np.nan_to_num(t.t(pv, p1v1, db=db, material=material))
+        depth = thickness[slab][:, None] - u
+        a[0][slab] = np.sum(weights * scattering, axis=-1)  # Order 0
+        a[1][slab] = 1e-2 * np.sum(weights * depth * scattering, axis=-1)  # Order 1
+        a[2][slab] = 1e-4 * np.sum(weights * depth ** 2 * scattering, axis=-1)  # Order 2
+    e_r = residual_energies(material, thickness, energy, db)
+    return {
+        'A0': a[0],
+        'A1': a[1],
+        'A2': a[2],
+        'B': np.sqrt(a[0] * a[2] - a[1] ** 2),
+        'E_R': e_r,
+        'DPP': compute_energy_dispersion(e_r, str(material)) ** 2,
+        'LOSS': compute_losses(e_r, str(material)) * np.ones_like(e_r),
+    }
+
+
+def _is_absorber(e: pd.Series) -> bool:
+    """Elements with an energy loss (same selection as `track_energy`)."""
+    return (e['TYPE'] == 'slab' or e['TYPE'] == 'gap' or e['CLASS'] == 'DEGRADER') \
+        and str(e.get('MATERIAL', '')) not in ('', 'nan', 'vacuum')
+
+
+def _is_scatterer(e: pd.Series) -> bool:
+    """Elements with Fermi-Eyges parameters (same selection as `convert_line`)."""
+    return e['CLASS'] in ('DEGRADER', 'SCATTERER') and str(e.get('MATERIAL', '')) not in ('', 'nan', 'vacuum')
+
+
+def plan_layers(line: Beamline,
+                energies: Iterable[float],
+                energy: float,
+                degrader: str,
+                db: Optional[MaterialsDB] = None,
+                model=DifferentialMoliere,
+                ess_slits: Optional[float] = None,
+                ess_dispersion: Optional[float] = None,
+                n_nodes: int = PLANNER_QUADRATURE_NODES) -> Dict[str, pd.DataFrame]:
+    """
+    Plan a batch of energy layers.
+
+    Example:
+        plan = plan_layers(line, energies=np.arange(70, 230, 1.0), energy=230.0, degrader='DEG',
+                           ess_slits=0.01, ess_dispersion=1.5)
+        plan['layers']['THICKNESS']
+        plan['elements']['BRHO']  # layers x elements
+
+    :param line: the beamline (CLASS, LENGTH and MATERIAL columns)
+    :param energies: the kinetic energies (MeV) requested at the exit of the degrader
+    :param energy: the kinetic energy (MeV) at the entrance of the line
+    :param degrader: name of the degrader element (its length is adjusted for each layer)
+    :param db: the materials database (a default database is created on first use)
+    :param model: the scattering power model of the Fermi-Eyges computations
+    :param ess_slits: half opening (m) of the slits of the energy selection system
+    :param ess_dispersion: dispersion (m) at the slits of the energy selection system
+    :param n_nodes: number of nodes of the Fermi-Eyges quadratures
+    :return: a dictionary with 'layers', a dataframe with one row per layer (energy, degrader thickness in m,
+    Fermi-Eyges parameters of the degrader and ESS transmission) and 'elements', a dataframe with one row per
+    layer and two levels of columns (quantity, element) for the energies, BRHO and Fermi-Eyges parameters
+    """
+    db = _db(db)
+    energies = np.atleast_1d(np.asarray(energies, dtype=float))
+    elements = line.line.copy()
+    if 'TYPE' not in elements:
+        elements['TYPE'] = elements['CLASS']
+    if degrader not in elements.index:
+        raise PlannerException(f"The degrader '{degrader}' is not in the line.")
+    if elements.at[degrader, 'CLASS'] != 'DEGRADER':
+        raise PlannerException(f"The element '{degrader}' is not a degrader.")
+
+    n = len(energies)
+    quantities = {q: np.zeros((n, len(elements))) for q in PLANNER_ELEMENT_QUANTITIES}
+    thickness = np.zeros(n)
+    k = np.full(n, float(energy))
+    for i, (name, e) in enumerate(elements.iterrows()):
+        quantities['ENERGY_IN'][:, i] = k
+        material = str(e.get('MATERIAL', ''))
+        if name == degrader:
+            if np.any(energies > k):
+                raise PlannerException("The requested energies must be below the energy at the degrader.")
+            thickness = get_range_from_energy(material, k, db=db) - get_range_from_energy(material, energies, db=db)
+            length = thickness
+        else:
+            length = np.full(n, 100 * e['LENGTH'])
+        if (_is_scatterer(e) and e['LENGTH'] != 0) or name == degrader:
+            fe = fermi_eyges_parameters(material, k, length, db, model, n_nodes)
+            quantities['FE_A0'][:, i] = fe['A0']
+            quantities['FE_A1'][:, i] = fe['A1']
+            quantities['FE_A2'][:, i] = fe['A2']
+            quantities['FE_DPP'][:, i] = fe['DPP']
+            quantities['FE_LOSS'][:, i] = fe['LOSS']
+        if _is_absorber(e) and (e['LENGTH'] != 0 or name == degrader):
+            k = energies.copy() if name == degrader else residual_energies(material, length, k, db)
+        quantities['ENERGY_OUT'][:, i] = k
+    quantities['BRHO'] = physics.energy_to_brho(quantities['ENERGY_IN'])
+
+    index = pd.Index(np.arange(n), name='LAYER')
+    d = elements.index.get_loc(degrader)
+    layers = pd.DataFrame({
+        'ENERGY': energies,
+        'THICKNESS': thickness / 100,
+        'BRHO': physics.energy_to_brho(energies),
+        'FE_A0': quantities['FE_A0'][:, d],
+        'FE_A1': quantities['FE_A1'][:, d],
+        'FE_A2': quantities['FE_A2'][:, d],
+        'FE_DPP': quantities['FE_DPP'][:, d],
+        'FE_LOSS': quantities['FE_LOSS'][:, d],
+    }, index=index)
+    if ess_slits is not None and ess_dispersion is not None:
+        layers['TRANSMISSION'] = physics.ess_transmission(0.0, np.sqrt(layers['FE_DPP'].values), ess_slits,
+                                                          ess_dispersion)
+    columns = pd.MultiIndex.from_product([PLANNER_ELEMENT_QUANTITIES, elements.index], names=['QUANTITY', 'ELEMENT'])
+    return {
+        'layers': layers,
+        'elements': pd.DataFrame(np.concatenate([quantities[q] for q in PLANNER_ELEMENT_QUANTITIES], axis=1),
+                                 index=index,
+                                 columns=columns),
+    }
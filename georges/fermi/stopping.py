@@ -14,16 +14,26 @@ def get_range_from_energy(material, energy, **kwargs):
 
 
 def get_energy_from_range(material, r, **kwargs):
+    """
+    Return the kinetic energy from the range (in cm). Arrays of ranges are converted with the cached inverse
+    range tables of the database; ranges outside of the tables (e.g. negative residual ranges) give NaN.
+    """
     db = kwargs.get('db', None)
     csda = kwargs.get("csda", False)
     projected = kwargs.get("projected", not csda)
+    if projected == csda:
+        raise Exception("'projected' or 'csda' arguments are mutually exclusive and one must be defined.")
+    if np.ndim(r) > 0:
+        inverse = db.inverse_range(material, csda=csda)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_r = np.log(np.asarray(r, dtype=float) * db.density(material))
+            valid = (log_r >= inverse.x[0]) & (log_r <= inverse.x[-1])
+        return np.where(valid, np.exp(inverse(np.where(valid, log_r, inverse.x[0]))), np.nan)
     if projected and not csda:
         return \
         np.exp(db.projected_ranges[str(material)].solve(np.log(r * db.density(material)), extrapolate=False))[0]
-    elif csda and not projected:
-        return np.exp(db.csda_ranges[str(material)].solve(np.log(r * db.density(material)), extrapolate=False))[0]
     else:
-        raise Exception("'projected' or 'csda' arguments are mutually exclusive and one must be defined.")
+        return np.exp(db.csda_ranges[str(material)].solve(np.log(r * db.density(material)), extrapolate=False))[0]
 
 
 def residual_energy(material, thickness, k_in, **kwargs):
@@ -1,2 +1,3 @@
 from .g4beamline import G4Beamline
 from .tracking import track
+from .tracking import read_detectors, read_g4beamline_tracking
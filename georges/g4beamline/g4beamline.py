@@ -1,15 +1,15 @@
 import os
-import re
-import subprocess as sub
 
 import jinja2
 import numpy as np
 import pandas as pd
 
 from georges.simulator import Simulator
+from georges.particle_files import ParticleFileWriter
 from .grammar import g4beamline_syntax
 
 INPUT_FILENAME = 'input.g4bl'
+G4BEAMLINE_BEAM_COLUMNS = ['X', 'Y', 'Z', 'PX', 'PY', 'PZ', 't', 'PDGid', 'EventId', 'TrackId', 'ParentId', 'Weight']
 
 
 class G4BeamlineException(Exception):
@@ -105,6 +105,9 @@ class G4Beamline(Simulator):
     """
 
     EXECUTABLE_NAME = 'g4bl'
+    WARNING_PATTERN = 'Warning|Fatal Exception'
+    FATAL_PATTERN = 'Fatal Exception'
+    PROGRESS_PATTERN = r'Event \d+'
 
     def __init__(self, **kwargs):
 
@@ -130,28 +133,59 @@ class G4Beamline(Simulator):
     def _add__detector(self, e):
         self.__add_input('add_detector', (e['AT_CENTER'], e.name))
 
-    def track(self, particles):
+    def track(self, particles, cwd='.', p0=None, background=True):
+        """
+        Write the particles file (in a background thread, see `ParticleFileWriter`) and use it as the beam.
+        :param particles: the distribution, in G4Beamline units (X, Y, Z, PX, PY, PZ, t, PDGid, EventId, TrackId,
+        ParentId, Weight) or, if p0 is given, in georges units (X, PX, Y, PY); the conversion is then done chunk by
+        chunk, without modifying the distribution
+        :param cwd: directory of the particles file
+        :param p0: the reference momentum [MeV/c]
+        :param background: write the file in a background thread (waited for before running)
+        """
         if len(particles) == 0:
             print("No particles to track... Doing nothing.")
             return
 
         # Create the input file
         self.__add_input('beam_input', (len(particles),))
-        with open('input_beam.dat', 'w+') as f:
-            f.write('#BLTrackFile\n')
-            f.write('# x y z Px Py Pz t PDGid EventID TrackID ParentID Weight\n')
-            f.write('# mm mm mm MeV/c MeV/c MeV/c ns - - - - -\n')
-            particles.to_csv(f, header=False, sep=' ', index=None
-                             , columns=['X', 'Y', 'Z', 'PX', 'PY', 'PZ',
-                                        't', 'PDGid', 'EventId', 'TrackId',
-                                        'ParentId', 'Weight'])
+        if p0 is None:
+            columns = [(c, c) for c in G4BEAMLINE_BEAM_COLUMNS]
+        else:
+            columns = [
+                ('X', lambda c: c['X'] * 1000),
+                ('Y', lambda c: c['Y'] * 1000),
+                ('Z', 0.0),
+                ('PX', lambda c: c['PX'] * p0),
+                ('PY', lambda c: c['PY'] * p0),
+                ('PZ', lambda c: np.sqrt(p0 ** 2 - (c['PX'] * p0) ** 2 - (c['PY'] * p0) ** 2)),
+                ('t', 0.0),
+                ('PDGid', 2212),
+                ('EventId', lambda c: c['INDEX'] + 1),
+                ('TrackId', 1),
+                ('ParentId', 1),
+                ('Weight', 1.0),
+            ]
+        writer = ParticleFileWriter(os.path.join(cwd, 'input_beam.dat'),
+                                    columns=columns,
+                                    decimals={**{c: 5 for c in G4BEAMLINE_BEAM_COLUMNS},
+                                              **{c: None for c in ['PDGid', 'EventId', 'TrackId', 'ParentId']}},
+                                    header='#BLTrackFile\n'
+                                           '# x y z Px Py Pz t PDGid EventID TrackID ParentID Weight\n'
+                                           '# mm mm mm MeV/c MeV/c MeV/c ns - - - - -\n',
+                                    )
+        if background:
+            writer.start(particles)
+        else:
+            writer.write(particles)
+        self._add_input_file(os.path.join(cwd, 'input_beam.dat'), writer)
 
     def __add_input(self, keyword, strings=()):
         self._input += g4beamline_syntax[keyword].format(*strings) + '\n'
 
-    def run(self, **kwargs):
-        """Run madx as a subprocess."""
-
+    def _prepare_run(self, **kwargs):
+        """Prepare a g4beamline run (in the working directory given by the `cwd` keyword argument)."""
+        cwd = kwargs.get('cwd', '.')
         template_input = jinja2.Template(self._input).render(kwargs.get("context", {}))
         if kwargs.get("debug", False) >= 2:
             print(template_input)
@@ -159,25 +193,17 @@ class G4Beamline(Simulator):
             raise G4BeamlineException("Can't run G4Beamline if no valid path and executable are defined.")
 
         # Write the file for g4beamline
-        file = open(INPUT_FILENAME, 'w')
+        file = open(os.path.join(cwd, INPUT_FILENAME), 'w')
         file.write(template_input)
         file.flush()
         file.close()
 
-        cmd = " ".join([self._exec, INPUT_FILENAME])
-
-        p = sub.Popen(cmd,
-                      stdin=sub.PIPE,
-                      stdout=sub.PIPE,
-                      stderr=sub.STDOUT,
-                      cwd=".",
-                      shell=True
-                      )
-        self._output = p.communicate(input=template_input.encode())[0].decode()
-        self._warnings = [line for line in self._output.split('\n') if re.search('Warning|Fatal Exception', line)]
-        self._fatals = [line for line in self._output.split('\n') if re.search('Fatal Exception', line)]
-        self._last_context = kwargs.get("context", {})
-        if kwargs.get('debug', False):
-            print(self._output)
-        os.remove(INPUT_FILENAME)
-        return self
+        return {
+            'cmd': " ".join([self._exec, INPUT_FILENAME]),
+            'input': template_input.encode(),
+            'cwd': cwd,
+        }
+
+    def _finalize_run(self, output, **kwargs):
+        super()._finalize_run(output, **kwargs)
+        os.remove(os.path.join(kwargs.get('cwd', '.'), INPUT_FILENAME))
@@ -1,4 +1,7 @@
 import os
+import multiprocessing
+from typing import Optional, Dict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from .. import beamline
 from .. import beam
@@ -7,6 +10,10 @@ import numpy as np
 from .. import physics
 
 G4BEAMLINE_SKIP_ROWS = 3
+G4BEAMLINE_DETECTOR_COLUMNS = ['X', 'Y', 'S', 'PX', 'PY', 'PZ', 't', 'PDGid', 'EventID', 'TrackID', 'ParentID',
+                               'Weight']
+DETECTOR_SOURCE_COLUMNS = ['X', 'PX', 'Y', 'PY', 'PZ', 'S', 't', 'PDGid', 'EventID', 'Weight']
+DETECTOR_COLUMNS = ['X', 'PX', 'Y', 'PY', 'P', 'S', 't', 'PDGid', 'EventID', 'Weight']
 
 
 class TrackException(Exception):
@@ -16,27 +23,80 @@ class TrackException(Exception):
         self.message = m
 
 
-def read_g4beamline_tracking(file):
-    """Read a G4Beamline Tracking 'one' file to a dataframe."""
+def _read_detector(file: str) -> Optional[np.ndarray]:
+    """
+    Read a G4Beamline detector file, keep the primary particles and convert the units.
+    :param file: path to the detector file
+    :return: an array with the columns DETECTOR_COLUMNS (None if the file does not exist)
+    """
+    if not os.path.isfile(file):
+        return None
+    data = pd.read_csv(file,
+                       comment='#',
+                       header=None,
+                       names=G4BEAMLINE_DETECTOR_COLUMNS,
+                       delim_whitespace=True,
+                       dtype=np.float64,
+                       engine='c',
+                       ).values
+    c = {k: i for i, k in enumerate(G4BEAMLINE_DETECTOR_COLUMNS)}
+    data = data[(data[:, c['TrackID']] == 1) & (data[:, c['ParentID']] == 1)]
+    data[:, [c['X'], c['Y'], c['S']]] /= 1000
+    p = np.sqrt(data[:, c['PX']] ** 2 + data[:, c['PY']] ** 2 + data[:, c['PZ']] ** 2)
+    data[:, c['PX']] /= p
+    data[:, c['PY']] /= p
+    data[:, c['PZ']] = p  # the total momentum replaces PZ
+    return data[:, [c[k] for k in DETECTOR_SOURCE_COLUMNS]]
+
+
+def read_detectors(files: Dict[str, str], max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Read G4Beamline detector files in parallel worker processes (one pool of worker processes by default).
+
+    The files are always read in the calling process when it is itself a daemonic worker (e.g. a job of a
+    `SimulatorJobRunner`), which can not have child processes.
+    :param files: the detector files, by element name
+    :param max_workers: number of worker processes (default: number of CPUs, 1 to read in the calling process)
+    :return: a long dataframe (one row per primary particle and detector, DETECTOR is a categorical column)
+    """
+    names = list(files.keys())
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(names), 1))
+    if max_workers > 1 and not multiprocessing.current_process().daemon:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            arrays = list(executor.map(_read_detector, [files[n] for n in names]))
+    else:
+        arrays = [_read_detector(files[n]) for n in names]
+    arrays = [np.zeros((0, len(DETECTOR_COLUMNS))) if a is None else a for a in arrays]
+    data = pd.DataFrame(np.concatenate(arrays) if len(arrays) else np.zeros((0, len(DETECTOR_COLUMNS))),
+                        columns=DETECTOR_COLUMNS)
+    data.insert(0, 'DETECTOR', pd.Categorical.from_codes(
+        np.repeat(np.arange(len(names), dtype=np.int32), [len(a) for a in arrays]), categories=names))
+    return data
 
-    column_names = ['X', 'Y', 'S', 'PX', 'PY', 'PZ', 't', 'PDGid', 'EventID', 'TrackID', 'ParentID', 'Weight']
-    tmp = np.nan
-    if os.path.isfile(file):
-        data = pd.read_csv(file, skiprows=G4BEAMLINE_SKIP_ROWS, delimiter=' ', header=None, names=column_names) \
-                 .query("TrackID == 1 and ParentID == 1")
 
-        if len(data) == 0:
-            return tmp
-        data['X'] /= 1000
-        data['Y'] /= 1000
-        data['S'] /= 1000
-        data['P'] = np.sqrt(data['PX']**2+data['PY']**2+data['PZ']**2)
-        data['PX'] /= data['P']
-        data['PY'] /= data['P']
+def read_g4beamline_tracking(file):
+    """Read a G4Beamline Tracking 'one' file to a dataframe."""
+    data = _read_detector(file)
+    if data is None or len(data) == 0:
+        return np.nan
+    return beam.Beam(pd.DataFrame(data, columns=DETECTOR_COLUMNS)[['X', 'PX', 'Y', 'PY', 'P']])
 
-        tmp = beam.Beam(data[['X', 'PX', 'Y', 'PY', 'P']])
 
-    return tmp
+def detectors_to_beams(data: pd.DataFrame, line: pd.DataFrame) -> pd.Series:
+    """
+    Split the long dataframe of the detectors data in a beam per element.
+    :param data: the detectors data (see `read_detectors`)
+    :param line: the beamline table
+    :return: a series of Beam objects indexed as the beamline (NaN for the elements without particles)
+    """
+    codes = data['DETECTOR'].cat.codes.values
+    bounds = np.searchsorted(codes, np.arange(len(data['DETECTOR'].cat.categories) + 1))
+    values = data[['X', 'PX', 'Y', 'PY', 'P']].values
+    beams = {
+        d: beam.Beam(pd.DataFrame(values[bounds[i]:bounds[i + 1]], columns=['X', 'PX', 'Y', 'PY', 'P']))
+        for i, d in enumerate(data['DETECTOR'].cat.categories) if bounds[i + 1] > bounds[i]
+    }
+    return pd.Series([beams.get(n, np.nan) for n in line.index], index=line.index)
 
 
 def track(**kwargs):
@@ -55,28 +115,14 @@ def track(**kwargs):
 
     g4 = G4Beamline(beamlines=[line], **kwargs)
 
-    # Convert m in mm for G4Beamline and rad in MeV/c
-    g4_beam = b.distribution.copy()
-
     momentum = physics.energy_to_momentum(b.energy)
-    g4_beam['X'] *= 1000
-    g4_beam['Y'] *= 1000
-    g4_beam['Z'] = 0.0
-    g4_beam['PX'] *= momentum
-    g4_beam['PY'] *= momentum
-    g4_beam['PZ'] = np.sqrt(momentum**2 - g4_beam['PX']**2 - g4_beam['PY']**2)
-    g4_beam['t'] = 0.0
-    g4_beam['PDGid'] = 2212
-    g4_beam['EventId'] = np.arange(1, len(b.distribution)+1, 1)
-    g4_beam['TrackId'] = 1
-    g4_beam['ParentId'] = 1
-    g4_beam['Weight'] = 1.0
 
     # Create a new beamline to include the results
     l = line.line.copy()
 
-    # Run G4Beamline
-    g4.track(round(g4_beam, 5))
+    # Run G4Beamline (m are converted in mm and rad in MeV/c while writing the beam file)
+    cwd = kwargs.get('cwd', '.')
+    g4.track(b.distribution, cwd=cwd, p0=momentum)
     errors = g4.run(**kwargs).fatals
 
     if kwargs.get("debug", False):
@@ -87,9 +133,10 @@ def track(**kwargs):
         # raise TrackException("G4Beamline ended with fatal error.")
 
     # Add columns which contains datas
-    l['BEAM'] = l.apply(lambda g: read_g4beamline_tracking('Detector'+g.name+'.txt'), axis=1)
-    l.apply(lambda g:
-            os.remove('Detector' + g.name + '.txt') if os.path.isfile('Detector' + g.name + '.txt') else None,
-            axis=1)
+    files = {n: os.path.join(cwd, 'Detector' + n + '.txt') for n in l.index}
+    l['BEAM'] = detectors_to_beams(read_detectors(files, max_workers=kwargs.get('max_workers')), l)
+    for f in files.values():
+        if os.path.isfile(f):
+            os.remove(f)
 
     return beamline.Beamline(l)
@@ -1,5 +1,96 @@
+import gzip as _gzip
 import numpy as _np
 
+# Number of rows of the field map encoded at once (bounds the memory used by the text encoding)
+CHUNK_SIZE = 200000
+
+# Compression level of the gzipped field maps (fast compression, the text of the numbers compresses well anyway)
+GZIP_LEVEL = 1
+
+# Powers of ten (extended precision) covering the range of the double precision exponents
+_POWERS_OFFSET = 400
+_POWERS = _np.longdouble(10) ** _np.arange(-_POWERS_OFFSET, _POWERS_OFFSET, dtype=_np.longdouble)
+
+
+# Characters of the numbers 0000 to 9999, packed in 4 bytes
+_DIGITS_TABLE = _np.array([list(b'%04d' % i) for i in range(10000)], dtype=_np.uint8).view(_np.uint32).ravel()
+
+
+def _Digits(values, n):
+    """Return the (len(values), n) matrix of the characters of the n last digits of integers."""
+    nGroups = (n + 3) // 4
+    groups = _np.empty((len(values), nGroups), dtype=_np.uint32)
+    for i in range(nGroups - 1, -1, -1):
+        groups[:, i] = _DIGITS_TABLE[values % 10000]
+        values = values // 10000
+    return groups.view(_np.uint8)[:, -n:]
+
+
+def EncodeScientific(values, nDecimals=8):
+    """
+    Encode a column of numbers in scientific notation ('%.8E' style), as a
+    matrix of characters (one row per value, same width for all the rows,
+    a space in place of the sign of the positive values).
+
+    The mantissas are computed with extended precision so that 16 decimals
+    (doublePrecision) are correctly rounded.
+    """
+    values = _np.asarray(values, dtype=_np.float64)
+    if not _np.all(_np.isfinite(values)):
+        raise ValueError('Invalid (non finite) values in the field map.')
+    n = len(values)
+    a = _np.abs(values).astype(_np.longdouble)
+    nonzero = a > 0
+    exponent = _np.zeros(n, dtype=_np.int64)
+    exponent[nonzero] = _np.floor(_np.log10(_np.abs(values[nonzero]))).astype(_np.int64)
+    low = _POWERS[_POWERS_OFFSET + nDecimals]
+    high = _POWERS[_POWERS_OFFSET + nDecimals + 1]
+    for _ in range(3):
+        # Fix the exponents off by one (log10 rounding, mantissa rounded up to 10)
+        mantissa = _np.rint(a * _POWERS[_POWERS_OFFSET + nDecimals - exponent])
+        small = nonzero & (mantissa < low)
+        large = mantissa >= high
+        if not (small.any() or large.any()):
+            break
+        exponent[small] -= 1
+        exponent[large] += 1
+    mantissa = mantissa.astype(_np.int64)
+    nExponent = 3 if n > 0 and _np.abs(exponent).max() >= 100 else 2
+
+    chars = _np.empty((n, nDecimals + 5 + nExponent), dtype=_np.uint8)
+    chars[:, 0] = _np.where(values < 0, ord('-'), ord(' '))
+    digits = _Digits(mantissa, nDecimals + 1)
+    chars[:, 1] = digits[:, 0]
+    chars[:, 2] = ord('.')
+    chars[:, 3:3 + nDecimals] = digits[:, 1:]
+    chars[:, 3 + nDecimals] = ord('E')
+    chars[:, 4 + nDecimals] = _np.where(exponent < 0, ord('-'), ord('+'))
+    chars[:, 5 + nDecimals:] = _Digits(_np.abs(exponent), nExponent)
+    return chars
+
+
+def EncodeRows(data, nDecimals=8, separator='\t'):
+    """
+    Encode a 2D array as lines of text (columns in scientific notation).
+    """
+    data = _np.asarray(data)
+    if data.shape[0] == 0:
+        return b''
+    sep = _np.frombuffer(separator.encode(), dtype=_np.uint8)
+    parts = []
+    for i in range(data.shape[1]):
+        if i > 0:
+            parts.append(_np.broadcast_to(sep, (data.shape[0], len(sep))))
+        parts.append(EncodeScientific(data[:, i], nDecimals))
+    parts.append(_np.full((data.shape[0], 1), ord('\n'), dtype=_np.uint8))
+    return _np.ascontiguousarray(_np.concatenate(parts, axis=1)).tobytes()
+
+
+def _Open(fileName, mode):
+    if fileName.endswith('.gz') and not fileName.endswith('.tar.gz'):
+        return _gzip.open(fileName, mode, compresslevel=GZIP_LEVEL)
+    return open(fileName, mode)
+
 
 class Field(object):
     """
@@ -7,6 +98,9 @@ class Field(object):
 
     This does not support arbitrary loop ordering - only the originally intended
     xyzt.
+
+    The field map is written by chunks of rows with a vectorized encoder, and
+    compressed on the fly if the file name ends with '.gz'.
     """
     def __init__(self, array=_np.array([]), columns=[], flip=True, doublePrecision=False):
         self.data            = array
@@ -15,19 +109,20 @@ class Field(object):
         self.flip            = flip
         self.doublePrecision = doublePrecision       
 
-    def Write(self, fileName):
-        f = open(fileName, 'w')
-        for key,value in self.header.iteritems():
-            f.write(str(key)+'> '+ str(value) + '\n')
+    def Write(self, fileName, chunkSize=CHUNK_SIZE):
+        """
+        Write the field map to a file (gzip compressed if the name ends in '.gz').
 
+        chunkSize - number of rows encoded at once.
+        """
         if self.doublePrecision:
-            colStrings = map(lambda s: '%23s' % s, self.columns)
+            colStrings = ['%23s' % s for s in self.columns]
+            nDecimals = 16
         else:
-            colStrings = map(lambda s: '%14s' % s, self.columns)
+            colStrings = ['%14s' % s for s in self.columns]
+            nDecimals = 8
         colStrings[0] = colStrings[0].strip() # don't pad the first column title
-        # a '!' denotes the column header line
-        f.write('! '+ '\t'.join(colStrings)+'\n')
-        
+
         # flatten all but last dimension - 3 field components
         nvalues = _np.shape(self.data)[-1] # number of values in last dimension
 
@@ -36,26 +131,21 @@ class Field(object):
             # [x,y,z,values]   -> [z,y,x,values]   for 3D
             # [x,y,values]     -> [y,x,values]     for 2D
             # [x,values]       -> [x,values]       for 1D
-            if (self.data.ndim == 2):
-                pass # do nothin for 1D
-            inds = range(self.data.ndim)       # indices for dimension [0,1,2] etc
+            inds = list(range(self.data.ndim))       # indices for dimension [0,1,2] etc
             # keep the last value the same but reverse all indices before then
             inds[:(self.data.ndim - 1)] = reversed(inds[:(self.data.ndim - 1)])
             datal = _np.transpose(self.data, inds)
         else:
             datal = self.data
 
-        datal = datal.reshape(-1,nvalues)
-        for value in datal:
-            if self.doublePrecision:
-                strings   = map(lambda x: '%.16E' % x, value)
-                stringsFW = map(lambda s: '%23s' % s,  strings)
-            else:
-                strings   = map(lambda x: '%.8E' % x, value)
-                stringsFW = map(lambda s: '%14s' % s, strings)
-            f.write('\t'.join(stringsFW) + '\n')
-
-        f.close()
+        rows = datal.reshape(-1,nvalues)
+        with _Open(fileName, 'wb') as f:
+            for key,value in self.header.items():
+                f.write((str(key)+'> '+ str(value) + '\n').encode())
+            # a '!' denotes the column header line
+            f.write(('! '+ '\t'.join(colStrings)+'\n').encode())
+            for start in range(0, len(rows), chunkSize):
+                f.write(EncodeRows(rows[start:start + chunkSize], nDecimals))
 
 
 class Field1D(Field):
@@ -1,69 +1,154 @@
+import gzip as _gzip
+import os as _os
 import numpy as _np
 import tarfile as _tarfile
 
-def Load(filename, debug=False):
-    """
-    Load a BDSIM field format file into a numpy array. Can either
-    be a regular ascii text file or can be a compressed file ending
-    in ".tar.gz".
+# Number of bytes of text parsed at once (bounds the memory used by the text decoding)
+CHUNK_BYTES = 1 << 24
+CACHE_EXTENSION = '.npz'
+CACHE_VERSION = 1
 
-    returns a numpy array with the corresponding number of dimensions
-    and the dimension has the coordaintes and fx,fy,fz.
-    """
-    if (filename.endswith('.tar.gz')):
-        print('Field Loader> loading compressed file ' + filename)
+
+def _Open(filename):
+    if filename.endswith('.tar.gz'):
         tar = _tarfile.open(filename,'r')
-        f = tar.extractfile(tar.firstmember)
+        return tar.extractfile(tar.firstmember)
+    elif filename.endswith('.gz'):
+        return _gzip.open(filename, 'rb')
     else:
-        print('Field Loader> loading file ' + filename)
-        f = open(filename)
+        return open(filename, 'rb')
 
-    intoData = False
-    header   = {}
-    columns  = []
-    data     = []
-    
-    for line in f:
-        if intoData:
-            data.append(line.strip().split())
 
-        elif '>' in line:
+def _Signature(filename):
+    stat = _os.stat(filename)
+    return _np.array([stat.st_mtime_ns, stat.st_size, CACHE_VERSION], dtype=_np.int64)
+
+
+def _ReadCache(filename):
+    cacheName = filename + CACHE_EXTENSION
+    if not _os.path.exists(cacheName):
+        return None
+    try:
+        with _np.load(cacheName) as cache:
+            if not _np.array_equal(cache['signature'], _Signature(filename)):
+                return None
+            return cache['data']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _WriteCache(filename, data):
+    cacheName = filename + CACHE_EXTENSION
+    tmp = cacheName + '.' + str(_os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as f:
+        _np.savez(f, data=data, signature=_Signature(filename))
+    _os.replace(tmp, cacheName)
+
+
+def _ReadHeader(f):
+    header  = {}
+    columns = []
+    for line in f:
+        line = line.decode()
+        if '>' in line:
             d = line.strip().split('>')
             k = d[0].strip()
             v = float(d[1].strip())
             header[k] = v
-
         elif '!' in line:
-            columns = line.strip('!').strip().split()
-            intoData = True
+            columns = line.strip().strip('!').strip().split()
+            break
+    return header, columns
 
-    f.close()
 
-    data = _np.array(data, dtype=float)
+def _ReadValues(f, out, chunkBytes=CHUNK_BYTES):
+    """
+    Parse the whitespace separated numbers of a file into a preallocated
+    flat array, by chunks of text. Returns the number of values read.
+    """
+    n = 0
+    rest = b''
+    while True:
+        block = f.read(chunkBytes)
+        if not block:
+            text = rest
+        else:
+            text = rest + block
+            end = text.rfind(b'\n') + 1
+            if end == 0:
+                rest = text
+                continue
+            text, rest = text[:end], text[end:]
+        values = _np.fromstring(text, dtype=float, sep=' ') if text.strip() else _np.zeros(0)
+        if n + len(values) > len(out):
+            raise ValueError('More values in the field map than declared in its header.')
+        out[n:n + len(values)] = values
+        n += len(values)
+        if not block:
+            return n
 
-    nDim = len(columns) - 3
-    if (nDim < 1 or nDim > 4):
-        if debug:
-            print('Invalid number of columns')
-            print(columns)
-        return
 
-    required = ['nx','ny','nz','nt']
+def Load(filename, debug=False, cache=False, chunkBytes=CHUNK_BYTES):
+    """
+    Load a BDSIM field format file into a numpy array. Can either
+    be a regular ascii text file or can be a compressed file ending
+    in ".tar.gz" or ".gz".
 
-    requiredKeys    = required[:nDim]
-    requiredKeysSet = set(requiredKeys)
-    if not requiredKeysSet.issubset(header.keys()):
-        print('missing keys from header!')
-        if debug:
-            print(header)
-        return
+    returns a numpy array with the corresponding number of dimensions
+    and the dimension has the coordaintes and fx,fy,fz.
+
+    The values are parsed by chunks of text (chunkBytes) directly into
+    the output array. With cache=True, a binary copy of the array is stored
+    next to the file (filename.npz) and reused as long as the file is
+    unchanged (same modification time and size).
+    """
+    if cache:
+        data = _ReadCache(filename)
+        if data is not None:
+            if debug:
+                print('Field Loader> using cached copy of ' + filename)
+            return data
+
+    if (filename.endswith('.gz')):
+        print('Field Loader> loading compressed file ' + filename)
     else:
+        print('Field Loader> loading file ' + filename)
+
+    f = _Open(filename)
+    try:
+        header, columns = _ReadHeader(f)
+
+        nDim = len(columns) - 3
+        if (nDim < 1 or nDim > 4):
+            if debug:
+                print('Invalid number of columns')
+                print(columns)
+            return
+
+        required = ['nx','ny','nz','nt']
+
+        requiredKeys    = required[:nDim]
+        requiredKeysSet = set(requiredKeys)
+        if not requiredKeysSet.issubset(header.keys()):
+            print('missing keys from header!')
+            if debug:
+                print(header)
+            return
+
         dims = [int(header[k]) for k in requiredKeys[::-1]]
         dims.append(len(columns))
         if debug:
             print(dims)
             print(nDim)
-            print(_np.shape(data))
-        data = data.reshape(*dims)
+        data = _np.empty(int(_np.prod(dims)))
+        n = _ReadValues(f, data, chunkBytes)
+    finally:
+        f.close()
 
+    if n != len(data):
+        raise ValueError('The number of values of the field map (' + str(n) +
+                         ') does not match its header (' + str(len(data)) + ').')
+    data = data.reshape(*dims)
+    if cache:
+        _WriteCache(filename, data)
     return data
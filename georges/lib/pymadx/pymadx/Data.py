@@ -92,7 +92,13 @@ class Tfs(object):
 
         Read the tfs file and prepare data structures. If 'tar' or 'gz are in
         the filename, the file will be opened still compressed.
+
+        Plain (non segmented) files are read with the vectorised reader of
+        georges.madx.tfs when it is available.
         """
+        if ('tar' not in filename) and ('gz' not in filename) and self._LoadFast(filename, verbose):
+            self._PostProcess()
+            return
         if ('tar' in filename) or ('gz' in filename):
             print('pymadx.Tfs.Load> zipped file')
             tar = tarfile.open(filename,'r')
@@ -179,7 +185,62 @@ class Tfs(object):
                 self.nitems += 1           # keep tally of number of items
 
         f.close()
+        self._PostProcess()
+
+    def _LoadFast(self, filename, verbose=False):
+        """
+        Read the tfs file in a single pass with georges.madx.tfs. Returns False
+        if that reader is not available or can't read the file (e.g. a file
+        with segments), in which case the line by line parser is used.
+        """
+        try:
+            from georges.madx.tfs import read_tfs, TfsException
+        except ImportError:
+            return False
+        try:
+            df, header, formats = read_tfs(filename, index=None, with_header=True)
+        except TfsException:
+            return False
 
+        # numbers are floats as with _Cast in the line by line parser
+        numeric = [c for c, fmt in zip(df.columns, formats) if not fmt.endswith('s')]
+        if len(numeric) > 0:
+            df[numeric] = df[numeric].astype(float)
+
+        for key, value in header.items():
+            self.header[key] = float(value) if type(value) == int else value
+        self.columns.extend(["SEGMENT", "SEGMENTNAME"])
+        self.formats.extend(["%d", "%s"])
+        self.columns.extend(list(df.columns))
+        self.formats.extend(formats)
+        if verbose:
+            print('Columns will be:')
+            print(self.columns)
+
+        rows = df.values.tolist()
+        if 'NAME' in df.columns:
+            # same mangling as _CheckName, without rescanning the suffixes
+            # already used for each degenerate name
+            names = []
+            suffixes = {}
+            for name in df['NAME'].values:
+                if name in self.data:
+                    i = suffixes.get(name, 1)
+                    while name + '_' + str(i) in self.data:
+                        i = i + 1
+                    suffixes[name] = i
+                    name = name + '_' + str(i)
+                self.data[name] = None
+                names.append(name)
+        else:
+            names = list(range(len(rows)))
+        for name, row in zip(names, rows):
+            self.data[name] = [0, 'NA'] + row
+        self.sequence = names
+        self.nitems = len(rows)
+        return True
+
+    def _PostProcess(self):
         #additional processing
         self.index = range(0,len(self.data),1)
         if 'S' in self.columns:
@@ -212,7 +273,7 @@ class Tfs(object):
             self.columns.append('APERTYPE')
             self.formats.append('%s')
 
-            for key, element in self.data.iteritems():
+            for key, element in self.data.items():
                 aper1 = element[self.columns.index('APER_1')]
                 aper2 = element[self.columns.index('APER_2')]
                 aper3 = element[self.columns.index('APER_3')]
@@ -426,11 +487,11 @@ class Tfs(object):
             raise ValueError("argument not an index or a slice")
 
     def _CheckName(self,name):
-        if self.data.has_key(name):
+        if name in self.data:
             #name already exists - boo degenerate names!
             i = 1
             basename = name
-            while self.data.has_key(name):
+            while name in self.data:
                 name = basename+'_'+str(i)
                 i = i + 1
             return name
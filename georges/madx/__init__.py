@@ -1,8 +1,10 @@
 from .madx import Madx
 from .twiss import twiss
 from .twiss import read_madx_twiss, read_ptc_twiss
+from .tfs import read_tfs, iter_tfs, read_tfs_header, TfsException
 from .tracking import track
-from .tracking import read_tracking
+from .tracking import read_tracking, TrackingFile
 from .match import match
 from .survey import survey
 from .sectormap import sectormap
+from .session import MadxSession
@@ -1,5 +1,4 @@
-import re
-import subprocess as sub
+import shlex
 
 import jinja2
 import numpy as np
@@ -246,6 +245,7 @@ class Madx(Simulator):
     """
 
     EXECUTABLE_NAME = 'madx'
+    PROGRESS_PATTERN = r'^\s*enter .* module'
 
     def __init__(self, beamlines=None, path=None, **kwargs):
         self._ptc_use_knl_only = kwargs.get('ptc_use_knl_only', False)
@@ -265,8 +265,8 @@ class Madx(Simulator):
                                        ptc_use_knl_only=self._ptc_use_knl_only
                                        )
 
-    def run(self, **kwargs):
-        """Run madx as a subprocess."""
+    def _prepare_run(self, **kwargs):
+        """Prepare a madx run (in the working directory given by the `cwd` keyword argument, default to '.')."""
 
         # Finalize the input template
         self._input += self._syntax['stop']
@@ -274,28 +274,13 @@ class Madx(Simulator):
         if kwargs.get("debug", False) >= 2:
             print(template_input)
 
-        # Run subprocess
         if self._get_exec() is None:
             raise MadxException("Can't run MADX if no valid path and executable are defined.")
-        p = sub.Popen([self._get_exec()],
-                      stdin=sub.PIPE,
-                      stdout=sub.PIPE,
-                      stderr=sub.STDOUT,
-                      cwd=".",
-                      shell=True
-                      )
-
-        # Feed with input data
-        self._output = p.communicate(input=template_input.encode())[0].decode()
-
-        # Decode output
-        self._warnings = [line for line in self._output.split('\n') if re.search('warning|fatal', line)]
-        self._fatals = [line for line in self._output.split('\n') if re.search('fatal', line)]
-        self._last_context = kwargs.get("context", {})
-        if kwargs.get('debug', False):
-            print(self._output)
-
-        return self
+        return {
+            'cmd': shlex.quote(self._get_exec()),
+            'input': template_input.encode(),
+            'cwd': kwargs.get('cwd', '.'),
+        }
 
     def raw(self, raw):
         """Add a raw MAD-X command to the input."""
@@ -412,7 +397,7 @@ class Madx(Simulator):
         # self.raw("SELECT, FLAG=sectormap, range='P2E';")
         options = ""
         for k, v in kwargs.items():
-            if k not in ['ptc', 'start', 'line', 'ptc_params', 'context', 'debug', 'periodic']:
+            if k not in ['ptc', 'start', 'line', 'ptc_params', 'context', 'debug', 'periodic', 'cwd', 'cache']:
                 options += ",%s=%s" % (k, v)
         if kwargs.get('periodic', False):
             self._add_input('twiss', kwargs.get('file', 'twiss.outx'), options)
@@ -15,6 +15,8 @@ class MatchException(Exception):
 
 def match(**kwargs):
     """Interface to the MAD-X matchnig module.
+
+    A SimulatorCache can be provided with the `cache` keyword argument.
     """
     # Process arguments
     line = kwargs.get('line', None)
@@ -32,7 +34,8 @@ def match(**kwargs):
             ptc=kwargs.get('ptc', False),
             ptc_params=kwargs.get('ptc_params', {})
             )
-    errors = m.run(**kwargs).fatals
+    m.run_cached(lambda cwd: None, **kwargs)
+    errors = m.fatals
     if kwargs.get("debug", False):
         print(m.input)
     if len(errors) > 0:
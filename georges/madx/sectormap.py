@@ -2,9 +2,7 @@ import os
 import pandas as pd
 from .. import beamline
 from .madx import Madx
-
-MADX_SECTORMAP_HEADERS_SKIP_ROWS = 6
-MADX_SECTORMAP_DATA_SKIP_ROWS = 8
+from .tfs import read_tfs
 
 
 class SectormapException(Exception):
@@ -16,17 +14,7 @@ class SectormapException(Exception):
 
 def read_madx_sectormap(file) -> pd.DataFrame:
     """Read a MAD-X Sectormap TFS file to a dataframe."""
-    headers = pd.read_csv(file, skiprows=MADX_SECTORMAP_HEADERS_SKIP_ROWS, nrows=0, delim_whitespace=True)
-    headers.drop(headers.columns[[0, 1]], inplace=True, axis=1)
-    df = pd.read_csv(file,
-                     header=None,
-                     names=headers.columns.values,
-                     na_filter=False,
-                     skiprows=MADX_SECTORMAP_DATA_SKIP_ROWS,
-                     delim_whitespace=True
-                     )
-    df.index.name = 'NAME'
-    return df
+    return read_tfs(file, index='NAME')
 
 
 def sectormap(**kwargs):
@@ -37,6 +25,7 @@ def sectormap(**kwargs):
         - periodic: ring (True) or beamline (False)
         - start: RANGE at which the twiss/sectormap shoudl start
         - places: where to extract the sector map from
+        - cache: a SimulatorCache (optional)
     """
     # Process arguments
     line = kwargs.get('line', None)
@@ -51,13 +40,14 @@ def sectormap(**kwargs):
                 sectoracc=kwargs.get("sectoracc", False),
                 reflect=kwargs.get("reflect", False),
                 )
-    errors = m.run(**kwargs).fatals
+    madx_sectormap = m.run_cached(lambda cwd: read_madx_sectormap(os.path.join(cwd, 'sectormap')), **kwargs)
+    errors = m.fatals
     if kwargs.get("debug", False):
         print(m.input)
     if len(errors) > 0:
         print(errors)
         raise SectormapException("MAD-X ended with fatal error.")
-    madx_sectormap = read_madx_sectormap(os.path.join(".", 'sectormap')).rename(columns={'POS': 'S'})
+    madx_sectormap = madx_sectormap.rename(columns={'POS': 'S'})
     line_with_sectormap = madx_sectormap.merge(line.line,
                                                left_index=True,
                                                right_index=True,
@@ -0,0 +1,279 @@
+import os
+import re
+import queue
+import tempfile
+import threading
+import itertools
+import subprocess as sub
+from typing import Optional, Dict, List
+
+import jinja2
+import pandas as pd
+
+from .. import beamline
+from .grammar import madx_syntax
+from .madx import Madx, sequence_to_mad, MAD_DEFAULT_TWISS_COLUMNS
+from .twiss import read_madx_twiss
+from .sectormap import read_madx_sectormap
+
+SESSION_SENTINEL = 'GEORGES_MADX_SESSION'
+SESSION_DEFAULT_TIMEOUT = 60.0
+
+
+class MadxSessionException(Exception):
+    """Exception raised for errors in the MadxSession module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+class MadxSession:
+    """A long-lived MAD-X process.
+
+    The sequence (and the beam) is sent once, when the session starts. Each subsequent computation only sends the
+    variables of the context that changed since the previous one (as `NAME = VALUE;` assignments) followed by the
+    commands; the end of each block of commands is detected with a sentinel printed by MAD-X. The results are written
+    in uniquely named TFS files in the working directory of the session.
+
+    Example:
+        with MadxSession(line, context=context) as s:
+            for k1 in np.linspace(-2.0, 2.0, 200):
+                results.append(s.twiss(context={**context, 'B1G': k1}))
+    """
+
+    def __init__(self,
+                 line,
+                 context: Optional[Dict] = None,
+                 path: Optional[str] = None,
+                 workdir: Optional[str] = None,
+                 timeout: float = SESSION_DEFAULT_TIMEOUT,
+                 keep_files: bool = False,
+                 **kwargs):
+        """
+        :param line: the beamline loaded in the session
+        :param context: the initial context (used to render the sequence and the beam)
+        :param path: path to the MAD-X executable (default: lookup using 'which')
+        :param workdir: working directory of the MAD-X process (default: a new temporary directory)
+        :param timeout: maximum time (in seconds) to wait for the completion of a block of commands
+        :param keep_files: keep the TFS files produced by each computation
+        :param kwargs: parameters passed to the Madx sequence generation (e.g. `ptc_use_knl_only`)
+        """
+        self._line = line
+        self._context = dict(context or {})
+        self._sent_context = {}
+        self._madx = Madx(beamlines=[], path=path, **kwargs)
+        self._workdir = workdir or tempfile.mkdtemp(prefix='georges_madx_')
+        self._timeout = timeout
+        self._keep_files = keep_files
+        self._process = None
+        self._lines = None
+        self._reader = None
+        self._counter = itertools.count()
+        self._output = []
+        self._warnings = []
+        self._fatals = []
+        self._ptc_use_knl_only = kwargs.get('ptc_use_knl_only', False)
+        self._optional_markers = kwargs.get('optional_markers', True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def workdir(self) -> str:
+        """Return the working directory of the MAD-X process."""
+        return self._workdir
+
+    @property
+    def warnings(self) -> List[str]:
+        """Return the warnings of the last block of commands."""
+        return self._warnings
+
+    @property
+    def fatals(self) -> List[str]:
+        """Return the fatal errors of the last block of commands."""
+        return self._fatals
+
+    @property
+    def output(self) -> str:
+        """Return the output of the last block of commands."""
+        return '\n'.join(self._output)
+
+    @property
+    def running(self) -> bool:
+        """Return True if the MAD-X process is alive."""
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start the MAD-X process and load the sequence."""
+        if self.running:
+            return self
+        if self._madx.executable is None:
+            raise MadxSessionException("Can't run MADX if no valid path and executable are defined.")
+        self._process = sub.Popen([self._madx.executable],
+                                  stdin=sub.PIPE,
+                                  stdout=sub.PIPE,
+                                  stderr=sub.STDOUT,
+                                  cwd=self._workdir,
+                                  universal_newlines=True,
+                                  bufsize=1,
+                                  )
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self.__read_output, daemon=True)
+        self._reader.start()
+        line = self._line.line.copy()
+        line.name = self._line.name
+        line.length = self._line.length
+        if self._context.get('BRHO'):
+            line['BRHO'] = self._context['BRHO']
+        commands = "OPTION, -ECHO, -INFO;\n"
+        commands += sequence_to_mad(line,
+                                    optional_marker=self._optional_markers,
+                                    ptc_use_knl_only=self._ptc_use_knl_only
+                                    )
+        commands += madx_syntax['beam'].format() + '\n'
+        commands += madx_syntax['use_sequence'].format(self._line.name) + '\n'
+        commands += '\n'.join(
+            [madx_syntax['select_columns'].format('twiss', c) for c in MAD_DEFAULT_TWISS_COLUMNS]
+        ) + '\n'
+        self._sent_context = dict(self._context)
+        self.__execute(jinja2.Template(commands).render(self._context))
+        return self
+
+    def close(self):
+        """Terminate the MAD-X process."""
+        if self._process is None:
+            return
+        try:
+            if self.running:
+                self._process.stdin.write(madx_syntax['stop'] + '\n')
+                self._process.stdin.close()
+            self._process.wait(timeout=self._timeout)
+        except (sub.TimeoutExpired, BrokenPipeError, OSError):
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    def __read_output(self):
+        for line in self._process.stdout:
+            self._lines.put(line.rstrip('\n'))
+        self._lines.put(None)
+
+    def __execute(self, commands: str) -> str:
+        """Send a block of commands and wait for its completion."""
+        if not self.running:
+            raise MadxSessionException("The MAD-X session is not running.")
+        sentinel = f"{SESSION_SENTINEL}_{next(self._counter)}"
+        if not commands.endswith('\n'):
+            commands += '\n'
+        try:
+            self._process.stdin.write(commands)
+            self._process.stdin.write(f'PRINT, TEXT="{sentinel}";\n')
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            raise MadxSessionException("The MAD-X process terminated unexpectedly.")
+        self._output = []
+        while True:
+            try:
+                line = self._lines.get(timeout=self._timeout)
+            except queue.Empty:
+                self.close()
+                raise MadxSessionException("Timeout while waiting for MAD-X.")
+            if line is None:
+                self.__decode_output()
+                raise MadxSessionException("The MAD-X process terminated unexpectedly:\n" + '\n'.join(self._fatals))
+            if line.strip() == sentinel:
+                break
+            self._output.append(line)
+        self.__decode_output()
+        if len(self._fatals) > 0:
+            raise MadxSessionException("MAD-X ended with fatal error:\n" + '\n'.join(self._fatals))
+        return self.output
+
+    def __decode_output(self):
+        self._warnings = [line for line in self._output if re.search('warning|fatal', line)]
+        self._fatals = [line for line in self._output if re.search('fatal', line)]
+
+    def update(self, context: Optional[Dict] = None):
+        """Send the variables of the context which changed since the last update."""
+        if context is not None:
+            self._context = dict(context)
+        if not self.running:
+            self.start()
+        changes = {k: v for k, v in self._context.items()
+                   if isinstance(v, (int, float)) and not isinstance(v, bool) and self._sent_context.get(k) != v}
+        if len(changes) == 0:
+            return self
+        self.__execute(''.join([f"{k} = {v};\n" for k, v in changes.items()]))
+        self._sent_context.update(changes)
+        return self
+
+    def execute(self, commands: str, context: Optional[Dict] = None) -> str:
+        """
+        Execute raw MAD-X commands (rendered with the context) in the session.
+        :param commands: MAD-X commands (templates are rendered with the context)
+        :param context: the context (only the changed variables are sent)
+        :return: the output of MAD-X for these commands
+        """
+        self.update(context)
+        return self.__execute(jinja2.Template(commands).render(self._context))
+
+    def __result_file(self, prefix: str) -> str:
+        return f"{prefix}_{os.getpid()}_{next(self._counter)}.tfs"
+
+    def __read(self, filename: str, reader) -> pd.DataFrame:
+        path = os.path.join(self._workdir, filename)
+        try:
+            return reader(path)
+        finally:
+            if not self._keep_files and os.path.exists(path):
+                os.remove(path)
+
+    def twiss(self, context: Optional[Dict] = None, periodic: bool = False, **kwargs):
+        """
+        Compute the Twiss parameters of the beamline (see `madx.twiss`).
+        :param context: the context (only the changed variables are sent)
+        :param periodic: ring (True) or beamline (False)
+        :param kwargs: additional options of the MAD-X `twiss` command
+        :return: a Beamline with the Twiss parameters
+        """
+        filename = self.__result_file('twiss')
+        options = ''.join([f",{k}={v}" for k, v in kwargs.items()])
+        if periodic:
+            command = madx_syntax['twiss'].format(filename, options)
+        else:
+            command = madx_syntax['twiss_beamline'].format(filename, False, options)
+        self.execute(command, context)
+        madx_twiss = self.__read(filename, read_madx_twiss)
+        return beamline.Beamline(madx_twiss.merge(self._line.line,
+                                                  left_index=True,
+                                                  right_index=True,
+                                                  how='outer',
+                                                  suffixes=('_TWISS', '')
+                                                  ).sort_values(by='S'))
+
+    def sectormap(self, places: List[str], context: Optional[Dict] = None, **kwargs):
+        """
+        Compute the transfer matrices of the beamline (see `madx.sectormap`).
+        :param places: where to extract the sector map from
+        :param context: the context (only the changed variables are sent)
+        :param kwargs: additional options of the MAD-X `twiss` command
+        :return: a Beamline with the sector maps
+        """
+        filename = self.__result_file('twiss')
+        sectorfile = self.__result_file('sectormap')
+        commands = "SELECT, FLAG=sectormap, CLEAR;\n"
+        commands += ''.join([f"SELECT, FLAG=sectormap, range='{p}';\n" for p in places])
+        options = f",SECTORFILE={sectorfile}" + ''.join([f",{k}={v}" for k, v in kwargs.items()])
+        commands += madx_syntax['twiss_beamline'].format(filename, True, options)
+        self.execute(commands, context)
+        self.__read(filename, lambda f: None)
+        madx_sectormap = self.__read(sectorfile, read_madx_sectormap).rename(columns={'POS': 'S'})
+        return beamline.Beamline(madx_sectormap.merge(self._line.line,
+                                                      left_index=True,
+                                                      right_index=True,
+                                                      how='outer',
+                                                      suffixes=('_SECTORMAP', '')
+                                                      ).sort_values(by='S'))
@@ -2,9 +2,7 @@ import os
 import pandas as pd
 from .. import beamline
 from .madx import Madx
-
-MADX_SURVEY_HEADERS_SKIP_ROWS = 6
-MADX_SURVEY_DATA_SKIP_ROWS = 8
+from .tfs import read_tfs
 
 
 class SurveyException(Exception):
@@ -16,15 +14,7 @@ class SurveyException(Exception):
 
 def read_survey(file):
     """Read a MAD-X survey file to a datraframe"""
-    headers = pd.read_csv(file, skiprows=MADX_SURVEY_HEADERS_SKIP_ROWS, nrows=0, delim_whitespace=True)
-    headers.drop(headers.columns[[0, 1]], inplace=True, axis=1)
-    return pd.read_csv(file,
-                       header=None,
-                       names=headers.columns.values,
-                       na_filter=False,
-                       delim_whitespace=True,
-                       skiprows=MADX_SURVEY_DATA_SKIP_ROWS
-                       )
+    return read_tfs(file, index='NAME')
 
 
 def survey(**kwargs):
@@ -42,7 +32,7 @@ def survey(**kwargs):
     if len(errors) > 0:
         print(errors)
         raise SurveyException("MAD-X ended with fatal error.")
-    madx_survey = read_survey(os.path.join(".", 'survey.out'))
+    madx_survey = read_survey(os.path.join(kwargs.get('cwd', '.'), 'survey.out'))
     line_with_survey = madx_survey.merge(line.line,
                                          left_index=True,
                                          right_index=True,
@@ -0,0 +1,202 @@
+"""Reader for the TFS (Table File System) files produced by MAD-X and PTC.
+
+The header (`@` lines), the column names (`*` line) and the column formats (`$` line) are detected while reading the
+beginning of the file; the data block is then parsed in a single pass by the pandas C parser with the column types
+derived from the formats. Files ending with `.gz` are decompressed on the fly.
+"""
+from typing import Optional, Dict, List, Tuple, Iterator
+import os
+import gzip
+import pickle
+import numpy as np
+import pandas as pd
+
+TFS_SIDECAR_EXTENSION = '.pkl'
+TFS_SIDECAR_VERSION = 1
+
+
+class TfsException(Exception):
+    """Exception raised for errors in the Tfs module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def _open(filename: str):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename)
+
+
+def _cast(fmt: str, value: str):
+    """Cast a header value according to its TFS format."""
+    value = value.strip()
+    if fmt.endswith('s'):
+        return value.strip('"')
+    try:
+        if fmt.endswith('d'):
+            return int(value)
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _dtype(fmt: str):
+    """Return the numpy type of a column from its TFS format."""
+    if fmt.endswith('s'):
+        return object
+    if fmt.endswith('d'):
+        return np.int64
+    return np.float64
+
+
+def read_tfs_header(f) -> Tuple[Dict, List[str], List[str]]:
+    """
+    Read the header of a TFS file; the file is left positioned at the beginning of the data block.
+    :param f: an open (text) TFS file
+    :return: a tuple with the header dictionary, the column names and the column formats
+    """
+    header = {}
+    columns = []
+    formats = []
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        if not line.strip():
+            continue
+        if line[0] == '@':
+            items = line.split(None, 3)
+            if len(items) < 3:
+                raise TfsException(f"Invalid TFS header line: '{line.strip()}'.")
+            header[items[1]] = _cast(items[2], items[3] if len(items) > 3 else '')
+        elif line[0] == '*':
+            columns = line.split()[1:]
+        elif line[0] == '$':
+            formats = line.split()[1:]
+            break
+        else:
+            raise TfsException(f"Unexpected line in the TFS header: '{line.strip()}'.")
+    if len(columns) == 0:
+        raise TfsException("No column names ('*' line) found in the TFS file.")
+    if len(formats) != len(columns):
+        raise TfsException("The numbers of column names and column formats of the TFS file do not match.")
+    return header, columns, formats
+
+
+def _read_options(columns: List[str], formats: List[str], usecols: Optional[List[str]]) -> Dict:
+    return {
+        'header': None,
+        'names': columns,
+        'usecols': usecols,
+        'dtype': {c: _dtype(f) for c, f in zip(columns, formats)},
+        'delim_whitespace': True,
+        'na_filter': False,
+        'quotechar': '"',
+        'engine': 'c',
+    }
+
+
+def _check_data_block(f):
+    """Segmented files (`#segment` lines, e.g. PTC tracking) can't be parsed as a single block."""
+    position = f.tell()
+    line = f.readline()
+    f.seek(position)
+    if line.startswith('#'):
+        raise TfsException("Segmented TFS files are not supported by this reader.")
+
+
+def _finalize(df: pd.DataFrame, index: Optional[str]) -> pd.DataFrame:
+    if index is not None and index in df.columns:
+        df = df.set_index(index)
+    return df
+
+
+def _sidecar_signature(filename: str) -> Tuple[int, int]:
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read_sidecar(filename: str):
+    sidecar = filename + TFS_SIDECAR_EXTENSION
+    if not os.path.exists(sidecar):
+        return None
+    try:
+        with open(sidecar, 'rb') as f:
+            entry = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if entry.get('version') != TFS_SIDECAR_VERSION or entry.get('signature') != _sidecar_signature(filename):
+        return None
+    return entry
+
+
+def _write_sidecar(filename: str, header: Dict, columns: List[str], formats: List[str], data: pd.DataFrame):
+    sidecar = filename + TFS_SIDECAR_EXTENSION
+    tmp = f"{sidecar}.{os.getpid()}.tmp"
+    entry = {
+        'version': TFS_SIDECAR_VERSION,
+        'signature': _sidecar_signature(filename),
+        'header': header,
+        'columns': columns,
+        'formats': formats,
+        'data': data,
+    }
+    with open(tmp, 'wb') as f:
+        pickle.dump(entry, f, protocol=4)
+    os.replace(tmp, sidecar)
+
+
+def read_tfs(filename: str,
+             index: Optional[str] = 'NAME',
+             columns: Optional[List[str]] = None,
+             with_header: bool = False,
+             cache: bool = False):
+    """
+    Read a TFS file to a dataframe.
+    :param filename: path to the TFS file (gzipped if the name ends with '.gz')
+    :param index: column used as the index of the dataframe (None to keep a range index)
+    :param columns: subset of the columns to read (all the columns by default)
+    :param with_header: also return the header dictionary and the column formats
+    :param cache: store (and reuse) a binary copy of the parsed file next to it (`filename.pkl`); the copy is
+    invalidated when the modification time or the size of the TFS file change
+    :return: the dataframe, or a tuple (dataframe, header, formats) if with_header is True
+    """
+    entry = _read_sidecar(filename) if cache else None
+    if entry is not None:
+        header, names, formats, df = entry['header'], entry['columns'], entry['formats'], entry['data']
+    else:
+        with _open(filename) as f:
+            header, names, formats = read_tfs_header(f)
+            _check_data_block(f)
+            df = pd.read_csv(f, **_read_options(names, formats, None))
+        if cache:
+            _write_sidecar(filename, header, names, formats, df)
+    if columns is not None:
+        keep = [c for c in names if c in columns or c == index]
+        formats = [f for c, f in zip(names, formats) if c in keep]
+        df = df[keep]
+    df = _finalize(df, index)
+    if with_header:
+        return df, header, formats
+    return df
+
+
+def iter_tfs(filename: str,
+             chunksize: int = 100000,
+             index: Optional[str] = 'NAME',
+             columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read a TFS file by chunks of rows (for files which do not fit in memory).
+    :param filename: path to the TFS file (gzipped if the name ends with '.gz')
+    :param chunksize: number of rows of each chunk
+    :param index: column used as the index of the dataframes (None to keep a range index)
+    :param columns: subset of the columns to read (all the columns by default)
+    :return: an iterator over the dataframes
+    """
+    with _open(filename) as f:
+        _, names, formats = read_tfs_header(f)
+        _check_data_block(f)
+        usecols = None if columns is None else [c for c in names if c in columns or c == index]
+        for chunk in pd.read_csv(f, chunksize=chunksize, **_read_options(names, formats, usecols)):
+            yield _finalize(chunk, index)
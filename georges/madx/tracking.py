@@ -1,11 +1,17 @@
-import os, re, io
+import os, re
+from typing import Optional, List
+import numpy as np
 import pandas as pd
 from .. import beamline
 from .. import beam
 from .madx import Madx
+from .tfs import read_tfs_header, TfsException
 
 MADX_TRACKING_SKIP_ROWS = 54
 PTC_TRACKING_SKIP_ROWS = 9
+TRACKING_COLUMNS = ['NUMBER', 'TURN', 'X', 'PX', 'Y', 'PY', 'T', 'PT', 'S', 'E']
+TRACKING_SEGMENT_REGEX = re.compile(r"^#segment\s[\d\s]*\s(.*)$")
+TRACKING_SCAN_BLOCK_SIZE = 1 << 24
 
 
 class TrackException(Exception):
@@ -15,33 +21,145 @@ class TrackException(Exception):
         self.message = m
 
 
-def read_tracking(file):
-    """Read a PTC Tracking 'one' file to a dataframe."""
-
-    def process_data_lines(lines):
-        return pd.read_csv(io.StringIO("\n".join(lines)),
-                           names=['NUMBER', 'TURN', 'X', 'PX', 'Y', 'PY', 'T', 'PT', 'S', 'E'],
-                           delim_whitespace=True)
-
-    regex_header = re.compile("^#segment\s[\d\s]*\s(.*)$")
-    data = {}
-    collect_particles = False
-    location = None
-    for line in open(file):
-        if line.startswith("#segment"):
-            if collect_particles:
-                # Process previous data collection before moving on to the next
-                data[location] = process_data_lines(tmp)
-            location = re.findall(regex_header, line)[0].strip()
-            tmp = []
-            collect_particles = True
-        elif collect_particles:
-            tmp.append(line) if tmp is not None else None
-    if collect_particles:
-        # Process previous data collection
-        data[location] = process_data_lines(tmp)
+class TrackingFile:
+    """Indexed access to a PTC/MAD-X tracking 'one' file.
+
+    The file is scanned once (by blocks of bytes) to locate the `#segment` lines; the index gives, for each segment,
+    the observation point, the offset of its data in the file and its number of rows. The data of selected observation
+    points can then be read lazily, or the whole numeric body can be parsed in a single call and split by segment.
+
+    Example:
+        t = TrackingFile('ptctrackone.tfs')
+        t.locations
+        t['QUAD1']  # reads only the segments of QUAD1
+    """
+
+    def __init__(self, file: str, block_size: int = TRACKING_SCAN_BLOCK_SIZE):
+        """
+        :param file: path to the tracking file
+        :param block_size: size (in bytes) of the blocks read while building the index
+        """
+        self._file = file
+        self._columns = TRACKING_COLUMNS
+        self._segments = self.__scan(block_size)
+
+    @property
+    def columns(self) -> List[str]:
+        """Return the names of the columns of the tracking data."""
+        return self._columns
+
+    @property
+    def segments(self) -> pd.DataFrame:
+        """Return the index of the segments (LOCATION, OFFSET of the data and number of ROWS)."""
+        return self._segments
+
+    @property
+    def locations(self) -> List[str]:
+        """Return the observation points (in the order of their first appearance in the file)."""
+        return list(dict.fromkeys(self._segments['LOCATION']))
+
+    def __scan(self, block_size: int) -> pd.DataFrame:
+        with open(self._file) as f:
+            try:
+                _, self._columns, _ = read_tfs_header(f)
+            except TfsException:
+                self._columns = TRACKING_COLUMNS
+        hash_offsets = []
+        hash_lines = []
+        line_number = 0
+        offset = 0
+        carry = True
+        with open(self._file, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                a = np.frombuffer(block, dtype=np.uint8)
+                starts = np.flatnonzero(a == ord('\n')) + 1
+                if carry:
+                    starts = np.concatenate([[0], starts])
+                carry = len(starts) > 0 and starts[-1] == len(a)
+                if carry:
+                    starts = starts[:-1]
+                is_segment = a[starts] == ord('#')
+                hash_offsets.append(offset + starts[is_segment])
+                hash_lines.append(line_number + np.flatnonzero(is_segment))
+                line_number += len(starts)
+                offset += len(a)
+            hash_offsets = np.concatenate(hash_offsets or [np.zeros(0, dtype=int)])
+            hash_lines = np.concatenate(hash_lines or [np.zeros(0, dtype=int)])
+            locations = []
+            data_offsets = []
+            for o in hash_offsets:
+                f.seek(o)
+                header = f.readline()
+                data_offsets.append(o + len(header))
+                locations.append(re.findall(TRACKING_SEGMENT_REGEX, header.decode().rstrip())[0].strip().upper())
+        return pd.DataFrame({
+            'LOCATION': locations,
+            'OFFSET': np.array(data_offsets, dtype=np.int64),
+            'ROWS': np.diff(np.append(hash_lines, line_number)) - 1,
+        })
+
+    def read_segment(self, i: int) -> pd.DataFrame:
+        """
+        Read the data of a single segment.
+        :param i: the position of the segment in the index
+        :return: a dataframe with the tracking data
+        """
+        segment = self._segments.iloc[i]
+        with open(self._file, 'rb') as f:
+            f.seek(segment['OFFSET'])
+            return pd.read_csv(f, header=None, names=self._columns, nrows=segment['ROWS'], delim_whitespace=True)
+
+    def read(self, location: str) -> pd.DataFrame:
+        """
+        Read the data of an observation point (all its segments, e.g. all the turns).
+        :param location: the observation point
+        :return: a dataframe with the tracking data
+        """
+        segments = np.flatnonzero(self._segments['LOCATION'].values == location.upper())
+        if len(segments) == 0:
+            raise TrackException(f"No tracking data for '{location}'.")
+        frames = [self.read_segment(i) for i in segments]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def __getitem__(self, location: str) -> pd.DataFrame:
+        return self.read(location)
+
+    def read_all(self) -> List[pd.DataFrame]:
+        """
+        Parse the whole numeric body of the file in a single call.
+        :return: the list of the dataframes of the segments (in the order of the index)
+        """
+        if len(self._segments) == 0:
+            return []
+        with open(self._file, 'rb') as f:
+            f.seek(self._segments['OFFSET'].iloc[0])
+            data = pd.read_csv(f, header=None, names=self._columns, comment='#', delim_whitespace=True)
+        bounds = np.concatenate([[0], np.cumsum(self._segments['ROWS'].values)])
+        if bounds[-1] != len(data):
+            raise TrackException("The tracking file does not match its segment index.")
+        return [data.iloc[i:j].reset_index(drop=True) for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def read_tracking(file, locations: Optional[List[str]] = None):
+    """
+    Read a PTC Tracking 'one' file to a dataframe.
+    :param file: path to the tracking file
+    :param locations: observation points to load (default: all, parsed in a single pass)
+    :return: a dataframe of Beam objects (column BEAM) indexed by the observation points; when a location appears in
+    several segments (multiple turns) the last one is kept
+    """
+    t = TrackingFile(file)
+    if locations is None:
+        segments = dict(zip(t.segments['LOCATION'], t.read_all()))
+    else:
+        locations = [l.upper() for l in locations]
+        last = t.segments.reset_index().query("LOCATION in @locations").groupby('LOCATION', sort=False)['index'].last()
+        segments = {k: t.read_segment(i) for k, i in last.items()}
     df = pd.DataFrame.from_dict(
-        {k.upper(): beam.Beam(v[['X', 'PX', 'Y', 'PY', 'PT']]) for k, v in data.items()}, orient='index'
+        {k: beam.Beam(v[['X', 'PX', 'Y', 'PY', 'PT']]) for k, v in segments.items()}, orient='index'
     ).rename(columns={0: "BEAM"})
     df.index.name = 'NAME'
     return df
@@ -52,6 +170,7 @@ def track(line=None, beam=None, context=None, **kwargs):
     :param kwargs: parameters are:
         - line: the beamline on which twiss will be run
         - context: the associated context on which MAD-X is run
+        - cache: a SimulatorCache (optional)
     """
     # Process arguments
     if line is None or beam is None:
@@ -69,16 +188,20 @@ def track(line=None, beam=None, context=None, **kwargs):
             misalignment=kwargs.get('misalignment', False),
             start=kwargs.get('start', False)
             )
-    errors = m.run(context=context, **kwargs).fatals
+
+    def collect(cwd):
+        if kwargs.get('ptc', True):
+            return read_tracking(os.path.join(cwd, 'ptctrackone.tfs'))
+        else:
+            return read_tracking(os.path.join(cwd, 'tracking.outxone'))
+
+    madx_track = m.run_cached(collect, context=context, **kwargs)
+    errors = m.fatals
     if kwargs.get("debug", False):
         print(m.raw_input)
         print(m.input)
     if len(errors) > 0:
         print(errors)
         raise TrackException("MAD-X ended with fatal error.")
-    if kwargs.get('ptc', True):
-        madx_track = read_tracking(os.path.join(".", 'ptctrackone.tfs'))
-    else:
-        madx_track = read_tracking(os.path.join(".", 'tracking.outxone'))
     line_tracking = line_tracking.merge(madx_track, left_index=True, right_index=True, how='left')
     return beamline.Beamline(line_tracking)
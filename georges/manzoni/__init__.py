@@ -4,7 +4,12 @@ from .common import \
     transform_variables, \
     transform_elements
 from . import manzoni
-from .tracking import track
+from .tracking import track, track_chunks
 from .twiss import twiss, TwissMap
+from .match import match, MatchException
+from .orbit import response_matrix, correct_orbit, OrbitException
+from .errors import error_study, draw_errors, ErrorsException
+from .henon import dynamic_aperture, track_turns, polar_grid, cartesian_grid, HenonException
+from .fma import frequency_map, tunes, FMAException
 from .observers import *
 from . import matrices
@@ -2,18 +2,30 @@ import numpy as np
 from .constants import *
 
 
-def aperture_check(b, e):
+def aperture_mask(b, e):
+    """
+    Mask of the particles within the aperture of an element.
+    :param b: the beam (the coordinates are on the last axis, stacked beams are supported)
+    :param e: the element
+    :return: a boolean array (True for the transmitted particles) or None if the element has no aperture
+    """
     # Circular aperture
     if e[INDEX_APERTYPE_CODE] == APERTYPE_CODE_CIRCLE:
-        s = (b[:, 0]**2 + b[:, 2]**2) < e[INDEX_APERTURE]**2
+        return (b[..., X]**2 + b[..., Y]**2) < e[INDEX_APERTURE]**2
     # Elliptical aperture
     elif e[INDEX_APERTYPE_CODE] == APERTYPE_CODE_ELLIPSE:
-        s = (b[:, 0]**2 + b[:, 2]**2) < e[INDEX_APERTURE]**2
+        return (b[..., X]**2 + b[..., Y]**2) < e[INDEX_APERTURE]**2
     # Rectangular aperture
     elif e[INDEX_APERTYPE_CODE] == APERTYPE_CODE_RECTANGLE:
-        s = (b[:, 0]**2 < e[INDEX_APERTURE]**2) & (b[:, 2]**2 < e[INDEX_APERTURE_2]**2)
+        return (b[..., X]**2 < e[INDEX_APERTURE]**2) & (b[..., Y]**2 < e[INDEX_APERTURE_2]**2)
     # Unknown aperture type
     else:
+        return None
+
+
+def aperture_check(b, e):
+    s = aperture_mask(b, e)
+    if s is None:
         return b
     # np.compress used for performance
     return np.compress(s, b, axis=0)
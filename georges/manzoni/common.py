@@ -10,6 +10,9 @@ from .. import Beam
 
 FERMI_DB: fermi.MaterialsDB = fermi.MaterialsDB()
 
+# Materials of the stepped degrader (MATERIAL_CODE is the index in this list plus one, 0 for no material)
+MATERIALS: List[str] = sorted(FERMI_DB.projected_ranges.keys())
+
 
 def convert_line(line: Beamline,
                  context: Optional[Dict] = None,
@@ -70,6 +73,13 @@ def convert_line(line: Beamline,
                 e['APERTURE_2'] = float(s[1])
         return e
 
+    def material_conversion(e):
+        if e['CLASS'] != 'DEGRADER' and e['CLASS'] != 'SCATTERER':
+            return e
+        if str(e.get('MATERIAL', '')) in MATERIALS:
+            e['MATERIAL_CODE'] = MATERIALS.index(str(e['MATERIAL'])) + 1
+        return e
+
     def fermi_eyges_computations(e):
         if e['CLASS'] != 'DEGRADER' and e['CLASS'] != 'SCATTERER':
             return e
@@ -107,6 +117,7 @@ def convert_line(line: Beamline,
     line_copy = line_copy.apply(class_conversion, axis=1)
     line_copy = line_copy.apply(circuit_conversion, axis=1)
     line_copy = line_copy.apply(apertype_conversion, axis=1)
+    line_copy = line_copy.apply(material_conversion, axis=1)
 
     # Energy tracking
     if 'BRHO' not in line.columns:
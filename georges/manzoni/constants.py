@@ -28,6 +28,7 @@ INDEX: Dict[str, int] = {k: i for i, k in enumerate(
         'BRHO',
         'MISALIGNEMENT_X',
         'MISALIGNEMENT_Y',
+        'MATERIAL_CODE',
     )
 )}
 
@@ -57,6 +58,7 @@ INDEX_FE_LOSS = INDEX['FE_LOSS']
 INDEX_BRHO = INDEX['BRHO']
 INDEX_MISALIGNEMENT_X = INDEX['MISALIGNEMENT_X']
 INDEX_MISALIGNEMENT_Y = INDEX['MISALIGNEMENT_Y']
+INDEX_MATERIAL_CODE = INDEX['MATERIAL_CODE']
 
 # Define constants for elements types
 CLASS_CODES: Dict[str, int] = {k: i for i, k in enumerate(
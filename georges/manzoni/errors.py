@@ -0,0 +1,283 @@
+"""Error studies: statistics of the beam over random seeds of misalignments and field errors.
+
+The line is converted once; the errors of all the seeds are drawn at once and applied to a stack of copies of the
+converted line (one per seed). The seeds are then evaluated as stacked arrays, element by element, either with a
+batched sigma-matrix propagation (centroid and 5D sigma matrix, Gaussian estimate of the transmission) or with a
+batched particle tracking (lost particles are flagged with NaN coordinates instead of being removed, so that the beams
+of all the seeds keep the same shape). The seeds are split in chunks evaluated in parallel worker processes.
+"""
+from typing import Optional, List, Dict
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .constants import *
+from .common import _process_model_argument
+from .match import _element_matrix
+from .integrators import integrators
+from .fe import mc, fe
+from .aperture import aperture_mask
+from .. import physics
+
+ERRORS_QUANTITIES = ['X', 'Y', 'SIGMA_X', 'SIGMA_Y', 'TRANSMISSION']
+ERRORS_METHODS = ['particles', 'sigma']
+ERRORS_DISTRIBUTIONS = ['normal', 'uniform']
+ERRORS_QUANTILES = (0.05, 0.5, 0.95)
+
+
+class ErrorsException(Exception):
+    """Exception raised for errors in the Errors module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def _draw(error: Dict, random_state: np.random.RandomState, size: tuple) -> np.ndarray:
+    distribution = error.get('distribution', 'normal')
+    if callable(distribution):
+        return np.asarray(distribution(random_state, size), dtype=float).reshape(size)
+    sigma = error.get('sigma', 0.0)
+    if distribution == 'uniform':
+        return random_state.uniform(-sigma, sigma, size)
+    if distribution == 'normal':
+        values = random_state.normal(0.0, sigma, size)
+        if error.get('cut') is not None:
+            # Truncated distribution, the values beyond the cut (in units of sigma) are drawn again
+            outside = np.abs(values) > error['cut'] * sigma
+            while np.any(outside):
+                values[outside] = random_state.normal(0.0, sigma, np.count_nonzero(outside))
+                outside = np.abs(values) > error['cut'] * sigma
+        return values
+    raise ErrorsException(f"Invalid error distribution '{distribution}'.")
+
+
+def draw_errors(line: pd.DataFrame,
+                elements: np.ndarray,
+                errors: List[Dict],
+                seeds: int,
+                seed: Optional[int] = None) -> Dict:
+    """
+    Draw the errors of all the seeds and apply them to a stack of copies of the converted line.
+    :param line: the beamline dataframe (CLASS column and element names as index)
+    :param elements: the line converted with `convert_line`
+    :param errors: the error definitions (see `error_study`)
+    :param seeds: number of seeds
+    :param seed: seed of the random number generator
+    :return: a dictionary with the stacked lines ('lines', seeds x elements x parameters) and the drawn errors
+    ('errors', a dataframe with one row per seed and one column per element and parameter)
+    """
+    random_state = np.random.RandomState(seed)
+    names = list(line.index.values)
+    lines = np.repeat(elements[None, :, :], seeds, axis=0)
+    drawn = {}
+    for error in errors:
+        parameter = error.get('parameter')
+        if parameter not in INDEX:
+            raise ErrorsException(f"Invalid error parameter '{parameter}'.")
+        if 'elements' in error:
+            targets = list(error['elements'])
+            for t in targets:
+                if t not in names:
+                    raise ErrorsException(f"Element '{t}' is not in the line.")
+        elif 'class' in error:
+            targets = [n for n, c in zip(names, line['CLASS'].values) if c == error['class']]
+        else:
+            raise ErrorsException("The errors need an 'elements' or a 'class' key.")
+        indices = [names.index(t) for t in targets]
+        values = _draw(error, random_state, (seeds, len(indices)))
+        if error.get('relative', False):
+            lines[:, indices, INDEX[parameter]] *= 1 + values
+        else:
+            lines[:, indices, INDEX[parameter]] += values
+        for k, t in enumerate(targets):
+            drawn[(t, parameter)] = drawn.get((t, parameter), 0.0) + values[:, k]
+    return {
+        'lines': lines,
+        'errors': pd.DataFrame(drawn,
+                               index=pd.Index(np.arange(seeds), name='SEED'),
+                               columns=pd.MultiIndex.from_tuples(list(drawn.keys()), names=['ELEMENT', 'PARAMETER'])),
+    }
+
+
+def _matrices(lines: np.ndarray, i: int) -> np.ndarray:
+    """Transfer matrices of an element for all the seeds (a single matrix if the element has no error)."""
+    if np.all(lines[:, i] == lines[0, i]):
+        return _element_matrix(lines[0, i])
+    return np.array([_element_matrix(e) for e in lines[:, i]])
+
+
+def _statistics(coordinates: np.ndarray, alive: np.ndarray, n: np.ndarray) -> tuple:
+    """Mean and standard deviation over the particles of each seed, ignoring the lost particles."""
+    values = np.where(alive, coordinates, 0.0)
+    mean = np.sum(values, axis=1) / n
+    deviations = np.where(alive, coordinates - mean[:, None], 0.0)
+    return mean, np.sqrt(np.sum(deviations ** 2, axis=1) / n)
+
+
+def _track_particles(lines: np.ndarray, beam: np.ndarray, **kwargs) -> np.ndarray:
+    n_seeds, n_elements = lines.shape[0], lines.shape[1]
+    beams = np.repeat(beam[None, :, :], n_seeds, axis=0)
+    results = np.zeros((n_seeds, len(ERRORS_QUANTITIES), n_elements))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(n_elements):
+            code = int(lines[0, i, INDEX_CLASS_CODE])
+            offset_x = lines[:, i, INDEX_MISALIGNEMENT_X][:, None]
+            offset_y = lines[:, i, INDEX_MISALIGNEMENT_Y][:, None]
+            misaligned = np.any(offset_x != 0) or np.any(offset_y != 0)
+            if misaligned:
+                beams[..., X] -= offset_x
+                beams[..., Y] -= offset_y
+            if code in CLASS_CODE_INTEGRATOR or code in CLASS_CODE_FE:
+                propagate = integrators[code] if code in CLASS_CODE_INTEGRATOR else mc[code]
+                if np.all(lines[:, i] == lines[0, i]):
+                    propagated = [propagate(lines[0, i], beams.reshape(-1, 5), **kwargs)]
+                else:
+                    propagated = [propagate(lines[s, i], beams[s], **kwargs) for s in range(n_seeds)]
+                if sum(p.shape[0] for p in propagated) != beams.shape[0] * beams.shape[1]:
+                    raise ErrorsException("Elements removing particles are not supported by the error studies.")
+                beams = np.concatenate(propagated).reshape(beams.shape)
+            elif code in CLASS_CODE_MATRIX:
+                beams = beams @ np.swapaxes(_matrices(lines, i), -1, -2)
+            mask = aperture_mask(beams, lines[0, i])
+            if mask is not None:
+                beams[~mask] = np.nan
+            if misaligned:
+                beams[..., X] += offset_x
+                beams[..., Y] += offset_y
+
+            # Statistics (seeds with all the particles lost give NaN)
+            alive = np.isfinite(beams[..., X])
+            n = np.count_nonzero(alive, axis=1)
+            results[:, 0, i], results[:, 2, i] = _statistics(beams[..., X], alive, n)
+            results[:, 1, i], results[:, 3, i] = _statistics(beams[..., Y], alive, n)
+            results[:, 4, i] = n / beam.shape[0]
+    return results
+
+
+def _propagate_sigma(lines: np.ndarray, beam: np.ndarray, **kwargs) -> np.ndarray:
+    n_seeds, n_elements = lines.shape[0], lines.shape[1]
+    centroids = np.repeat(np.mean(beam, axis=0)[None, :], n_seeds, axis=0)
+    sigmas = np.repeat(np.cov(beam, rowvar=False)[None, :, :], n_seeds, axis=0)
+    transmission = np.ones(n_seeds)
+    results = np.zeros((n_seeds, len(ERRORS_QUANTITIES), n_elements))
+    for i in range(n_elements):
+        code = int(lines[0, i, INDEX_CLASS_CODE])
+        centroids[:, X] -= lines[:, i, INDEX_MISALIGNEMENT_X]
+        centroids[:, Y] -= lines[:, i, INDEX_MISALIGNEMENT_Y]
+        if code in CLASS_CODE_FE:
+            for s in range(n_seeds):
+                sigmas[s] = fe[code](lines[s, i], sigmas[s], **kwargs)
+            centroids[:, X] += lines[:, i, INDEX_LENGTH] * centroids[:, PX]
+            centroids[:, Y] += lines[:, i, INDEX_LENGTH] * centroids[:, PY]
+        else:
+            # Non-linear elements are propagated as drifts, the kickers also deflect the centroid
+            matrices = _matrices(lines, i)
+            centroids = np.einsum('...ij,...j->...i', matrices, centroids)
+            sigmas = matrices @ sigmas @ np.swapaxes(matrices, -1, -2)
+            if code == CLASS_CODES['HKICKER']:
+                centroids[:, PX] += lines[:, i, INDEX_KICK]
+            elif code == CLASS_CODES['VKICKER']:
+                centroids[:, PY] += lines[:, i, INDEX_KICK]
+        # Gaussian transmission through the aperture (rectangular approximation); the envelope is not truncated by
+        # the losses, so the transmission is estimated by the tightest aperture met so far
+        e = lines[0, i]
+        if e[INDEX_APERTYPE_CODE] != APERTYPE_CODE_NONE:
+            half_y = e[INDEX_APERTURE_2] if e[INDEX_APERTYPE_CODE] == APERTYPE_CODE_RECTANGLE else e[INDEX_APERTURE]
+            transmission = np.minimum(
+                transmission,
+                physics.ess_transmission(centroids[:, X], np.sqrt(sigmas[:, X, X]), e[INDEX_APERTURE], 1.0)
+                * physics.ess_transmission(centroids[:, Y], np.sqrt(sigmas[:, Y, Y]), half_y, 1.0))
+        centroids[:, X] += lines[:, i, INDEX_MISALIGNEMENT_X]
+        centroids[:, Y] += lines[:, i, INDEX_MISALIGNEMENT_Y]
+
+        results[:, 0, i] = centroids[:, X]
+        results[:, 1, i] = centroids[:, Y]
+        results[:, 2, i] = np.sqrt(sigmas[:, X, X])
+        results[:, 3, i] = np.sqrt(sigmas[:, Y, Y])
+        results[:, 4, i] = transmission
+    return results
+
+
+def _evaluate(lines: np.ndarray, beam: np.ndarray, method: str, kwargs: Dict) -> np.ndarray:
+    if method == 'sigma':
+        return _propagate_sigma(lines, beam, **kwargs)
+    return _track_particles(lines, beam, **kwargs)
+
+
+def error_study(model=None,
+                line=None,
+                beam=None,
+                context: Optional[Dict] = None,
+                errors: Optional[List[Dict]] = None,
+                seeds: int = 100,
+                method: str = 'particles',
+                seed: Optional[int] = None,
+                max_workers: Optional[int] = None,
+                quantiles: tuple = ERRORS_QUANTILES,
+                **kwargs) -> Dict:
+    """
+    Compute the distributions of the beam centroid, envelope and transmission along a line over random seeds of
+    misalignments and field errors.
+
+    Example:
+        study = error_study(line=line, beam=beam, context={'ENERGY': 230.0}, seeds=1000, errors=[
+            {'class': 'QUADRUPOLE', 'parameter': 'MISALIGNEMENT_X', 'sigma': 1e-4, 'cut': 3.0},
+            {'class': 'QUADRUPOLE', 'parameter': 'K1', 'sigma': 1e-3, 'relative': True},
+            {'elements': ['B1'], 'parameter': 'ANGLE', 'distribution': 'uniform', 'sigma': 1e-4},
+        ])
+        study['statistics']['SIGMA_X']  # Mean, standard deviation and quantiles of the horizontal beam size
+
+    :param model: a model (replaces line, beam and context)
+    :param line: the beamline
+    :param beam: the beam
+    :param context: the context
+    :param errors: the error definitions, dictionaries with the keys 'parameter' (a column of the Manzoni line, e.g.
+    'MISALIGNEMENT_X', 'K1', 'ANGLE' or 'KICK'), 'elements' (element names) or 'class' (all the elements of a class),
+    'distribution' ('normal', 'uniform' or a callable (random_state, size) -> values), 'sigma' (standard deviation of
+    the normal distribution or half width of the uniform distribution), 'cut' (truncation of the normal distribution in
+    units of sigma) and 'relative' (relative instead of absolute errors)
+    :param seeds: number of seeds
+    :param method: 'particles' (batched tracking of the beam) or 'sigma' (batched sigma-matrix propagation)
+    :param seed: seed of the random number generator
+    :param max_workers: number of worker processes (default: number of CPUs, 1 to run in the calling process)
+    :param quantiles: quantiles of the statistics
+    :param kwargs: optional parameters of the propagation of the elements
+    :return: a dictionary with the drawn errors ('errors'), the centroids, beam sizes and transmissions of all the seeds
+    ('elements', one row per seed and two levels of columns: quantity and element) and their statistics ('statistics',
+    one row per element and two levels of columns: quantity and statistic)
+    """
+    if method not in ERRORS_METHODS:
+        raise ErrorsException(f"Invalid method '{method}'.")
+    if seeds < 1:
+        raise ErrorsException("At least one seed is needed.")
+    v = _process_model_argument(model, line, beam, context or {}, ErrorsException)
+    georges_line = v['georges_line'].line
+    drawn = draw_errors(georges_line, v['manzoni_line'], errors or [], seeds, seed)
+
+    max_workers = min(max_workers or os.cpu_count() or 1, seeds)
+    chunks = np.array_split(drawn['lines'], max_workers)
+    beam = np.asarray(v['manzoni_beam'], dtype=float)
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_evaluate, chunks, [beam] * len(chunks), [method] * len(chunks),
+                                        [kwargs] * len(chunks)))
+    else:
+        results = [_evaluate(c, beam, method, kwargs) for c in chunks]
+    results = np.concatenate(results)
+
+    names = list(georges_line.index.values)
+    index = pd.Index(np.arange(seeds), name='SEED')
+    data = pd.DataFrame(results.reshape(seeds, -1),
+                        index=index,
+                        columns=pd.MultiIndex.from_product([ERRORS_QUANTITIES, names], names=['QUANTITY', 'ELEMENT']))
+    statistics = {}
+    for k, q in enumerate(ERRORS_QUANTITIES):
+        statistics[(q, 'MEAN')] = np.nanmean(results[:, k], axis=0)
+        statistics[(q, 'STD')] = np.nanstd(results[:, k], axis=0)
+        for p in quantiles:
+            statistics[(q, f"Q{100 * p:g}")] = np.nanquantile(results[:, k], p, axis=0)
+    return {
+        'errors': drawn['errors'],
+        'elements': data,
+        'statistics': pd.DataFrame(statistics, index=pd.Index(names, name='ELEMENT')),
+    }
@@ -1,11 +1,24 @@
 import numpy as np
 from .constants import *
+from .common import FERMI_DB, MATERIALS
+from .. import physics
+from .. import fermi
 
 try:
     import numpy.random_intel as nprandom
 except ModuleNotFoundError:
     import numpy.random as nprandom
 
+# Default step length (m) of the stepped degrader
+DEGRADER_STEP: float = 5e-3
+
+# Bohr energy straggling constant (MeV^2 cm^2 / g), 4 pi N_A r_e^2 (m_e c^2)^2
+BOHR_STRAGGLING: float = 0.1569
+
+# Nuclear interaction length approximation lambda_I = 35 A^(1/3) g/cm^2 (the materials database has no
+# nuclear interaction lengths)
+NUCLEAR_INTERACTION_LENGTH: float = 35.0
+
 
 def propagation_scatterer(e, b, **kwargs):
     b[PX, PX] += e[INDEX_FE_A0]
@@ -33,7 +46,79 @@ def mc_scatterer(e, b, **kwargs):
     return b
 
 
+def mc_degrader_stepped_mask(e, b, **kwargs):
+    """
+    Monte-Carlo tracking through a degrader sliced in steps, each step being vectorized over the particles:
+    energy loss from the projected range tables, Gaussian (Bohr) energy straggling, multiple Coulomb scattering with
+    correlated angle and position kicks from the scattering power model and nuclear losses from an attenuation law.
+
+    :param e: the degrader element (its MATERIAL_CODE must be set)
+    :param b: the beam
+    :param kwargs: 'degrader_step' (m) the maximum step length and 'degrader_scattering' the scattering power model
+    (default: DifferentialMoliere)
+    :return: the beam at the exit of the degrader, its momentum offsets are relative to the reference momentum at the
+    exit of the degrader, and the mask of the transmitted particles (the stopped and lost particles are not removed)
+    """
+    length = e[INDEX_LENGTH]
+    if length == 0:
+        return b, np.ones(b.shape[0], dtype=bool)
+    material = MATERIALS[int(e[INDEX_MATERIAL_CODE]) - 1]
+    model = kwargs.get('degrader_scattering', fermi.DifferentialMoliere)
+    n_steps = int(np.ceil(length / kwargs.get('degrader_step', DEGRADER_STEP)))
+    step = length / n_steps
+    step_cm = 100 * step
+    rho = FERMI_DB.density(material)
+    a = FERMI_DB.a(material)
+    straggling = BOHR_STRAGGLING * rho * FERMI_DB.z(material) / a * step_cm
+    survival = np.exp(-rho * step_cm / (NUCLEAR_INTERACTION_LENGTH * a ** (1 / 3)))
+
+    p0 = physics.brho_to_momentum(e[INDEX_BRHO])
+    energy = physics.momentum_to_energy(p0 * (1 + b[:, DPP]))
+    p1v1 = physics.energy_to_pv(energy)
+    r = fermi.get_range_from_energy(material, energy, db=FERMI_DB)
+    alive = np.ones(b.shape[0], dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for _ in range(n_steps):
+            energy_out = fermi.get_energy_from_range(material, r - step_cm, db=FERMI_DB)
+            alive &= np.isfinite(energy_out)
+            energy_out = np.where(alive, energy_out, energy)
+            pv = np.minimum(physics.energy_to_pv(0.5 * (energy + energy_out)), (1 - 1e-9) * p1v1)
+            theta = np.sqrt(model.t(pv, p1v1, db=FERMI_DB, material=material) * step_cm)
+            z = nprandom.standard_normal((5, b.shape[0]))
+            b[:, X] += step * b[:, PX] + step * theta * (z[0] / np.sqrt(12) + z[1] / 2)
+            b[:, PX] += theta * z[1]
+            b[:, Y] += step * b[:, PY] + step * theta * (z[2] / np.sqrt(12) + z[3] / 2)
+            b[:, PY] += theta * z[3]
+            gamma2 = (1 + energy_out / physics.PROTON_MASS) ** 2
+            energy = energy_out + z[4] * np.sqrt(straggling * (gamma2 + 1) / 2)
+            alive &= (energy > 0) & (nprandom.uniform(size=b.shape[0]) < survival)
+            energy = np.where(alive, energy, energy_out)
+            r = fermi.get_range_from_energy(material, energy, db=FERMI_DB)
+
+    # Momentum offsets relative to the reference particle at the exit of the degrader
+    k0 = fermi.residual_energies(material, 100 * length, np.array([physics.momentum_to_energy(p0)]), FERMI_DB)[0]
+    b[alive, DPP] = physics.energy_to_momentum(energy[alive]) / physics.energy_to_momentum(k0) - 1
+    return b, alive
+
+
+def mc_degrader_stepped(e, b, **kwargs):
+    """Monte-Carlo tracking through a degrader sliced in steps (see `mc_degrader_stepped_mask`), the stopped and lost
+    particles are removed."""
+    b, alive = mc_degrader_stepped_mask(e, b, **kwargs)
+    return np.compress(alive, b, axis=0)
+
+
+def mc_degrader_mask(e, b, **kwargs):
+    """Same as `mc_degrader`, also returning the mask of the transmitted particles (None if none is removed)."""
+    if kwargs.get('degrader') == 'stepped' and e[INDEX_MATERIAL_CODE] != 0:
+        return mc_degrader_stepped_mask(e, b, **kwargs)
+    return mc_degrader(e, b, **kwargs), None
+
+
 def mc_degrader(e, b, **kwargs):
+    if kwargs.get('degrader') == 'stepped' and e[INDEX_MATERIAL_CODE] != 0:
+        return mc_degrader_stepped(e, b, **kwargs)
+
     # Remove particles
     # if e[INDEX_FE_LOSS] != 0:
     #     idx = np.random.randint(b.shape[0], size=int((e[INDEX_FE_LOSS]) * b.shape[0]))
@@ -73,6 +158,12 @@ mc = {
 
 }
 
+# Monte-Carlo propagation reporting the mask of the transmitted particles instead of removing them (the indices of the
+# particles can then be followed by the observers)
+mc_masks = {
+    CLASS_CODES['DEGRADER']: mc_degrader_mask,
+}
+
 fe = {
     CLASS_CODES['DEGRADER']: propagation_degrader,
     CLASS_CODES['SCATTERER']: propagation_scatterer,
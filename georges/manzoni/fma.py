@@ -0,0 +1,145 @@
+"""Frequency map analysis: amplitude-dependent tunes and tune diffusion from turn-by-turn data.
+
+The turn-by-turn data of each plane are stored compactly as (turns, particles, 2) arrays of the position and the
+angle (see `manzoni.henon.track_turns`). The tunes of all the particles are computed at once: the spectrum of the
+Hann-windowed signals is computed with a single FFT along the turns, the peak is refined either by the interpolation
+of the Hann window (`interpolation`) or by maximizing the windowed Fourier amplitude with a few vectorized Newton
+iterations (`naff`, the main frequency of the NAFF algorithm). The diffusion is the change of the tunes between the two
+halves of the turns.
+"""
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+FMA_METHODS = ['interpolation', 'naff']
+FMA_NEWTON_ITERATIONS: int = 4
+
+
+class FMAException(Exception):
+    """Exception raised for errors in the FMA module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def hann_window(n: int) -> np.ndarray:
+    """
+    Periodic Hann window.
+    :param n: number of turns
+    :return: the window, normalized to a unit mean
+    """
+    return 1 - np.cos(2 * np.pi * np.arange(n) / n)
+
+
+def _newton(signal: np.ndarray, tune: np.ndarray) -> np.ndarray:
+    """Maximize the amplitude of the Fourier transform of the (windowed) signals around the tunes."""
+    n = signal.shape[0]
+    t = np.arange(n)[:, None]
+    start = tune.copy()
+    for _ in range(FMA_NEWTON_ITERATIONS):
+        e = signal * np.exp(-2j * np.pi * tune[None, :] * t)
+        f0 = np.sum(e, axis=0)
+        f1 = -1j * np.sum(t * e, axis=0)
+        f2 = -np.sum(t ** 2 * e, axis=0)
+        # d|F|^2/dw = 2 Re(F* F'), d2|F|^2/dw2 = 2 (|F'|^2 + Re(F* F''))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = -np.real(np.conj(f0) * f1) / (np.abs(f1) ** 2 + np.real(np.conj(f0) * f2))
+        tune = tune + np.nan_to_num(step) / (2 * np.pi)
+    # The refinement stays within the bin of the FFT estimate
+    return np.clip(tune, start - 1 / n, start + 1 / n)
+
+
+def tunes(signal: np.ndarray, method: str = 'interpolation') -> np.ndarray:
+    """
+    Compute the tunes of turn-by-turn signals.
+    :param signal: (turns, particles) array, complex (x - i p with normalized coordinates, tunes in [0, 1)) or real
+    (tunes in [0, 0.5])
+    :param method: 'interpolation' (interpolated FFT) or 'naff' (maximization of the Fourier amplitude)
+    :return: the tunes of the particles (NaN for the particles lost or with non-finite data)
+    """
+    if method not in FMA_METHODS:
+        raise FMAException(f"Invalid method '{method}'.")
+    signal = np.asarray(signal)
+    if signal.ndim == 1:
+        signal = signal[:, None]
+    n = signal.shape[0]
+    if n < 8:
+        raise FMAException("At least 8 turns are needed.")
+    real = not np.iscomplexobj(signal)
+    valid = np.all(np.isfinite(signal), axis=0)
+    signal = np.where(valid[None, :], signal, 0.0)
+    signal = (signal - np.mean(signal, axis=0)) * hann_window(n)[:, None]
+
+    spectrum = np.abs(np.fft.fft(signal, axis=0))
+    bins = n // 2 + 1 if real else n
+    k = 1 + np.argmax(spectrum[1:bins], axis=0)
+    columns = np.arange(signal.shape[1])
+    left = spectrum[(k - 1) % n, columns]
+    right = spectrum[(k + 1) % n, columns]
+    peak = spectrum[k, columns]
+    side = np.where(right > left, 1, -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.maximum(left, right) / peak
+        # Hann window: |W(d - 1)| / |W(d)| = (1 + d) / (2 - d)
+        delta = np.clip(np.nan_to_num((2 * ratio - 1) / (1 + ratio)), 0.0, 1.0)
+    tune = (k + side * delta) / n
+    if method == 'naff':
+        tune = _newton(signal, tune)
+    tune = np.mod(tune, 1.0)
+    if real:
+        tune = np.minimum(tune, 1 - tune)
+    return np.where(valid, tune, np.nan)
+
+
+def _signal(data: np.ndarray, beta: Optional[float], alpha: float) -> np.ndarray:
+    if beta is None:
+        return data[..., 0]
+    # Normalized coordinates: x / sqrt(beta) - i (alpha x + beta x') / sqrt(beta)
+    return (data[..., 0] - 1j * (alpha * data[..., 0] + beta * data[..., 1])) / np.sqrt(beta)
+
+
+def frequency_map(x: np.ndarray,
+                  y: np.ndarray,
+                  beta_x: Optional[float] = None,
+                  beta_y: Optional[float] = None,
+                  alpha_x: float = 0.0,
+                  alpha_y: float = 0.0,
+                  method: str = 'interpolation') -> pd.DataFrame:
+    """
+    Frequency map analysis of turn-by-turn data.
+
+    Example:
+        data = henon.track_turns(line, polar_grid(amplitudes, angles), context, turns=2048)
+        fm = frequency_map(data[..., [X, PX]], data[..., [Y, PY]], beta_x=10.0, beta_y=5.0)
+        plt.scatter(fm['QX'], fm['QY'], c=fm['DIFFUSION'])
+
+    :param x: horizontal turn-by-turn data, a (turns, particles, 2) array of the positions and angles
+    :param y: vertical turn-by-turn data, a (turns, particles, 2) array of the positions and angles
+    :param beta_x: horizontal beta function at the observation point (the tunes are in [0, 0.5] if not given)
+    :param beta_y: vertical beta function at the observation point (the tunes are in [0, 0.5] if not given)
+    :param alpha_x: horizontal alpha function at the observation point
+    :param alpha_y: vertical alpha function at the observation point
+    :param method: 'interpolation' (interpolated FFT) or 'naff' (maximization of the Fourier amplitude)
+    :return: a dataframe with one row per particle: initial positions (X, Y), tunes over the first half of the turns
+    (QX, QY), tunes over the second half (QX2, QY2) and diffusion (DIFFUSION, log10 of the tune change, NaN for the
+    lost particles)
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if x.ndim != 3 or x.shape[2] != 2 or x.shape != y.shape:
+        raise FMAException("The turn-by-turn data must be (turns, particles, 2) arrays of the same shape.")
+    half = x.shape[0] // 2
+    sx, sy = _signal(x, beta_x, alpha_x), _signal(y, beta_y, alpha_y)
+    # Both halves of a plane in a single call
+    qx1, qx2 = np.split(tunes(np.concatenate([sx[:half], sx[half:2 * half]], axis=1), method), 2)
+    qy1, qy2 = np.split(tunes(np.concatenate([sy[:half], sy[half:2 * half]], axis=1), method), 2)
+    with np.errstate(divide='ignore'):
+        diffusion = np.log10(np.hypot(qx2 - qx1, qy2 - qy1))
+    return pd.DataFrame({
+        'X': x[0, :, 0],
+        'Y': y[0, :, 0],
+        'QX': qx1,
+        'QY': qy1,
+        'QX2': qx2,
+        'QY2': qy2,
+        'DIFFUSION': diffusion,
+    }, index=pd.Index(np.arange(x.shape[1]), name='PARTICLE'))
@@ -1,2 +1,284 @@
+"""Dynamic aperture scans: multi-turn tracking of a grid of initial amplitudes, recording only the survival turns.
+
+The ring is compiled once into a short sequence of operations: the linear elements between two non-linear elements
+are merged into a single affine map (transfer matrix and constant offset, which also accounts for the kickers and the
+misalignments of the linear elements) and the multipoles are applied as thin-lens kicks (drift-kick-drift for thick
+elements) computed with the complex multipole expansion. For a ring made of a linear lattice and a single thin
+sextupole, the compiled map is the Hénon map.
+
+The particles are tracked as a single array; the lost particles are removed from the active set and only their
+survival turn is recorded. The tracking can stop early once the dynamic aperture (the smallest initial amplitude of
+the lost particles) has converged.
+"""
+from typing import Optional, Dict, List, Tuple, Union
 import numpy as np
+import pandas as pd
 from .constants import *
+from .common import convert_line
+from .match import _element_matrix
+from .aperture import aperture_mask
+from .integrators import _drift
+from .. import Beamline
+
+HENON_COORDINATES = ['X', 'PX', 'Y', 'PY', 'DPP']
+
+# Multipole orders and strengths of the non-linear elements
+_MULTIPOLES = {
+    CLASS_CODES['SEXTUPOLE']: ((2, INDEX_K2),),
+    CLASS_CODES['OCTUPOLE']: ((3, INDEX_K3),),
+    CLASS_CODES['DECAPOLE']: ((4, INDEX_K4),),
+    CLASS_CODES['MULTIPOLE']: ((2, INDEX_K2), (3, INDEX_K3), (4, INDEX_K4)),
+}
+_FACTORIALS = {2: 2.0, 3: 6.0, 4: 24.0}
+
+
+class HenonException(Exception):
+    """Exception raised for errors in the Henon module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def polar_grid(amplitudes: np.ndarray, angles: np.ndarray, dpp: float = 0.0) -> np.ndarray:
+    """
+    Grid of initial conditions in polar coordinates of the (X, Y) plane.
+    :param amplitudes: the amplitudes (m)
+    :param angles: the angles (rad, 0 for the horizontal plane)
+    :param dpp: the momentum offset of all the particles
+    :return: an (amplitudes x angles, 5) array of initial coordinates
+    """
+    r, a = np.meshgrid(np.asarray(amplitudes, dtype=float), np.asarray(angles, dtype=float), indexing='ij')
+    grid = np.zeros((r.size, 5))
+    grid[:, X] = (r * np.cos(a)).ravel()
+    grid[:, Y] = (r * np.sin(a)).ravel()
+    grid[:, DPP] = dpp
+    return grid
+
+
+def cartesian_grid(x: np.ndarray, y: np.ndarray, dpp: float = 0.0) -> np.ndarray:
+    """
+    Grid of initial conditions in Cartesian coordinates of the (X, Y) plane.
+    :param x: the horizontal positions (m)
+    :param y: the vertical positions (m)
+    :param dpp: the momentum offset of all the particles
+    :return: an (x x y, 5) array of initial coordinates
+    """
+    gx, gy = np.meshgrid(np.asarray(x, dtype=float), np.asarray(y, dtype=float), indexing='ij')
+    grid = np.zeros((gx.size, 5))
+    grid[:, X] = gx.ravel()
+    grid[:, Y] = gy.ravel()
+    grid[:, DPP] = dpp
+    return grid
+
+
+def _affine(e: np.ndarray, matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Affine map (b -> b M^T + c) of a linear element, including its kick and its misalignment."""
+    offset = np.zeros(5)
+    if e[INDEX_CLASS_CODE] == CLASS_CODES['HKICKER']:
+        offset[PX] = e[INDEX_KICK]
+    elif e[INDEX_CLASS_CODE] == CLASS_CODES['VKICKER']:
+        offset[PY] = e[INDEX_KICK]
+    misalignment = np.zeros(5)
+    misalignment[X] = e[INDEX_MISALIGNEMENT_X]
+    misalignment[Y] = e[INDEX_MISALIGNEMENT_Y]
+    # x -> M (x - d) + k + d
+    return matrix, offset + misalignment - matrix @ misalignment
+
+
+def _compose(first: Optional[Tuple], second: Tuple) -> Tuple[np.ndarray, np.ndarray]:
+    if first is None:
+        return second
+    return second[0] @ first[0], second[0] @ first[1] + second[1]
+
+
+def compile_line(elements: np.ndarray) -> List[Tuple]:
+    """
+    Compile a line converted with `convert_line` into a sequence of operations: ('map', matrix, offset) for the merged
+    linear elements, ('kick', orders, strengths, misalignment) for the thin-lens multipole kicks (integrated normalized
+    strengths) and ('aperture', element) for the aperture checks.
+    :param elements: the line in Manzoni format
+    :return: the list of operations of one turn
+    """
+    operations = []
+    current = None
+
+    def flush():
+        nonlocal current
+        if current is not None:
+            operations.append(('map',) + current)
+            current = None
+
+    for e in elements:
+        code = int(e[INDEX_CLASS_CODE])
+        if code in CLASS_CODE_FE:
+            raise HenonException("Degraders and scatterers are not supported by the dynamic aperture scans.")
+        if code in _MULTIPOLES:
+            length = e[INDEX_LENGTH]
+            # Integrated strengths (the strengths of thin elements are already integrated)
+            orders = [n for n, i in _MULTIPOLES[code] if e[i] != 0]
+            strengths = [e[i] * (length if length > 0 else 1.0) / e[INDEX_BRHO] / _FACTORIALS[n]
+                         for n, i in _MULTIPOLES[code] if e[i] != 0]
+            half_drift = _affine(e, _drift(length / 2))
+            if length > 0:
+                current = _compose(current, half_drift)
+            if len(orders) > 0:
+                flush()
+                operations.append(('kick', orders, strengths, (e[INDEX_MISALIGNEMENT_X], e[INDEX_MISALIGNEMENT_Y])))
+            if length > 0:
+                current = _compose(current, half_drift)
+        else:
+            current = _compose(current, _affine(e, _element_matrix(e)))
+        if e[INDEX_APERTYPE_CODE] != APERTYPE_CODE_NONE:
+            flush()
+            operations.append(('aperture', e))
+    flush()
+    return operations
+
+
+def _kick(b: np.ndarray, orders: List[int], strengths: List[float], misalignment: Tuple[float, float]):
+    """Thin-lens multipole kick: dPX - i dPY = -sum(k_n L / n! (x + iy)^n) / (1 + dpp)."""
+    z = (b[:, X] - misalignment[0]) + 1j * (b[:, Y] - misalignment[1])
+    power = z
+    kick = 0.0
+    for n in range(2, max(orders) + 1):
+        # Integer powers by successive products (faster than complex exponentiation)
+        power = power * z
+        if n in orders:
+            kick = kick + strengths[orders.index(n)] * power
+    kick = kick / (1 + b[:, DPP])
+    b[:, PX] -= kick.real
+    b[:, PY] += kick.imag
+
+
+def _apply(operation: Tuple, beam: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Apply a compiled operation, return the beam and the mask of the particles within the aperture (if any)."""
+    if operation[0] == 'map':
+        beam = beam @ operation[1].T
+        beam += operation[2]
+    elif operation[0] == 'kick':
+        _kick(beam, operation[1], operation[2], operation[3])
+    else:
+        return beam, aperture_mask(beam, operation[1])
+    return beam, None
+
+
+def _initial_conditions(initial: Union[np.ndarray, pd.DataFrame]) -> np.ndarray:
+    if isinstance(initial, pd.DataFrame):
+        initial = initial[HENON_COORDINATES].values
+    initial = np.array(initial, dtype=float)
+    if initial.ndim != 2 or initial.shape[1] != 5:
+        raise HenonException("The initial conditions must be an (n, 5) array.")
+    return initial
+
+
+def track_turns(line: Beamline,
+                initial: Union[np.ndarray, pd.DataFrame],
+                context: Optional[Dict] = None,
+                turns: int = 1024,
+                limit: float = 1.0) -> np.ndarray:
+    """
+    Turn-by-turn coordinates at the start of the ring (e.g. for the frequency map analysis, see `manzoni.fma`).
+    :param line: the ring
+    :param initial: the initial conditions, an (n, 5) array or a dataframe with the X, PX, Y, PY and DPP columns
+    :param context: the context
+    :param turns: the number of turns
+    :param limit: particles with a coordinate |X| or |Y| above this limit (m) are lost
+    :return: a (turns, n, 5) array, the first turn being the initial conditions and the lost particles being NaN
+    """
+    beam = _initial_conditions(initial)
+    operations = compile_line(convert_line(line.line, context or {}))
+    data = np.empty((turns,) + beam.shape)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for turn in range(turns):
+            data[turn] = beam
+            for operation in operations:
+                beam, mask = _apply(operation, beam)
+                if mask is not None:
+                    beam[~mask] = np.nan
+            beam[~((np.abs(beam[:, X]) < limit) & (np.abs(beam[:, Y]) < limit))] = np.nan
+    return data
+
+
+def _dynamic_aperture(amplitudes: np.ndarray, lost: np.ndarray) -> float:
+    return float(np.min(amplitudes[lost])) if np.any(lost) else np.inf
+
+
+def dynamic_aperture(line: Beamline,
+                     initial: Union[np.ndarray, pd.DataFrame],
+                     context: Optional[Dict] = None,
+                     turns: int = 1000,
+                     limit: float = 1.0,
+                     check_interval: int = 100,
+                     patience: Optional[int] = None) -> Dict:
+    """
+    Track a set of initial conditions for many turns and record the survival turn of each particle.
+
+    Example:
+        da = dynamic_aperture(line, polar_grid(np.linspace(1e-3, 5e-2, 200), np.linspace(0, np.pi / 2, 10)),
+                              context={'ENERGY': 230.0}, turns=10000, patience=5)
+        da['boundary']  # Stable amplitude for each angle of the grid
+
+    :param line: the ring
+    :param initial: the initial conditions, an (n, 5) array (see `polar_grid` and `cartesian_grid`) or a dataframe
+    with the X, PX, Y, PY and DPP columns
+    :param context: the context
+    :param turns: the maximum number of turns
+    :param limit: particles with a coordinate |X| or |Y| above this limit (m) are lost
+    :param check_interval: number of turns between two checks of the convergence of the dynamic aperture
+    :param patience: stop once the dynamic aperture is unchanged for this number of consecutive checks (default: track
+    all the turns)
+    :return: a dictionary with the initial conditions and the number of turns survived by each particle ('particles'),
+    the number of turns tracked ('turns'), the dynamic aperture ('dynamic_aperture', smallest initial amplitude of the
+    lost particles) and the stable amplitude along each direction of the grid ('boundary', largest amplitude below
+    which all the particles survived)
+    """
+    initial = _initial_conditions(initial)
+    operations = compile_line(convert_line(line.line, context or {}))
+
+    n = initial.shape[0]
+    survived = np.full(n, turns, dtype=int)
+    amplitudes = np.hypot(initial[:, X], initial[:, Y])
+    active = np.arange(n)
+    beam = initial.copy()
+    history = []
+    tracked = turns
+    with np.errstate(invalid='ignore', over='ignore'):
+        for turn in range(turns):
+            for operation in operations:
+                beam, mask = _apply(operation, beam)
+                if mask is not None and not np.all(mask):
+                    survived[active[~mask]] = turn
+                    active, beam = active[mask], beam[mask]
+            alive = (np.abs(beam[:, X]) < limit) & (np.abs(beam[:, Y]) < limit)
+            if not np.all(alive):
+                survived[active[~alive]] = turn
+                active, beam = active[alive], beam[alive]
+            if len(active) == 0:
+                tracked = turn + 1
+                break
+            if patience is not None and (turn + 1) % check_interval == 0:
+                history.append(_dynamic_aperture(amplitudes, survived < turns))
+                if len(history) > patience and len(set(history[-patience - 1:])) == 1:
+                    tracked = turn + 1
+                    break
+    survived[active] = tracked
+
+    particles = pd.DataFrame(initial, columns=HENON_COORDINATES)
+    particles['TURNS'] = survived
+    particles['LOST'] = survived < tracked
+    particles['AMPLITUDE'] = amplitudes
+    particles['ANGLE'] = np.round(np.arctan2(initial[:, Y], initial[:, X]), 12)
+
+    def stable(group):
+        lost = group['AMPLITUDE'][group['LOST']]
+        below = group['AMPLITUDE'][~group['LOST']]
+        if len(lost) > 0:
+            below = below[below < lost.min()]
+        return below.max() if len(below) > 0 else 0.0
+
+    return {
+        'particles': particles,
+        'turns': tracked,
+        'dynamic_aperture': _dynamic_aperture(amplitudes, particles['LOST'].values),
+        'boundary': particles.groupby('ANGLE').apply(stable).rename('AMPLITUDE'),
+    }
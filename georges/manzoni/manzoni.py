@@ -2,9 +2,9 @@ import numpy as np
 from .matrices import matrices, matrices4
 from .tensors import tensors
 from .integrators import integrators
-from .fe import mc, fe
+from .fe import mc, mc_masks, fe
 from .constants import *
-from .aperture import aperture_check
+from .aperture import aperture_check, aperture_mask
 from .observers import Observer
 
 
@@ -72,6 +72,9 @@ def track1(line, beam, observer, **kwargs) -> Observer:
     :return: Observer
     """
 
+    # Indices of the transmitted particles in the initial beam, for the observers using them
+    ids = np.arange(beam.shape[0]) if observer.uses_ids else None
+
     # Main loop
     for turn in range(0, observer.turns):
         nelem = 0
@@ -85,8 +88,17 @@ def track1(line, beam, observer, **kwargs) -> Observer:
                 if line[i, INDEX_CLASS_CODE] in CLASS_CODE_INTEGRATOR:
                     beam = integrators[int(line[i, INDEX_CLASS_CODE])](line[i], beam, **kwargs)
                 # Monte-Carlo propagation
+                elif ids is not None and line[i, INDEX_CLASS_CODE] in mc_masks:
+                    beam, alive = mc_masks[int(line[i, INDEX_CLASS_CODE])](line[i], beam, **kwargs)
+                    if alive is not None:
+                        beam = np.compress(alive, beam, axis=0)
+                        ids = ids[alive]
                 elif line[i, INDEX_CLASS_CODE] in CLASS_CODE_FE:
+                    n = beam.shape[0]
                     beam = mc[int(line[i, INDEX_CLASS_CODE])](line[i], beam, **kwargs)
+                    if ids is not None and beam.shape[0] != n:
+                        # The element removed particles without reporting which ones
+                        ids = None
                 # Transfert matrices and tensors
                 elif line[i, INDEX_CLASS_CODE] in CLASS_CODE_MATRIX:
                     matrix = matrices[int(line[i, INDEX_CLASS_CODE])]
@@ -95,11 +107,19 @@ def track1(line, beam, observer, **kwargs) -> Observer:
                     # Alternative
                     # beam = np.einsum('ij,kj->ik', beam, matrix(line[i]))
                     beam = beam.dot(matrix(line[i]).T)
-            beam = aperture_check(beam, line[i])
+            mask = aperture_mask(beam, line[i])
+            if mask is not None:
+                # np.compress used for performance
+                beam = np.compress(mask, beam, axis=0)
+                if ids is not None:
+                    ids = ids[mask]
 
             # Observation
             if i in observer._elements:
-                observer(turn, nelem, beam)
+                if observer.uses_ids:
+                    observer(turn, nelem, beam, ids=ids)
+                else:
+                    observer(turn, nelem, beam)
                 nelem += 1
 
             if line[i, INDEX_MISALIGNEMENT_X] != 0:
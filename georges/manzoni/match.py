@@ -0,0 +1,391 @@
+"""In-process optics matching, a drop-in replacement of `georges.madx.match` for transfer lines and rings.
+
+The matcher uses the vocabulary of the MAD-X interface: the variables (`vary`) are keys of the context plugged in the
+elements through the PLUG and CIRCUIT columns of the beamline; the constraints are MAD-X constraint strings
+('betx=10.0, alfx<0.5') applied at the exit of an element (`range`); the global constraints are the tunes (Q1, Q2).
+
+The optics are computed from the cumulative 5D transfer maps of the line. For a transfer line, the derivatives of the
+Twiss parameters with respect to the variables are analytic: the derivative of the map of an element is propagated
+with the cumulative maps (the derivative of the quadrupole matrices with respect to K1 is exact, the one of the other
+elements is computed by central differences of the element matrix only). The problem is solved with
+`scipy.optimize.least_squares`, the bounds of the variables being honored.
+"""
+from typing import Optional, List, Dict, Tuple
+import re
+import numpy as np
+from scipy.optimize import least_squares
+from .constants import *
+from .common import convert_line
+from .matrices import matrices, drift
+from .. import Beamline
+
+MATCH_PARAMETERS = ['BETX', 'ALFX', 'MUX', 'DX', 'DPX', 'BETY', 'ALFY', 'MUY', 'DY', 'DPY']
+MATCH_GLOBAL_PARAMETERS = {'Q1': 'MUX', 'Q2': 'MUY'}
+
+# Default weights of the MAD-X MATCH module
+MATCH_WEIGHTS = {
+    'BETX': 1.0,
+    'ALFX': 10.0,
+    'MUX': 10.0,
+    'DX': 10.0,
+    'DPX': 100.0,
+    'BETY': 1.0,
+    'ALFY': 10.0,
+    'MUY': 10.0,
+    'DY': 10.0,
+    'DPY': 100.0,
+}
+
+MATCH_UNSTABLE_PENALTY = 1e6
+MATCH_CONSTRAINT_REGEX = re.compile(r"(\w+)\s*(=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+MATCH_METHODS = {
+    'jacobian': 'trf',
+    'lmdif': 'lm',
+    'migrad': 'trf',
+    'simplex': 'trf',
+}
+
+
+class MatchException(Exception):
+    """Exception raised for errors in the Match module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def parse_constraint(constraint: str) -> List[Tuple[str, str, float]]:
+    """
+    Parse a MAD-X constraint string.
+    :param constraint: the constraint (e.g. 'betx=10.0, alfx<0.5')
+    :return: a list of (parameter, operator, value)
+    """
+    parsed = [(p.upper(), op, float(v)) for p, op, v in MATCH_CONSTRAINT_REGEX.findall(str(constraint))]
+    if len(parsed) == 0:
+        raise MatchException(f"Invalid constraint '{constraint}'.")
+    for p, _, _ in parsed:
+        if p not in MATCH_PARAMETERS and p not in MATCH_GLOBAL_PARAMETERS:
+            raise MatchException(f"Unsupported matching parameter '{p}'.")
+    return parsed
+
+
+def quadrupole_derivative(e: np.ndarray) -> np.ndarray:
+    """
+    Derivative of the quadrupole transfer matrix with respect to K1.
+    :param e: element definition
+    :return: a numpy array representing the derivative of the 5D transfer matrix
+    """
+    length = e[INDEX_LENGTH]
+    k = e[INDEX_K1] / e[INDEX_BRHO]
+    d = np.zeros((5, 5))
+    for i, q, sign in ((0, k, 1.0), (2, -k, -1.0)):
+        # With M = [[C, S], [-q S, C]], dC/dq = -L S / 2, dS/dq = (L C - S) / 2q and d(-q S)/dq = -(S + L C) / 2
+        if q > 0:
+            w = np.sqrt(q)
+            c, s = np.cos(w * length), np.sin(w * length) / w
+        elif q < 0:
+            w = np.sqrt(-q)
+            c, s = np.cosh(w * length), np.sinh(w * length) / w
+        else:
+            c, s = 1.0, length
+        if np.abs(q) * length ** 2 > 1e-4:
+            ds = (length * c - s) / (2 * q)
+        else:
+            ds = -length ** 3 / 6 + q * length ** 5 / 60
+        d[i:i + 2, i:i + 2] = (sign / e[INDEX_BRHO]) * np.array([
+            [-length * s / 2, ds],
+            [-(s + length * c) / 2, -length * s / 2],
+        ])
+    return d
+
+
+def _element_matrix(e: np.ndarray) -> np.ndarray:
+    return matrices.get(int(e[INDEX_CLASS_CODE]), drift)(e)
+
+
+def _element_derivative(e: np.ndarray, index: int) -> np.ndarray:
+    if index == INDEX_K1 and (e[INDEX_CLASS_CODE] == CLASS_CODES['QUADRUPOLE'] or (
+            e[INDEX_CLASS_CODE] in (CLASS_CODES['SBEND'], CLASS_CODES['RBEND']) and e[INDEX_ANGLE] == 0)):
+        return quadrupole_derivative(e)
+    h = 1e-6 * max(1.0, np.abs(e[index]))
+    e_plus = e.copy()
+    e_plus[index] += h
+    e_minus = e.copy()
+    e_minus[index] -= h
+    return (_element_matrix(e_plus) - _element_matrix(e_minus)) / (2 * h)
+
+
+def _cumulative_maps(matrices_: np.ndarray) -> np.ndarray:
+    """Return the cumulative maps (identity first, then the map up to the exit of each element)."""
+    m = np.empty((len(matrices_) + 1, 5, 5))
+    m[0] = np.identity(5)
+    for i in range(len(matrices_)):
+        m[i + 1] = matrices_[i] @ m[i]
+    return m
+
+
+def _plane_optics(m: np.ndarray, dm: Optional[np.ndarray], initial: Dict, plane: str) -> Dict[str, np.ndarray]:
+    """Twiss parameters (or their derivatives if dm is given) propagated by the cumulative maps in one plane."""
+    i, j = (0, 1) if plane == 'X' else (2, 3)
+    beta0, alpha0 = initial[f'BET{plane}'], initial[f'ALF{plane}']
+    d0, dp0 = initial[f'D{plane}'], initial[f'DP{plane}']
+    a = m[:, i, i] * beta0 - m[:, i, j] * alpha0
+    b = m[:, i, j]
+    c = m[:, j, i] * beta0 - m[:, j, j] * alpha0
+    if dm is None:
+        return {
+            f'BET{plane}': (a ** 2 + b ** 2) / beta0,
+            f'ALF{plane}': -(a * c + b * m[:, j, j]) / beta0,
+            f'MU{plane}': initial[f'MU{plane}'] + np.unwrap(np.arctan2(b, a)) / (2 * np.pi),
+            f'D{plane}': m[:, i, i] * d0 + m[:, i, j] * dp0 + m[:, i, 4],
+            f'DP{plane}': m[:, j, i] * d0 + m[:, j, j] * dp0 + m[:, j, 4],
+        }
+    da = dm[:, i, i] * beta0 - dm[:, i, j] * alpha0
+    db = dm[:, i, j]
+    dc = dm[:, j, i] * beta0 - dm[:, j, j] * alpha0
+    return {
+        f'BET{plane}': 2 * (a * da + b * db) / beta0,
+        f'ALF{plane}': -(da * c + a * dc + db * m[:, j, j] + b * dm[:, j, j]) / beta0,
+        f'MU{plane}': (a * db - b * da) / (a ** 2 + b ** 2) / (2 * np.pi),
+        f'D{plane}': dm[:, i, i] * d0 + dm[:, i, j] * dp0 + dm[:, i, 4],
+        f'DP{plane}': dm[:, j, i] * d0 + dm[:, j, j] * dp0 + dm[:, j, 4],
+    }
+
+
+def _optics(m: np.ndarray, initial: Dict, dm: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    return {**_plane_optics(m, dm, initial, 'X'), **_plane_optics(m, dm, initial, 'Y')}
+
+
+def _periodic_initial(m: np.ndarray) -> Dict:
+    """Periodic solution of the one-turn map."""
+    initial = {'MUX': 0.0, 'MUY': 0.0}
+    for plane, (i, j) in (('X', (0, 1)), ('Y', (2, 3))):
+        cos_mu = 0.5 * (m[i, i] + m[j, j])
+        if np.abs(cos_mu) >= 1:
+            raise MatchException("The one-turn map is unstable.")
+        sin_mu = np.sign(m[i, j]) * np.sqrt(1 - cos_mu ** 2)
+        initial[f'BET{plane}'] = m[i, j] / sin_mu
+        initial[f'ALF{plane}'] = (m[i, i] - m[j, j]) / (2 * sin_mu)
+        # Periodic dispersion: (I - M) D = M[:, 4]
+        d = np.linalg.solve(np.identity(2) - m[[i, j]][:, [i, j]], m[[i, j], 4])
+        initial[f'D{plane}'], initial[f'DP{plane}'] = d
+    return initial
+
+
+class _Matcher:
+    def __init__(self, line: Beamline, context: Dict, vary: List, constraints: List, global_constraints: List,
+                 periodic: bool):
+        self.periodic = periodic
+        self.context = context
+        self.elements = convert_line(line.line, context)
+        self.names = list(line.line.index.values)
+        self.matrices = np.array([_element_matrix(e) for e in self.elements])
+
+        # Variables and the element parameters they drive
+        self.variables = []
+        self.lower = []
+        self.upper = []
+        self.plugs = []
+        plugs = line.line.get('PLUG')
+        circuits = line.line.get('CIRCUIT')
+        for v in vary:
+            if isinstance(v, dict):
+                name = v['variable']
+                lower, upper = v.get('lower', np.nan), v.get('upper', np.nan)
+            else:
+                name, lower, upper = v, np.nan, np.nan
+            targets = []
+            if plugs is not None and circuits is not None:
+                for i, (plug, circuit) in enumerate(zip(plugs.values, circuits.values)):
+                    if circuit == name and plug in INDEX and plug != 'APERTURE':
+                        targets.append((i, INDEX[plug]))
+            if len(targets) == 0:
+                raise MatchException(f"Variable '{name}' is not plugged in any element of the line.")
+            self.variables.append(name)
+            self.lower.append(-np.inf if lower is None or np.isnan(lower) else lower)
+            self.upper.append(np.inf if upper is None or np.isnan(upper) else upper)
+            self.plugs.append(targets)
+
+        # Constraints: (name, location in the cumulative maps, parameter, operator, target)
+        self.constraints = []
+        for c in constraints:
+            location = self._location(c['range'])
+            if 'constraint' in c:
+                parsed = parse_constraint(c['constraint'])
+            else:
+                parsed = parse_constraint(f"{c['parameter']}={c['value']}")
+            for p, op, value in parsed:
+                if p not in MATCH_PARAMETERS:
+                    raise MatchException(f"'{p}' can only be used as a global constraint.")
+                self.constraints.append((c['range'], location, p, op, value))
+        for c in global_constraints or []:
+            for p, op, value in parse_constraint(c):
+                if p not in MATCH_GLOBAL_PARAMETERS:
+                    raise MatchException(f"Unsupported global constraint '{p}'.")
+                self.constraints.append(('#E', len(self.elements), p, op, value))
+
+        self.initial = None
+        if not periodic:
+            self.initial = {
+                'BETX': context.get('BETAX', 1.0),
+                'ALFX': context.get('ALPHAX', 0.0),
+                'MUX': context.get('MUX', 0.0),
+                'DX': context.get('DX', 0.0),
+                'DPX': context.get('DPX', 0.0),
+                'BETY': context.get('BETAY', 1.0),
+                'ALFY': context.get('ALPHAY', 0.0),
+                'MUY': context.get('MUY', 0.0),
+                'DY': context.get('DY', 0.0),
+                'DPY': context.get('DPY', 0.0),
+            }
+
+    def _location(self, name: str) -> int:
+        if str(name).upper() == '#S':
+            return 0
+        if str(name).upper() == '#E':
+            return len(self.elements)
+        try:
+            return self.names.index(name) + 1
+        except ValueError:
+            raise MatchException(f"Invalid constraint range '{name}'.")
+
+    def x0(self) -> np.ndarray:
+        return np.array([self.elements[self.plugs[k][0][0], self.plugs[k][0][1]] for k in range(len(self.variables))])
+
+    def update(self, x: np.ndarray):
+        for value, targets in zip(x, self.plugs):
+            for i, index in targets:
+                if self.elements[i, index] != value:
+                    self.elements[i, index] = value
+                    self.matrices[i] = _element_matrix(self.elements[i])
+
+    def optics(self, x: np.ndarray) -> Tuple[np.ndarray, Dict, Dict]:
+        self.update(x)
+        m = _cumulative_maps(self.matrices)
+        initial = _periodic_initial(m[-1]) if self.periodic else self.initial
+        return m, initial, _optics(m, initial)
+
+    def _values(self, optics: Dict) -> np.ndarray:
+        return np.array([optics[MATCH_GLOBAL_PARAMETERS.get(p, p)][location]
+                         for _, location, p, _, _ in self.constraints])
+
+    def _active(self, values: np.ndarray) -> np.ndarray:
+        active = np.ones(len(values), dtype=bool)
+        for k, (_, _, _, op, target) in enumerate(self.constraints):
+            if op == '<':
+                active[k] = values[k] > target
+            elif op == '>':
+                active[k] = values[k] < target
+        return active
+
+    def _weights(self) -> np.ndarray:
+        return np.array([MATCH_WEIGHTS[MATCH_GLOBAL_PARAMETERS.get(p, p)] for _, _, p, _, _ in self.constraints])
+
+    def residuals(self, x: np.ndarray) -> np.ndarray:
+        try:
+            values = self._values(self.optics(x)[2])
+        except MatchException:
+            # Unstable trial point of a periodic match, rejected by the solver
+            return np.full(len(self.constraints), MATCH_UNSTABLE_PENALTY)
+        targets = np.array([c[4] for c in self.constraints])
+        return self._weights() * np.where(self._active(values), values - targets, 0.0)
+
+    def jacobian(self, x: np.ndarray) -> np.ndarray:
+        m, initial, optics = self.optics(x)
+        active = self._active(self._values(optics))
+        jac = np.zeros((len(self.constraints), len(self.variables)))
+        for k, targets in enumerate(self.plugs):
+            dm = np.zeros_like(m)
+            for i, index in targets:
+                # d(M_j...M_1) = (M_j...M_i+1) dM_i (M_i-1...M_1), for all the locations j >= i
+                transfer = m[i + 1:] @ np.linalg.inv(m[i + 1])
+                dm[i + 1:] += transfer @ (_element_derivative(self.elements[i], index) @ m[i])
+            jac[:, k] = self._values(_optics(m, initial, dm))
+        return self._weights()[:, None] * np.where(active[:, None], jac, 0.0)
+
+
+def match(line: Beamline = None,
+          vary: Optional[List] = None,
+          constraints: Optional[List[Dict]] = None,
+          global_constraints: Optional[List[str]] = None,
+          context: Optional[Dict] = None,
+          periodic: bool = True,
+          method: str = 'jacobian',
+          tolerance: float = 1e-10,
+          max_nfev: Optional[int] = None,
+          **kwargs) -> Dict:
+    """
+    Match the optics of a beamline in-process (drop-in replacement of `georges.madx.match`).
+
+    Example:
+        match(line=line,
+              context={'ENERGY': 230.0, 'BETAX': 10.0, 'BETAY': 10.0, 'Q1K1': 1.0, 'Q2K1': -1.0},
+              vary=['Q1K1', {'variable': 'Q2K1', 'lower': -5.0, 'upper': 0.0}],
+              constraints=[{'range': 'M1', 'constraint': 'betx=5.0, alfx=0.0, alfy=0.0'}],
+              periodic=False)
+
+    :param line: the beamline (the variables are plugged in the elements with the PLUG and CIRCUIT columns)
+    :param vary: the variables (context keys, or dictionaries with the 'variable', 'lower' and 'upper' keys)
+    :param constraints: the constraints (dictionaries with the 'range' and 'constraint' keys, or the PTC-style
+    'range', 'parameter' and 'value' keys)
+    :param global_constraints: the global constraints ('Q1=...', 'Q2=...'; total phase advances for a line)
+    :param context: the context (energy, variables and, for a line, the initial conditions BETAX, ALPHAX, etc.)
+    :param periodic: match the periodic solution (ring) or propagate the initial conditions (line)
+    :param method: the MAD-X method name ('lmdif' uses Levenberg-Marquardt when no bounds are given, the other
+    methods use a trust region reflective algorithm)
+    :param tolerance: the tolerance on the variables and on the penalty function
+    :param max_nfev: maximum number of evaluations of the optics
+    :param kwargs: other parameters of `georges.madx.match` (ignored)
+    :return: a dictionary with the constraints, the variables, the penalty, a summary and the matched context
+    """
+    if line is None:
+        raise MatchException("A beamline needs to be defined.")
+    if method not in MATCH_METHODS:
+        raise MatchException("Invalid 'method' for matching. Please provide a valid entry.")
+    context = context or {}
+    matcher = _Matcher(line, context, vary or [], constraints or [], global_constraints or [], periodic)
+    if len(matcher.variables) == 0 or len(matcher.constraints) == 0:
+        raise MatchException("At least one variable and one constraint need to be defined.")
+
+    x0 = matcher.x0()
+    if periodic:
+        matcher.optics(x0)  # Raises if the initial one-turn map is unstable
+    lower, upper = np.array(matcher.lower), np.array(matcher.upper)
+    bounded = np.any(np.isfinite(lower)) or np.any(np.isfinite(upper))
+    solver = MATCH_METHODS[method]
+    if solver == 'lm' and (bounded or len(matcher.constraints) < len(matcher.variables)):
+        solver = 'trf'
+    solution = least_squares(matcher.residuals,
+                             np.clip(x0, lower, upper),
+                             jac='2-point' if periodic else matcher.jacobian,
+                             bounds=(lower, upper) if solver != 'lm' else (-np.inf, np.inf),
+                             method=solver,
+                             xtol=tolerance,
+                             ftol=tolerance,
+                             gtol=tolerance,
+                             max_nfev=max_nfev,
+                             )
+
+    optics = matcher.optics(solution.x)[2]
+    values = matcher._values(optics)
+    penalty = float(np.sum(matcher.residuals(solution.x) ** 2))
+    data = {
+        'constraints': {},
+        'variables': {},
+        'penalty': penalty,
+        'summary': [
+            'MATCH SUMMARY',
+            f"Solver: {solver}, evaluations: {solution.nfev}, status: {solution.message}",
+        ],
+    }
+    for (name, _, p, op, target), value in zip(matcher.constraints, values):
+        data['constraints'].setdefault(name, {})[p.lower()] = {'target': target, 'final': float(value)}
+        data['summary'].append(f"{name:<16} {p.lower():<6} {op} {target: .6e} {value: .6e}")
+    matched_context = context.copy()
+    for name, initial, final in zip(matcher.variables, x0, solution.x):
+        data['variables'][name] = {'initial': float(initial), 'final': float(final)}
+        data['summary'].append(f"{name:<16} {final: .6e} {initial: .6e}")
+        matched_context[name] = float(final)
+    data['summary'].append(f"Final Penalty Function = {penalty:.8e}")
+    data['summary'].append('END MATCH SUMMARY')
+    data['context'] = matched_context
+    return data
@@ -1,7 +1,18 @@
 from typing import Optional, List, Callable
+import queue as _queue
+import threading as _threading
 import numpy as _np
 
-__all__ = ['Observer']
+__all__ = ['Observer', 'StoreObserver', 'AsyncStoreObserver', 'ArrayObserver', 'ObserverException']
+
+ASYNC_QUEUE_SIZE: int = 16
+
+
+class ObserverException(Exception):
+    """Exception raised for errors in the Observers module."""
+
+    def __init__(self, m):
+        self.message = m
 
 
 def identity_copy(x: _np.array) -> _np.array:
@@ -9,6 +20,8 @@ def identity_copy(x: _np.array) -> _np.array:
 
 
 class Observer:
+    # Observers receiving the indices of the transmitted particles in the initial beam (ids keyword argument)
+    uses_ids: bool = False
 
     def __init__(self, turns: int = 1, elements: Optional[List[int]] = None, func: Callable = identity_copy):
         self._data = _np.empty(shape=(turns, max((len(elements), 1))), dtype=object)
@@ -26,3 +39,180 @@ class Observer:
 
     def __call__(self, turn, element, beam):
         self._data[turn, element] = self._func(beam)
+
+
+class StoreObserver(Observer):
+    """Observer writing the observed beams to a `georges.store.TrackingStore` instead of keeping them in memory.
+
+    The indices of the particles in the initial beam (shifted by `offset`, e.g. the number of particles of the previous
+    chunks) are written in the ID column of the store.
+    """
+    uses_ids = True
+
+    def __init__(self,
+                 store,
+                 turns: int = 1,
+                 elements: Optional[List[int]] = None,
+                 names: Optional[List[str]] = None,
+                 offset: int = 0):
+        """
+        :param store: a TrackingStore opened for writing
+        :param turns: number of turns
+        :param elements: indices of the observed elements
+        :param names: names of the observed elements (default: the element indices)
+        :param offset: offset added to the indices of the particles
+        """
+        self._data = None
+        self._turns = turns
+        self._elements = elements or []
+        self._names = names or list(map(str, self._elements))
+        self._store = store
+        self.offset = offset
+
+    @property
+    def store(self):
+        return self._store
+
+    def _ids(self, ids):
+        return None if ids is None else ids + self.offset
+
+    def __call__(self, turn, element, beam, ids=None):
+        self._store.write(self._names[element], beam, turn=turn, ids=self._ids(ids))
+
+
+class AsyncStoreObserver(StoreObserver):
+    """
+    Observer handing the observed beams to a background thread writing them to a `georges.store.TrackingStore`, so
+    that the tracking and the serialization overlap. The snapshots go through a bounded queue: when the writer falls
+    behind, the tracking blocks until a slot is free (back-pressure), which bounds the memory used by the pending
+    snapshots. The observer must be closed (see `close`) before the store.
+    """
+
+    def __init__(self,
+                 store,
+                 turns: int = 1,
+                 elements: Optional[List[int]] = None,
+                 names: Optional[List[str]] = None,
+                 func: Callable = identity_copy,
+                 maxsize: int = ASYNC_QUEUE_SIZE):
+        """
+        :param store: a TrackingStore opened for writing
+        :param turns: number of turns
+        :param elements: indices of the observed elements
+        :param names: names of the observed elements (default: the element indices)
+        :param func: snapshot of the beam taken in the tracking thread (default: a copy), e.g. a subset of the
+        particles (their indices are then not stored); the result must be writable to the store
+        :param maxsize: maximum number of pending snapshots
+        """
+        super().__init__(store, turns, elements, names)
+        self._func = func
+        self._queue = _queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = _threading.Thread(target=self.__write, daemon=True)
+        self._thread.start()
+
+    def __write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    self._store.write(item[0], item[1], turn=item[2], ids=item[3])
+                except Exception as e:
+                    # The queue is still drained so that the tracking thread is never blocked
+                    self._error = e
+
+    def __raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    @property
+    def pending(self) -> int:
+        """Number of snapshots waiting to be written."""
+        return self._queue.qsize()
+
+    def __call__(self, turn, element, beam, ids=None):
+        if self._thread is None:
+            raise ObserverException("The observer is closed.")
+        self.__raise()
+        snapshot = self._func(beam)
+        if ids is not None and len(ids) != len(snapshot):
+            ids = None  # The indices of a subset of the particles are unknown
+        self._queue.put((self._names[element], snapshot, turn, self._ids(ids)))
+
+    def close(self, raise_errors: bool = True):
+        """
+        Wait for the pending snapshots to be written.
+        :param raise_errors: raise the errors of the writing thread (discarded otherwise, e.g. when the tracking failed)
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if raise_errors:
+            self.__raise()
+        else:
+            self._error = None
+
+
+class ArrayObserver(Observer):
+    """
+    Observer writing the observed coordinates in place in a single preallocated typed buffer of shape
+    (turns, elements, particles, dims) instead of one array per turn and element. The lost particles are NaN.
+    For large runs, the buffer can be a memory-mapped .npy file.
+    """
+    uses_ids = True
+
+    def __init__(self,
+                 n_particles: int,
+                 turns: int = 1,
+                 elements: Optional[List[int]] = None,
+                 dims: int = 5,
+                 dtype=_np.float64,
+                 filename: Optional[str] = None):
+        """
+        :param n_particles: number of particles of the initial beam
+        :param turns: number of turns
+        :param elements: indices of the observed elements
+        :param dims: number of coordinates stored (the first dims columns of the beam)
+        :param dtype: type of the buffer (e.g. float32 to halve the memory)
+        :param filename: memory-map the buffer onto this .npy file (readable with np.load(filename, mmap_mode='r'))
+        """
+        self._turns = turns
+        self._elements = elements or []
+        self._n_particles = n_particles
+        self._dims = dims
+        shape = (turns, max((len(self._elements), 1)), n_particles, dims)
+        if filename is None:
+            self._data = _np.full(shape, _np.nan, dtype=dtype)
+        else:
+            self._data = _np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+            self._data[...] = _np.nan
+
+    @property
+    def data(self) -> _np.ndarray:
+        """The buffer (no copy), NaN for the lost particles and the elements not reached."""
+        return self._data
+
+    @property
+    def alive(self) -> _np.ndarray:
+        """Mask (turns, elements, particles) of the transmitted particles."""
+        return _np.isfinite(self._data[..., 0])
+
+    def flush(self):
+        if isinstance(self._data, _np.memmap):
+            self._data.flush()
+
+    def __call__(self, turn, element, beam, ids=None):
+        out = self._data[turn, element]
+        if ids is None:
+            if beam.shape[0] != self._n_particles:
+                raise ObserverException("The indices of the transmitted particles are unknown.")
+            out[...] = beam[:, :self._dims]
+        elif len(ids) == self._n_particles:
+            out[...] = beam[:, :self._dims]
+        else:
+            out[...] = _np.nan
+            out[ids] = beam[:, :self._dims]
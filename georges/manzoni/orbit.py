@@ -0,0 +1,189 @@
+"""Orbit response matrices and corrector-based orbit correction.
+
+The response of the beam position monitors (BPM) to the correctors (HKICKER and VKICKER elements, whose KICK is plugged
+to a context variable with the PLUG and CIRCUIT columns) is computed for all the correctors at once from the cumulative
+transfer maps of the line: the transfer map from a corrector to a monitor is the ratio of the two cumulative maps, so
+that no tracking is needed. For a ring, the closed orbit generated by each corrector is obtained from the one-turn map
+at the corrector location.
+
+The correction solves the linear system with a singular value decomposition (SVD), optionally truncated to the largest
+singular values and regularized (Tikhonov), and writes the corrector strengths back into the context.
+"""
+from typing import Optional, List, Dict, Union
+import numpy as np
+import pandas as pd
+from .constants import *
+from .common import convert_line
+from .match import _element_matrix, _cumulative_maps
+from .. import Beamline
+
+ORBIT_BPM_CLASSES = ['MONITOR', 'HMONITOR', 'VMONITOR', 'BPM', 'INSTRUMENT']
+ORBIT_PLANES = ['X', 'Y']
+
+# Coordinate kicked by the correctors
+_CORRECTOR_COORDINATES = {
+    CLASS_CODES['HKICKER']: PX,
+    CLASS_CODES['VKICKER']: PY,
+}
+
+
+class OrbitException(Exception):
+    """Exception raised for errors in the Orbit module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def _correctors(line: Beamline, elements: np.ndarray, correctors: Optional[List[str]]) -> Dict[str, List[int]]:
+    """Map the corrector variables onto the indices of the kicker elements they drive."""
+    plugs = line.line.get('PLUG')
+    circuits = line.line.get('CIRCUIT')
+    found = {}
+    if plugs is not None and circuits is not None:
+        for i, (plug, circuit) in enumerate(zip(plugs.values, circuits.values)):
+            if plug == 'KICK' and elements[i, INDEX_CLASS_CODE] in _CORRECTOR_COORDINATES:
+                found.setdefault(circuit, []).append(i)
+    if correctors is None:
+        correctors = list(found.keys())
+    for c in correctors:
+        if c not in found:
+            raise OrbitException(f"Corrector '{c}' is not plugged in the kick of any HKICKER or VKICKER.")
+    if len(correctors) == 0:
+        raise OrbitException("The line has no corrector.")
+    return {c: found[c] for c in correctors}
+
+
+def _bpms(line: Beamline, bpms: Optional[List[str]]) -> List[str]:
+    names = list(line.line.index.values)
+    if bpms is None:
+        bpms = [n for n, c in zip(names, line.line['CLASS'].values) if c in ORBIT_BPM_CLASSES]
+    for b in bpms:
+        if b not in names:
+            raise OrbitException(f"Monitor '{b}' is not in the line.")
+    if len(bpms) == 0:
+        raise OrbitException("The line has no beam position monitor.")
+    return list(bpms)
+
+
+def response_matrix(line: Beamline,
+                    context: Optional[Dict] = None,
+                    bpms: Optional[List[str]] = None,
+                    correctors: Optional[List[str]] = None,
+                    periodic: bool = False) -> pd.DataFrame:
+    """
+    Compute the orbit response matrix of the beam position monitors to the correctors.
+
+    Example:
+        r = response_matrix(line, context={'ENERGY': 230.0}, periodic=True)
+        r.loc['X']  # Horizontal response (m/rad) of the monitors (rows) to the correctors (columns)
+
+    :param line: the beamline (the correctors are the context variables plugged in the KICK of the HKICKER and
+    VKICKER elements with the PLUG and CIRCUIT columns)
+    :param context: the context
+    :param bpms: names of the monitors (default: the elements of class MONITOR, HMONITOR, VMONITOR, BPM or INSTRUMENT)
+    :param correctors: the corrector variables (default: all the variables plugged in the kickers)
+    :param periodic: closed orbit response of a ring or trajectory response of a transfer line
+    :return: a dataframe of the responses (m/rad) indexed by plane and monitor, with one column per corrector
+    """
+    context = context or {}
+    elements = convert_line(line.line, context)
+    m = _cumulative_maps(np.array([_element_matrix(e) for e in elements]))[:, :4, :4]
+    bpms = _bpms(line, bpms)
+    correctors = _correctors(line, elements, correctors)
+    names = list(line.line.index.values)
+
+    # Kicked elements (the kick is applied at the exit of the element) and unit kicks
+    kicked = np.array([i + 1 for indices in correctors.values() for i in indices])
+    owner = np.repeat(np.arange(len(correctors)), [len(indices) for indices in correctors.values()])
+    kicks = np.zeros((len(kicked), 4))
+    kicks[np.arange(len(kicked)), [_CORRECTOR_COORDINATES[elements[i - 1, INDEX_CLASS_CODE]] for i in kicked]] = 1.0
+    inverse = np.linalg.inv(m[kicked])
+    if periodic:
+        # Closed orbit at the kick: (I - T) u = k, with T the one-turn map from the kick location
+        one_turn = m[kicked] @ m[-1] @ inverse
+        kicks = np.linalg.solve(np.identity(4) - one_turn, kicks[..., None])[..., 0]
+    w = np.einsum('kij,kj->ki', inverse, kicks)
+
+    # Orbit at the monitors (exit of the elements), downstream of the kick or after one turn for a ring
+    located = np.array([names.index(b) + 1 for b in bpms])
+    downstream = located[:, None] >= kicked[None, :]
+    orbit = np.einsum('bij,kj->bki', m[located], w)
+    if periodic:
+        orbit = np.where(downstream[..., None], orbit, np.einsum('bij,kj->bki', m[located] @ m[-1], w))
+    else:
+        orbit = np.where(downstream[..., None], orbit, 0.0)
+
+    # Sum the elements driven by the same corrector
+    response = np.zeros((len(bpms), len(correctors), 2))
+    np.add.at(response, (slice(None), owner), orbit[..., [X, Y]])
+    return pd.DataFrame(np.concatenate([response[..., 0], response[..., 1]]),
+                        index=pd.MultiIndex.from_product([ORBIT_PLANES, bpms], names=['PLANE', 'BPM']),
+                        columns=pd.Index(list(correctors.keys()), name='CORRECTOR'))
+
+
+def correct_orbit(line: Beamline,
+                  orbit: Union[pd.DataFrame, Dict],
+                  context: Optional[Dict] = None,
+                  correctors: Optional[List[str]] = None,
+                  periodic: bool = False,
+                  n_singular: Optional[int] = None,
+                  alpha: float = 0.0,
+                  response: Optional[pd.DataFrame] = None) -> Dict:
+    """
+    Correct the orbit measured at the beam position monitors with the correctors.
+
+    The correction minimizes |R dk + orbit|^2 + alpha^2 |dk|^2 using the singular value decomposition of the
+    response matrix R, restricted to the n_singular largest singular values.
+
+    Example:
+        r = response_matrix(line, context=context)
+        correction = correct_orbit(line, orbit=pd.DataFrame({'X': x, 'Y': y}, index=bpms), context=context,
+                                   response=r, n_singular=20)
+        correction['context']  # Context with the corrected kicks
+
+    :param line: the beamline
+    :param orbit: the measured orbit (m), a dataframe (or dictionary) with the X and/or Y columns indexed by monitor
+    names; monitors with NaN readings are ignored
+    :param context: the context (the current corrector strengths default to 0)
+    :param correctors: the corrector variables (default: all the variables plugged in the kickers)
+    :param periodic: closed orbit (ring) or trajectory (transfer line) correction
+    :param n_singular: number of singular values used (default: all)
+    :param alpha: Tikhonov regularization parameter (m/rad)
+    :param response: a response matrix computed with `response_matrix`, reused instead of being recomputed
+    :return: a dictionary with the corrector strength changes ('kicks'), the predicted orbit after correction
+    ('orbit'), the singular values and the corrected context
+    """
+    context = context or {}
+    orbit = pd.DataFrame(orbit)
+    planes = [p for p in ORBIT_PLANES if p in orbit.columns]
+    if len(planes) == 0:
+        raise OrbitException("The orbit needs an 'X' or a 'Y' column.")
+    if response is None:
+        response = response_matrix(line, context, list(orbit.index.values), correctors, periodic)
+    elif correctors is not None:
+        response = response[correctors]
+    measured = pd.concat({p: orbit[p] for p in planes}, names=['PLANE', 'BPM'])
+    measured = measured[measured.notna()]
+    missing = measured.index.difference(response.index)
+    if len(missing) > 0:
+        raise OrbitException(f"No response for the monitors {list(missing)}.")
+    r = response.loc[measured.index].values
+
+    u, s, vt = np.linalg.svd(r, full_matrices=False)
+    n = len(s) if n_singular is None else min(int(n_singular), len(s))
+    # Singular values below the numerical precision (e.g. correctors without downstream monitors) are discarded
+    used = np.arange(len(s)) < n
+    used &= s > s[0] * np.finfo(float).eps * max(r.shape)
+    s_inverse = np.zeros(len(s))
+    s_inverse[used] = s[used] / (s[used] ** 2 + alpha ** 2)
+    kicks = -vt.T @ (s_inverse * (u.T @ measured.values))
+
+    corrected_context = context.copy()
+    for name, kick in zip(response.columns, kicks):
+        corrected_context[name] = context.get(name, 0.0) + float(kick)
+    return {
+        'kicks': pd.Series(kicks, index=response.columns),
+        'orbit': pd.Series(measured.values + r @ kicks, index=measured.index),
+        'singular_values': s,
+        'context': corrected_context,
+    }
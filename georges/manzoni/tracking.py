@@ -1,10 +1,13 @@
-from typing import Dict
+import contextlib
+from typing import Dict, Iterable, Union
+import numpy as np
 import pandas as pd
 from . import manzoni
-from .common import _process_model_argument
-from .observers import Observer
+from .common import _process_model_argument, convert_line
+from .observers import Observer, StoreObserver, AsyncStoreObserver
 from .. import Beamline
 from .. import Beam
+from ..store import TrackingStore
 
 
 class TrackException(Exception):
@@ -14,7 +17,43 @@ class TrackException(Exception):
         self.message = m
 
 
-def track(model=None, line: Beamline = None, beam: Beam = None, context: Dict = {}, **kwargs) -> Beamline:
+def _open(store: Union[str, TrackingStore]):
+    """Return the tracking store and whether it is opened (and then closed) by the tracking."""
+    if isinstance(store, str):
+        return TrackingStore(store, mode='w'), True
+    return store, False
+
+
+@contextlib.contextmanager
+def _closing(observer: StoreObserver, store: TrackingStore, close_store: bool):
+    """Close the observer (and the store if it was opened by the tracking) after the tracking; if the tracking fails,
+    its error is raised rather than an error of the writing thread of an asynchronous observer."""
+    try:
+        yield
+    except BaseException:
+        if isinstance(observer, AsyncStoreObserver):
+            observer.close(raise_errors=False)
+        if close_store:
+            try:
+                store.close()
+            except Exception:
+                pass  # The error of the tracking is raised
+        raise
+    try:
+        if isinstance(observer, AsyncStoreObserver):
+            observer.close()
+    finally:
+        if close_store:
+            store.close()
+
+
+def track(model=None,
+          line: Beamline = None,
+          beam: Beam = None,
+          context: Dict = {},
+          store=None,
+          asynchronous: bool = False,
+          **kwargs) -> Beamline:
     """
     Compute the distribution of the beam as it propagates through the beamline.
 
@@ -22,12 +61,33 @@ def track(model=None, line: Beamline = None, beam: Beam = None, context: Dict =
     :param line:
     :param beam:
     :param context:
+    :param store: optional TrackingStore opened for writing, or the path of a new store; the beams are then written to
+    disk while tracking and the returned beamline contains the summary table instead of a 'BEAM' column. A store given
+    by its path is closed on return; a TrackingStore is left open (more tracking results can be added to it) and must
+    be closed by the caller
+    :param asynchronous: write to the store in a background thread while tracking (see `AsyncStoreObserver`)
     :param kwargs:
     :return:
     """
     # Process arguments
     v = _process_model_argument(model, line, beam, context, TrackException)
 
+    # Run Manzoni with on-disk storage
+    if store is not None:
+        store, close_store = _open(store)
+        names = list(v['georges_line'].line.index.values)
+        o = (AsyncStoreObserver if asynchronous else StoreObserver)(
+            store, elements=list(range(len(v['manzoni_line']))), names=names)
+        with _closing(o, store, close_store):
+            manzoni.track(line=v['manzoni_line'], beam=v['manzoni_beam'], observer=o, **kwargs)
+        return Beamline(
+            v['georges_line'].line.merge(
+                store.summary.xs(0, level='TURN'),
+                left_index=True,
+                right_index=True,
+                how='left'
+            ))
+
     # Run Manzoni
     o = Observer(elements=list(range(len(v['manzoni_line']))))
     manzoni.track(line=v['manzoni_line'], beam=v['manzoni_beam'], observer=o, **kwargs)
@@ -50,3 +110,42 @@ def track(model=None, line: Beamline = None, beam: Beam = None, context: Dict =
             right_index=True,
             how='left'
         ).set_index('NAME'))
+
+
+def track_chunks(line: Beamline,
+                 chunks: Iterable[np.ndarray],
+                 store: Union[str, TrackingStore],
+                 context: Dict = {},
+                 asynchronous: bool = False,
+                 **kwargs) -> Beamline:
+    """
+    Track a beam chunk by chunk, writing the results to a tracking store.
+
+    The chunks are typically streamed from a beam file (see `georges.beam_io.iter_beam_chunks`) so that the complete
+    beam never needs to be loaded in memory.
+
+    :param line: the beamline
+    :param chunks: iterable of (n_particles, 5) arrays
+    :param store: a TrackingStore opened for writing, or the path of a new store; a store given by its path is closed
+    on return, a TrackingStore is left open and must be closed by the caller
+    :param context: the context used to convert the beamline
+    :param asynchronous: write to the store in a background thread, overlapping with the tracking of the next chunks
+    :param kwargs: optional parameters passed to the tracking
+    :return: the beamline with the summary table of the tracking store
+    """
+    manzoni_line = convert_line(line.line, context)
+    store, close_store = _open(store)
+    o = (AsyncStoreObserver if asynchronous else StoreObserver)(
+        store, elements=list(range(len(manzoni_line))), names=list(line.line.index.values))
+    with _closing(o, store, close_store):
+        for chunk in chunks:
+            manzoni.track(line=manzoni_line, beam=np.ascontiguousarray(chunk, dtype=np.float64), observer=o, **kwargs)
+            # The particles of the next chunk follow in the ID column
+            o.offset += chunk.shape[0]
+    return Beamline(
+        line.line.merge(
+            store.summary.xs(0, level='TURN'),
+            left_index=True,
+            right_index=True,
+            how='left'
+        ))
@@ -0,0 +1,186 @@
+"""Writers of the particle input files of the external codes (BDSIM, G4Beamline).
+
+The particles are written by chunks with a vectorized fixed-point encoder: each column is converted to integers
+(scaled by the number of decimals) and the digits are laid out in a matrix of characters, so that no Python code runs
+per particle. Derived columns (energies, momenta, units conversions, etc.) are computed chunk by chunk from views on
+the source columns; the distribution is neither copied nor modified. The file can be written in a background thread
+while the rest of the input deck is prepared.
+"""
+from typing import Optional, List, Dict, Callable, Union, Tuple
+import threading
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_SIZE = 500000
+DEFAULT_DECIMALS = 12
+
+Column = Union[str, float, int, Callable[[Dict[str, np.ndarray]], np.ndarray]]
+
+
+class ParticleFileException(Exception):
+    """Exception raised for errors in the ParticleFiles module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+def _digits(values: np.ndarray, n: int, powers: np.ndarray) -> np.ndarray:
+    """Return the (len(values), n) matrix of the characters of the n last digits of integers."""
+    return ((values[:, None] // powers[:n][None, ::-1]) % 10 + ord('0')).astype(np.uint8)
+
+
+def encode_fixed(values: np.ndarray, decimals: Optional[int] = DEFAULT_DECIMALS) -> np.ndarray:
+    """
+    Encode a column of numbers in fixed-point notation (right aligned, same width for all the rows).
+    :param values: the numbers
+    :param decimals: number of decimals (None for integers)
+    :return: a (len(values), width) matrix of characters (uint8)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.isfinite(values)):
+        raise ParticleFileException("Invalid (non finite) values in the particles data.")
+    d = decimals or 0
+    if len(values) > 0 and np.abs(values).max() * 10.0 ** d >= 2.0 ** 63:
+        raise ParticleFileException("Values too large to be encoded with this number of decimals.")
+    scaled = np.rint(np.abs(values) * 10 ** d).astype(np.int64)
+    integer = scaled // 10 ** d
+    n_int = len(str(int(integer.max()))) if len(integer) > 0 else 1
+    powers = 10 ** np.arange(max(n_int, d), dtype=np.int64)
+    n_digits = 1 + (integer[:, None] >= powers[1:n_int][None, :]).sum(axis=1)
+    negative = (values < 0) & (scaled > 0)
+
+    # Sign and integer part, right aligned in a block of n_int + 1 characters
+    block = np.full((len(values), n_int + 1), ord(' '), dtype=np.uint8)
+    digits = _digits(integer, n_int, powers)
+    position = np.arange(n_int)[None, :]
+    visible = position >= (n_int - n_digits)[:, None]
+    block[:, 1:] = np.where(visible, digits, ord(' '))
+    rows = np.flatnonzero(negative)
+    block[rows, n_int - n_digits[rows]] = ord('-')
+    if decimals is None:
+        return block
+
+    # Decimal point and fractional part
+    fraction = np.full((len(values), d + 1), ord('.'), dtype=np.uint8)
+    if d > 0:
+        fraction[:, 1:] = _digits(scaled % 10 ** d, d, powers)
+    return np.concatenate([block, fraction], axis=1)
+
+
+def encode_rows(columns: List[np.ndarray], decimals: List[Optional[int]], separator: str = ' ') -> bytes:
+    """
+    Encode rows of numbers as lines of text.
+    :param columns: the columns (same length)
+    :param decimals: the number of decimals of each column (None for integers)
+    :param separator: the separator of the columns
+    :return: the encoded lines
+    """
+    if len(columns) == 0 or len(columns[0]) == 0:
+        return b''
+    n = len(columns[0])
+    sep = np.frombuffer(separator.encode(), dtype=np.uint8)
+    parts = []
+    for i, (c, d) in enumerate(zip(columns, decimals)):
+        if i > 0:
+            parts.append(np.broadcast_to(sep, (n, len(sep))))
+        parts.append(encode_fixed(c, d))
+    parts.append(np.full((n, 1), ord('\n'), dtype=np.uint8))
+    return np.ascontiguousarray(np.concatenate(parts, axis=1)).tobytes()
+
+
+class ParticleFileWriter:
+    """Chunked writer of particle text files.
+
+    Each column of the file is either the name of a column of the source, a constant, or a function computing the
+    column from a chunk (a dictionary of views on the source columns, plus 'INDEX', the indices of the particles).
+
+    Example:
+        w = ParticleFileWriter('input_beam.dat',
+                               columns=[('X', 'X'), ('E', lambda c: (c['DPP'] + 1) * p0)],
+                               decimals={'E': 6})
+        w.start(beam.distribution)  # returns immediately
+        ...
+        w.wait()
+    """
+
+    def __init__(self,
+                 filename: str,
+                 columns: List[Tuple[str, Column]],
+                 decimals: Optional[Dict[str, Optional[int]]] = None,
+                 header: str = '',
+                 separator: str = ' ',
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param filename: path to the particles file
+        :param columns: list of (name, definition) of the columns of the file
+        :param decimals: number of decimals of the columns (None for integers, default: DEFAULT_DECIMALS)
+        :param header: text written before the particles (e.g. comments)
+        :param separator: separator of the columns
+        :param chunk_size: number of particles encoded at once
+        """
+        self._filename = filename
+        self._columns = columns
+        self._decimals = [(decimals or {}).get(name, DEFAULT_DECIMALS) for name, _ in columns]
+        self._header = header
+        self._separator = separator
+        self._chunk_size = chunk_size
+        self._thread = None
+        self._error = None
+
+    @property
+    def filename(self) -> str:
+        """Return the path to the particles file."""
+        return self._filename
+
+    def __chunk_columns(self, source: Dict[str, np.ndarray], start: int, stop: int) -> List[np.ndarray]:
+        chunk = {k: v[start:stop] for k, v in source.items()}
+        chunk['INDEX'] = np.arange(start, stop)
+        columns = []
+        for name, definition in self._columns:
+            if callable(definition):
+                columns.append(np.asarray(definition(chunk)))
+            elif isinstance(definition, str):
+                columns.append(chunk[definition])
+            else:
+                columns.append(np.full(stop - start, definition))
+        return columns
+
+    def write(self, data):
+        """
+        Write the particles (in the calling thread).
+        :param data: a DataFrame, a Beam or a dictionary of arrays
+        """
+        if hasattr(data, 'distribution'):
+            data = data.distribution
+        if isinstance(data, pd.DataFrame):
+            source = {c: data[c].values for c in data.columns}
+        else:
+            source = {k: np.asarray(v) for k, v in data.items()}
+        n = len(next(iter(source.values()))) if len(source) > 0 else 0
+        with open(self._filename, 'wb') as f:
+            f.write(self._header.encode())
+            for start in range(0, n, self._chunk_size):
+                stop = min(start + self._chunk_size, n)
+                f.write(encode_rows(self.__chunk_columns(source, start, stop), self._decimals, self._separator))
+        return self
+
+    def start(self, data):
+        """Write the particles in a background thread (see `wait`)."""
+        def target():
+            try:
+                self.write(data)
+            except Exception as e:
+                self._error = e
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self):
+        """Wait for the completion of a background write (errors of the writing thread are raised here)."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        return self
@@ -1,4 +1,5 @@
 import numpy as _np
+from scipy.special import erf as _erf
 
 PROTON_MASS = 938.2720813
 ELECTRON_MASS = 0.5109989461
@@ -6,76 +7,100 @@ CHARGED_PION_MASS = 139.57018
 NEUTRAL_PION_MASS = 134.9766
 
 
-def kinematics(units="MeV", **kwargs):
-    """Return a dictionary with all kinematics parameters from a given input."""
-    r = 0
-    e = 0
-    pc = 0
-    brho = 0
-    beta = 0
-    gamma = 1
+KINEMATICS_QUANTITIES = ['range', 'energy', 'momentum', 'brho', 'beta', 'gamma', 'pv']
+KINEMATICS_DTYPE = _np.dtype([(q, _np.float64) for q in KINEMATICS_QUANTITIES])
+
+
+def kinematics_array(mass=PROTON_MASS, quantities=None, **kwargs):
+    """
+    Return a structured array with the kinematics quantities from an array of a single one.
+
+    The quantities are computed in one vectorized pass from the total energy.
+
+    Example:
+        k = kinematics_array(momentum=beam.distribution['DPP'].values * p0 + p0)
+        k['energy'], k['brho']
+
+    :param mass: mass of the particles [MeV/c^2]
+    :param quantities: the quantities to compute (default: KINEMATICS_QUANTITIES)
+    :param kwargs: a single keyword argument (range, energy, momentum, brho, beta, gamma or pv), scalar or array
+    :return: a structured array of the same shape as the input (dtype KINEMATICS_DTYPE for all the quantities)
+    """
+    if len(kwargs) != 1:
+        raise Exception(f"A single keyword argument is expected: {', '.join(KINEMATICS_QUANTITIES)}.")
+    quantity, values = next(iter(kwargs.items()))
+    values = _np.asarray(values, dtype=_np.float64)
+    quantities = KINEMATICS_QUANTITIES if quantities is None else quantities
+    if quantity == 'range':
+        etot = range_to_energy(values) + mass
+    elif quantity == 'energy':
+        etot = values + mass
+    elif quantity == 'momentum':
+        etot = _np.hypot(values, mass)
+    elif quantity == 'brho':
+        etot = _np.hypot(brho_to_momentum(values), mass)
+    elif quantity == 'beta':
+        etot = mass / _np.sqrt(1 - values ** 2)
+    elif quantity == 'gamma':
+        etot = values * mass
+    elif quantity == 'pv':
+        # pv = (Etot^2 - m^2) / Etot
+        etot = 0.5 * (values + _np.sqrt(values ** 2 + 4 * mass ** 2))
+    else:
+        raise Exception(f"Invalid kinematics quantity '{quantity}'.")
+
+    energy = etot - mass
+    momentum = _np.sqrt(energy * (etot + mass))
+    computed = {
+        'energy': lambda: energy,
+        'momentum': lambda: momentum,
+        'brho': lambda: momentum_to_brho(momentum),
+        'gamma': lambda: etot / mass,
+        'beta': lambda: momentum / etot,
+        'pv': lambda: momentum * momentum / etot,
+        'range': lambda: values if quantity == 'range' else energy_to_range(energy),
+    }
+    if quantities is KINEMATICS_QUANTITIES:
+        k = _np.empty(values.shape, dtype=KINEMATICS_DTYPE)
+    else:
+        k = _np.empty(values.shape, dtype=[(q, _np.float64) for q in quantities])
+    with _np.errstate(invalid='ignore', divide='ignore'):
+        for q in quantities:
+            k[q] = computed[q]()
+    return k
+
+
+def kinematics(units="MeV", mass=PROTON_MASS, **kwargs):
+    """Return a dictionary with all kinematics parameters from a given input (scalars or arrays)."""
     if len(kwargs) > 1:
         raise Exception("A single keyword argument is expected: range, energy, momentum, beta, gamma).")
-    if kwargs.get("range"):
-        r = kwargs.get('range')
-        e = range_to_energy(r)
-        pc = energy_to_momentum(e)
-        brho = momentum_to_brho(pc)
-        beta = energy_to_beta(e)
-        gamma = beta_to_gamma(beta)
-    elif kwargs.get('energy'):
-        e = kwargs.get('energy')
-        r = energy_to_range(e)
-        pc = energy_to_momentum(e)
-        brho = momentum_to_brho(pc)
-        beta = energy_to_beta(e)
-        gamma = beta_to_gamma(beta)
-    elif kwargs.get('momentum'):
-        pc = kwargs.get('momentum')
-        e = momentum_to_energy(pc)
-        r = energy_to_range(e)
-        brho = momentum_to_brho(pc)
-        beta = energy_to_beta(e)
-        gamma = beta_to_gamma(beta)
-    elif kwargs.get('beta'):
-        beta = kwargs.get('beta')
-        e = beta_to_energy(beta)
-        pc = energy_to_momentum(e)
-        r = energy_to_range(e)
-        brho = momentum_to_brho(pc)
-        gamma = beta_to_gamma(beta)
-    elif kwargs.get('gamma'):
-        gamma = kwargs.get('gamma')
-        e = gamma_to_energy(gamma)
-        pc = energy_to_momentum(e)
-        brho = momentum_to_brho(pc)
-        r = energy_to_range(e)
-        beta = energy_to_beta(e)
-    elif kwargs.get('brho'):
-        brho = kwargs.get('brho')
-        pc = brho_to_momentum(brho)
-        e = momentum_to_energy(pc)
-        r = energy_to_range(e)
-        beta = energy_to_beta(e)
-        gamma = beta_to_gamma(beta)
-
-    return {
-        'range': r,
-        'energy': e,
-        'momentum': pc,
-        'brho': brho,
-        'beta': beta,
-        'gamma': gamma,
-    }
+    if len(kwargs) == 0 or not _np.any(next(iter(kwargs.values()))):
+        return {
+            'range': 0,
+            'energy': 0,
+            'momentum': 0,
+            'brho': 0,
+            'beta': 0,
+            'gamma': 1,
+        }
+    k = kinematics_array(mass=mass, **kwargs)
+    if k.ndim == 0:
+        return {q: float(k[q]) for q in KINEMATICS_QUANTITIES}
+    return {q: k[q] for q in KINEMATICS_QUANTITIES}
+
 
+def momentum_to_energy(p, mass=PROTON_MASS):
+    """Return E [MeV/c^2] from P [MeV/c]."""
+    return p ** 2 / (_np.sqrt(p ** 2 + mass ** 2) + mass)
 
-def momentum_to_energy(p):
-    """Return E [MeV/c^2] from P [MeV/c] (proton)."""
-    return _np.sqrt(p ** 2 + PROTON_MASS ** 2) - PROTON_MASS
+
+def momentum_to_total_energy(p, mass=PROTON_MASS):
+    """Return the total energy [MeV] from P [MeV/c]."""
+    return _np.sqrt(p ** 2 + mass ** 2)
 
 
 def momentum_to_brho(p):
-    """Return BRHO [T.m] from P [MeV/c] (proton)."""
+    """Return BRHO [T.m] from P [MeV/c] (unit charge)."""
     return 3.33564E-3 * p
 
 
@@ -83,25 +108,23 @@ def brho_to_momentum(brho):
     return brho / 3.33564E-3
 
 
-def brho_to_energy(brho):
-    return momentum_to_energy(brho / 3.33564E-3)
+def brho_to_energy(brho, mass=PROTON_MASS):
+    return momentum_to_energy(brho / 3.33564E-3, mass)
 
 
-def energy_to_brho(e):
-    """Return BRHO [T.m] from E [MeV] (proton)."""
-    return 3.33564E-3 * energy_to_momentum(e)
+def energy_to_brho(e, mass=PROTON_MASS):
+    """Return BRHO [T.m] from E [MeV] (unit charge)."""
+    return 3.33564E-3 * energy_to_momentum(e, mass)
 
 
-def energy_to_momentum(ekin):
-    """Return P [MeV/c] from E [MeV/c^2] (proton)."""
-    E = PROTON_MASS + ekin
-    return _np.sqrt(E ** 2 - PROTON_MASS ** 2)
+def energy_to_momentum(ekin, mass=PROTON_MASS):
+    """Return P [MeV/c] from E [MeV/c^2]."""
+    return _np.sqrt(ekin * (ekin + 2 * mass))
 
 
-def energy_to_beta(ekin):
-    """Return beta relativistic from E [MeV/c^2] (proton)."""
-    gamma = (PROTON_MASS + ekin) / PROTON_MASS
-    return _np.sqrt((gamma ** 2 - 1) / gamma ** 2)
+def energy_to_beta(ekin, mass=PROTON_MASS):
+    """Return beta relativistic from E [MeV/c^2]."""
+    return _np.sqrt(ekin * (ekin + 2 * mass)) / (ekin + mass)
 
 
 def beta_to_gamma(beta):
@@ -109,20 +132,19 @@ def beta_to_gamma(beta):
     return 1/(_np.sqrt(1 - beta ** 2))
 
 
-def gamma_to_energy(gamma):
+def gamma_to_energy(gamma, mass=PROTON_MASS):
     """Return relativistic energy from gamma."""
-    return gamma * PROTON_MASS - PROTON_MASS
+    return (gamma - 1) * mass
 
 
-def beta_to_energy(beta):
+def beta_to_energy(beta, mass=PROTON_MASS):
     """Return relativistic energy from beta."""
-    return beta_to_gamma(beta) * PROTON_MASS - PROTON_MASS
+    return (beta_to_gamma(beta) - 1) * mass
 
 
-def energy_to_pv(energy):
+def energy_to_pv(energy, mass=PROTON_MASS):
     """Return relativistic factor 'pv' from kinetic energy (MeV)."""
-    E = energy + PROTON_MASS
-    return (E**2 - PROTON_MASS**2) / E
+    return energy * (energy + 2 * mass) / (energy + mass)
 
 
 def range_to_energy(r):
@@ -140,14 +162,24 @@ def energy_to_range(e):
     return _np.exp((-c + _np.sqrt(c ** 2 - 4 * b * (d - _np.log(e)))) / (2 * b))
 
 
+def ess_transmission(offset, sigma, slits, dispersion):
+    """
+    Return the transmission of a Gaussian beam through the slits of an energy selection system, as a function of
+    the momentum offset of the beam (analytical convolution of the slits opening with the beam profile).
+    :param offset: momentum offset of the beam (same units as sigma)
+    :param sigma: rms momentum spread of the beam
+    :param slits: half opening of the slits
+    :param dispersion: dispersion at the slits (the slits accept the offsets within slits / dispersion)
+    :return: the transmission (broadcast over the arguments)
+    """
+    acceptance = _np.asarray(slits) / dispersion
+    scale = _np.sqrt(2) * _np.asarray(sigma)
+    return 0.5 * (_erf((acceptance - offset) / scale) + _erf((acceptance + offset) / scale))
+
+
 def compute_ess_transmission(beam_sigma, slits, dispersion):
     """Compute the transmission as a function of the momentum offset (in %) from a simple analytical model."""
     n_steps = 10000
     dx = 3.0/n_steps
-    sigma = beam_sigma/2.8
-    slits_at = slits/dispersion
     error = _np.arange(-1.5, 1.5, dx)
-    slits = _np.zeros(n_steps)
-    slits[_np.where((error < slits_at) & (error > -slits_at))] = 1.0
-    beam = _np.exp(-(error / sigma) ** 2 / 2)
-    return _np.roll(_np.convolve(slits, beam, mode="same"), -1) / _np.trapz(beam)
+    return ess_transmission(error, beam_sigma / 2.8, slits, dispersion)
@@ -1,5 +1,3 @@
-import sys
-import inspect
 import pandas as pd
 import numpy as np
 
@@ -10,17 +8,57 @@ def compute_derived_data(row):
     if pd.isnull(row.get('CLASS')):
         row['CLASS'] = row.get('TYPE', 'MARKER')
     # Apply transformations
-    all_converters = [e[0].upper() for e in inspect.getmembers(sys.modules[__name__], inspect.isfunction)
-                      if e[0] is not "compute_derived_data"]
-    for d in row.index | all_converters:
+    for d in row.index | list(CONVERTERS.keys()):
         if pd.isnull(row.get(d)) and not pd.isnull(row.get(d + '_ELEMENT')):
             row[d] = row[d + '_ELEMENT']
         if pd.isnull(row.get(d)):
-            row[d] = getattr(sys.modules[__name__], d.lower(), lambda r: np.nan)(row)
+            row[d] = CONVERTERS.get(d, lambda r: np.nan)(row)
 
     return row
 
 
+def expand_sequence_data(line: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the derived data of all the elements of a sequence.
+
+    Column-wise equivalent of applying `compute_derived_data` on each row until a fixed point is reached: each converter
+    is applied on all the elements at once, with masks selecting the missing values. The number of passes is bounded by
+    the number of converters (each pass either fills a new value or terminates).
+    :param line: the sequence (a DataFrame with one row per element)
+    :return: a new DataFrame with the derived columns
+    """
+    s = line.copy()
+
+    # Corner case
+    if 'CLASS' not in s:
+        s['CLASS'] = s['TYPE'] if 'TYPE' in s else 'MARKER'
+    elif s['CLASS'].isnull().any():
+        s['CLASS'] = s['CLASS'].where(s['CLASS'].notnull(), s['TYPE'] if 'TYPE' in s else 'MARKER')
+
+    # Missing columns and values inherited from the elements definitions
+    for d in sorted(set(s.columns) | set(CONVERTERS.keys())):
+        if d not in s:
+            s[d] = np.nan
+        if d + '_ELEMENT' in s:
+            s[d] = s[d].where(s[d].notnull(), s[d + '_ELEMENT'])
+
+    # Apply the converters until a fixed point is reached
+    for _ in range(len(CONVERTERS) + 1):
+        changed = False
+        for d, converter in VECTORIZED_CONVERTERS.items():
+            missing = s[d].isnull()
+            if not missing.any():
+                continue
+            values = converter(s)
+            fill = missing & values.notnull()
+            if fill.any():
+                s.loc[fill, d] = values[fill]
+                changed = True
+        if not changed:
+            break
+    return s
+
+
 def at_entry(r):
     """Try to compute the element's entry 's' position from other data."""
     if pd.isnull(r.get('ORBIT_LENGTH')):
@@ -76,3 +114,57 @@ def orbit_length(r):
     else:
         # SBEND
         return r['ANGLE'] * r['RHO'] / 1000.0
+
+
+def _column(s, c):
+    return pd.to_numeric(s[c], errors='coerce') if c in s else pd.Series(np.nan, index=s.index)
+
+
+def _at_entry(s):
+    return (_column(s, 'AT_CENTER') - _column(s, 'ORBIT_LENGTH') / 2.0).fillna(
+        _column(s, 'AT_EXIT') - _column(s, 'ORBIT_LENGTH'))
+
+
+def _at_center(s):
+    return (_column(s, 'AT_ENTRY') + _column(s, 'ORBIT_LENGTH') / 2.0).fillna(
+        _column(s, 'AT_EXIT') - _column(s, 'ORBIT_LENGTH') / 2.0)
+
+
+def _at_exit(s):
+    return (_column(s, 'AT_ENTRY') + _column(s, 'ORBIT_LENGTH')).fillna(
+        _column(s, 'AT_CENTER') + _column(s, 'ORBIT_LENGTH') / 2.0)
+
+
+def _length(s):
+    return _column(s, 'ORBIT_LENGTH')
+
+
+def _orbit_length(s):
+    l = _column(s, 'LENGTH')
+    rho = _column(s, 'RHO')
+    angle = _column(s, 'ANGLE')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.Series(np.select(
+            [
+                l.isnull() & rho.isnull(),
+                angle.isnull() | (angle == 0.0),
+                rho.isnull(),
+            ],
+            [
+                0.0,
+                l,
+                angle * l / (2.0 * np.sin(angle / 2.0)),  # RBEND
+            ],
+            angle * rho / 1000.0  # SBEND
+        ), index=s.index)
+
+
+# Converters are looked up once (in the order used by `compute_derived_data`)
+CONVERTERS = {f.__name__.upper(): f for f in (at_center, at_entry, at_exit, length, orbit_length)}
+VECTORIZED_CONVERTERS = {
+    'AT_CENTER': _at_center,
+    'AT_ENTRY': _at_entry,
+    'AT_EXIT': _at_exit,
+    'LENGTH': _length,
+    'ORBIT_LENGTH': _orbit_length,
+}
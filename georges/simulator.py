@@ -1,8 +1,22 @@
+from typing import Optional, List, Callable, Iterable, Tuple, AsyncIterator
+import re
 import shutil
+import asyncio
+import subprocess as sub
 import jinja2
 import os
 import os.path
 import sys
+import time
+import json
+import pickle
+import hashlib
+import signal
+import tempfile
+import traceback
+import threading
+import multiprocessing
+import multiprocessing.connection
 
 
 class SimulatorException(Exception):
@@ -13,7 +27,15 @@ class SimulatorException(Exception):
 
 
 class Simulator:
-    """Base class to support external 'simulator' programs (MAD-X, BDSim, etc.)."""
+    """Base class to support external 'simulator' programs (MAD-X, BDSim, etc.).
+
+    Subclasses define `_prepare_run`, which writes the input files and returns the command to be run; the simulator can
+    then be run synchronously (`run`) or as an asyncio subprocess (`run_async`).
+    """
+
+    WARNING_PATTERN = 'warning|fatal'
+    FATAL_PATTERN = 'fatal'
+    PROGRESS_PATTERN = None
 
     def __init__(self, beamlines=None, path=None, **kwargs):
         """
@@ -30,6 +52,8 @@ class Simulator:
         self._context = {}
         self._last_context = None
         self._path = path
+        self._input_files = []
+        self._writers = []
         self._beamlines = []
         if beamlines and not isinstance(beamlines, list):
             raise SimulatorException("The 'beamlines' argument must be a list (if defined).")
@@ -40,6 +64,181 @@ class Simulator:
         """Attach a beamline to the simulator instance."""
         self._beamlines.append(beamline)
 
+    @staticmethod
+    def run_jobs(jobs: List['SimulatorJob'], max_workers: Optional[int] = None, timeout: Optional[float] = None,
+                 **kwargs) -> List['SimulatorJobResult']:
+        """
+        Run simulator jobs concurrently, each one in a private temporary working directory (see `SimulatorJobRunner`).
+        :param jobs: list of jobs
+        :param max_workers: maximum number of concurrent jobs (default: number of CPUs)
+        :param timeout: maximum duration (in seconds) of each job
+        :return: the list of results (in the same order as the jobs)
+        """
+        return SimulatorJobRunner(max_workers=max_workers, timeout=timeout, **kwargs).run(jobs)
+
+    def _prepare_run(self, **kwargs) -> Optional[dict]:
+        """
+        Prepare a run (input files, etc.).
+        :return: a dictionary with the shell command ('cmd'), the data piped to the process ('input', optional) and the
+        working directory ('cwd'); None if the simulator must not be run
+        """
+        raise SimulatorException("The simulator does not define how to run.")
+
+    def _finalize_run(self, output: str, **kwargs):
+        """Process the output of a run (also used to clean up the input files)."""
+        self._output = output
+        lines = output.split('\n')
+        self._warnings = [line for line in lines if re.search(self.WARNING_PATTERN, line)]
+        self._fatals = [line for line in lines if re.search(self.FATAL_PATTERN, line)]
+        self._last_context = kwargs.get("context", {})
+        if kwargs.get('debug', False):
+            print(self._output)
+
+    def _add_input_file(self, filename: str, writer=None):
+        """
+        Register an input file of the runs (used for the cache key).
+        :param filename: path to the input file
+        :param writer: a ParticleFileWriter writing the file in the background (waited for before running)
+        """
+        self._input_files.append(filename)
+        if writer is not None:
+            self._writers.append(writer)
+
+    def _wait_input_files(self):
+        """Wait for the completion of the input files written in the background."""
+        while len(self._writers) > 0:
+            self._writers.pop(0).wait()
+
+    def run(self, **kwargs):
+        """Run the simulator as a subprocess."""
+        self._wait_input_files()
+        command = self._prepare_run(**kwargs)
+        if command is None:
+            return self
+        p = sub.Popen(command['cmd'],
+                      stdin=sub.PIPE,
+                      stdout=sub.PIPE,
+                      stderr=sub.STDOUT,
+                      cwd=command.get('cwd', '.'),
+                      shell=True
+                      )
+        output = p.communicate(input=command.get('input'))[0].decode()
+        self._finalize_run(output, **kwargs)
+        return self
+
+    async def run_async(self, on_event: Optional[Callable[[str, str], None]] = None, abort_on_fatal: bool = True,
+                        **kwargs):
+        """
+        Run the simulator as an asyncio subprocess.
+
+        The output is parsed line by line: the warnings, fatal errors and progress lines are reported as they arrive to
+        the `on_event` callback (called with the kind of event, 'warning', 'fatal' or 'progress', and the line).
+        :param on_event: callback for the events (optional)
+        :param abort_on_fatal: kill the process on the first fatal error
+        :param kwargs: parameters of the run (as for `run`)
+        :return: the simulator instance, with the output, warnings and fatals of the run
+        """
+        self._wait_input_files()
+        command = self._prepare_run(**kwargs)
+        if command is None:
+            return self
+        p = await asyncio.create_subprocess_shell(command['cmd'],
+                                                  stdin=asyncio.subprocess.PIPE,
+                                                  stdout=asyncio.subprocess.PIPE,
+                                                  stderr=asyncio.subprocess.STDOUT,
+                                                  cwd=command.get('cwd', '.'),
+                                                  )
+
+        async def feed():
+            try:
+                if command.get('input') is not None:
+                    p.stdin.write(command['input'])
+                    await p.stdin.drain()
+                p.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        feeder = asyncio.ensure_future(feed())
+        lines = []
+        try:
+            while True:
+                raw = await p.stdout.readline()
+                if not raw:
+                    break
+                line = raw.decode(errors='replace').rstrip('\n')
+                lines.append(line)
+                kind = self._classify(line)
+                if kind is not None and on_event is not None:
+                    on_event(kind, line)
+                if kind == 'fatal' and abort_on_fatal:
+                    p.kill()
+                    break
+            await p.wait()
+        finally:
+            if p.returncode is None:
+                p.kill()
+                await p.wait()
+            feeder.cancel()
+        self._finalize_run('\n'.join(lines), **kwargs)
+        return self
+
+    def _classify(self, line: str) -> Optional[str]:
+        """Return the kind of event of an output line ('fatal', 'warning', 'progress' or None)."""
+        if re.search(self.FATAL_PATTERN, line):
+            return 'fatal'
+        if re.search(self.WARNING_PATTERN, line):
+            return 'warning'
+        if self.PROGRESS_PATTERN is not None and re.search(self.PROGRESS_PATTERN, line):
+            return 'progress'
+        return None
+
+    def render(self, context: Optional[dict] = None) -> str:
+        """Return the input rendered with a given context."""
+        return jinja2.Template(self._input).render(context or {})
+
+    def _cache_input(self, context: Optional[dict] = None) -> str:
+        """Return the description of the run used for the cache key (default: the rendered input)."""
+        return self.render(context)
+
+    def run_cached(self, collect: Callable, files=(), **kwargs):
+        """
+        Run the simulator and collect its (parsed) outputs, using the result cache given by the `cache` keyword argument.
+
+        On a cache hit the simulator is not run: the collected outputs, the output, the warnings and the fatal errors
+        of the cached run are restored. Without cache the simulator is always run.
+        :param collect: function called with the working directory to collect the outputs after a successful run
+        :param files: additional input files (beam files, geometry files, etc.)
+        :param kwargs: parameters of the `run` method and `cache` (a SimulatorCache)
+        :return: the value returned by collect (None if the run ended with fatal errors)
+        """
+        cache = kwargs.get('cache')
+        context = kwargs.get('context', {})
+        key = None
+        if cache is not None:
+            self._wait_input_files()
+            key = cache.key(self._cache_input(context),
+                            files=list(self._input_files) + list(files),
+                            executable=self.executable or self._exec,
+                            extra=getattr(collect, '__qualname__', None),
+                            )
+            entry = cache.get(key)
+            if entry is not None:
+                self._output = entry['output']
+                self._warnings = entry['warnings']
+                self._fatals = entry['fatals']
+                self._last_context = context
+                return entry['value']
+        self.run(**kwargs)
+        value = collect(kwargs.get('cwd', '.')) if len(self._fatals) == 0 else None
+        if cache is not None:
+            cache.put(key, {
+                'value': value,
+                'output': self._output,
+                'warnings': self._warnings,
+                'fatals': self._fatals,
+            })
+        return value
+
     @property
     def executable(self):
         return self._get_exec()
@@ -54,7 +253,7 @@ class Simulator:
             if os.path.isfile(f"{sys.prefix}/bin/{self._exec}"):
                 return f"{sys.prefix}/bin/{self._exec}"
             else:
-                return shutil.which(self._exec, path=os.path.join(os.environ['PATH'], '/usr/local/bin'))
+                return shutil.which(self._exec, path=os.pathsep.join([os.environ['PATH'], '/usr/local/bin']))
 
     def _add_input(self, keyword, *args, **kwargs):
         """Uses the simulator's own syntax to add to the input"""
@@ -95,3 +294,324 @@ class Simulator:
     def beamlines(self):
         """Return the list of beamlines attached to the simulator."""
         return self._beamlines
+
+
+async def as_completed_runs(runs: Iterable[Tuple[Simulator, dict]],
+                            max_concurrency: int = 8,
+                            ) -> AsyncIterator[Tuple[int, Simulator]]:
+    """
+    Run simulators concurrently (at most `max_concurrency` processes at the same time) and yield them as they complete.
+    :param runs: iterable of (simulator, run parameters) pairs
+    :param max_concurrency: maximum number of simulators running at the same time
+    :return: an asynchronous iterator on (index of the run, simulator) pairs, in order of completion
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(i, simulator, kwargs):
+        async with semaphore:
+            return i, await simulator.run_async(**kwargs)
+
+    tasks = [asyncio.ensure_future(run(i, s, kwargs)) for i, (s, kwargs) in enumerate(runs)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def gather_runs(runs: Iterable[Tuple[Simulator, dict]], max_concurrency: int = 8) -> List[Simulator]:
+    """
+    Run simulators concurrently (at most `max_concurrency` processes at the same time) and wait for all of them.
+    :param runs: iterable of (simulator, run parameters) pairs
+    :param max_concurrency: maximum number of simulators running at the same time
+    :return: the list of simulators (in the same order as the runs)
+    """
+    runs = list(runs)
+    results = [None] * len(runs)
+    async for i, simulator in as_completed_runs(runs, max_concurrency):
+        results[i] = simulator
+    return results
+
+
+def _executable_identity(executable: Optional[str]) -> str:
+    """Identity of an executable: its real path, size and modification time (or its name if it is not found)."""
+    if executable is None or not os.path.isfile(executable):
+        return str(executable)
+    stat = os.stat(os.path.realpath(executable))
+    return f"{os.path.realpath(executable)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class SimulatorCache:
+    """Content-addressed on-disk cache of simulator results.
+
+    The key is the sha256 of the rendered input, of the content of the auxiliary input files and of the identity of the
+    executable (path, size and modification time, which changes with the installed version). Each entry stores the
+    collected (parsed) outputs with the output, warnings and fatal errors of the run. The total size of the cache is
+    bounded: the least recently used entries are evicted first.
+    """
+
+    def __init__(self,
+                 path: str = os.path.join(os.path.expanduser('~'), '.cache', 'georges', 'simulators'),
+                 max_size: int = 2**30,
+                 ):
+        """
+        :param path: directory of the cache (created if needed)
+        :param max_size: maximum size of the cache on disk (in bytes)
+        """
+        self._path = path
+        self._max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        """Return the directory of the cache."""
+        return self._path
+
+    @property
+    def size(self) -> int:
+        """Return the size of the cache on disk (in bytes)."""
+        return sum(os.path.getsize(os.path.join(self._path, f)) for f in os.listdir(self._path))
+
+    def key(self, simulator_input: str, files=(), executable: Optional[str] = None, extra=None) -> str:
+        """
+        Compute the key of a simulator run.
+        :param simulator_input: the rendered input
+        :param files: auxiliary input files (only their content is used)
+        :param executable: path to the executable
+        :param extra: additional data distinguishing the collected outputs (JSON serializable)
+        :return: the key (hexadecimal digest)
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps({'executable': _executable_identity(executable), 'extra': extra}).encode())
+        h.update(simulator_input.encode())
+        for f in files:
+            with open(f, 'rb') as data:
+                for block in iter(lambda: data.read(1 << 20), b''):
+                    h.update(block)
+        return h.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self._path, key + '.pkl')
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return a cached entry (None if the key is not in the cache) and mark it as recently used."""
+        filename = self._entry(key)
+        try:
+            with open(filename, 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(filename)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        """Store an entry and evict the least recently used entries if the cache is too large."""
+        filename = self._entry(key)
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove the least recently used entries until the size of the cache is below its maximum size."""
+        entries = []
+        for f in os.listdir(self._path):
+            if not f.endswith('.pkl'):
+                continue
+            stat = os.stat(os.path.join(self._path, f))
+            entries.append((stat.st_mtime, stat.st_size, f))
+        total = sum(e[1] for e in entries)
+        for _, size, f in sorted(entries):
+            if total <= self._max_size:
+                break
+            if keep is not None and f == keep + '.pkl':
+                continue
+            os.remove(os.path.join(self._path, f))
+            total -= size
+
+    def clear(self):
+        """Remove all the entries of the cache."""
+        for f in os.listdir(self._path):
+            os.remove(os.path.join(self._path, f))
+
+
+class SimulatorJob:
+    """A simulator run to be executed by a `SimulatorJobRunner` in a private working directory.
+
+    The function is called with the working directory as `cwd` keyword argument (e.g. `madx.twiss`, `madx.track` or
+    `bdsim.track`); the (optional) `collect` function is then called with the working directory and its return value
+    is used as the result of the job, otherwise the return value of the function is used.
+    """
+
+    def __init__(self, function: Callable, *args, collect: Optional[Callable] = None, name: Optional[str] = None,
+                 **kwargs):
+        """
+        :param function: the function running the simulator (must accept a `cwd` keyword argument)
+        :param args: positional arguments of the function
+        :param collect: function called with the working directory to collect the outputs (optional)
+        :param name: name of the job (default: name of the function)
+        :param kwargs: keyword arguments of the function
+        """
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.collect = collect
+        self.name = name or getattr(function, '__name__', 'job')
+
+
+class SimulatorJobResult:
+    """Result of a `SimulatorJob`: status ('done', 'failed', 'timeout' or 'cancelled'), value and error."""
+
+    def __init__(self, name: str, status: str, value=None, error: Optional[str] = None, duration: float = 0.0):
+        self.name = name
+        self.status = status
+        self.value = value
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        """Return True if the job completed successfully."""
+        return self.status == 'done'
+
+    def __repr__(self):
+        return f"SimulatorJobResult(name={self.name!r}, status={self.status!r}, duration={self.duration:.2f})"
+
+
+def _run_job(index: int, job: SimulatorJob, workdir: str, results):
+    """Entry point of the job processes (the result is sent through the private pipe of the job)."""
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()  # The simulator subprocesses are killed with the job
+    start = time.time()
+    try:
+        value = job.function(*job.args, cwd=workdir, **job.kwargs)
+        if job.collect is not None:
+            value = job.collect(workdir)
+        results.send((index, 'done', value, None, time.time() - start))
+    except Exception:
+        results.send((index, 'failed', None, traceback.format_exc(), time.time() - start))
+
+
+class SimulatorJobRunner:
+    """Run simulator jobs concurrently, each one in its own process and private temporary working directory.
+
+    At most `max_workers` jobs run at the same time; jobs exceeding the timeout are killed (with their simulator
+    subprocesses) and `cancel` stops all pending and running jobs.
+    """
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 directory: Optional[str] = None,
+                 keep_directories: bool = False,
+                 ):
+        """
+        :param max_workers: maximum number of concurrent jobs (default: number of CPUs)
+        :param timeout: maximum duration (in seconds) of each job (default: no timeout)
+        :param directory: directory in which the working directories are created (default: system temporary directory)
+        :param keep_directories: do not remove the working directories after the jobs
+        """
+        self._max_workers = max_workers or multiprocessing.cpu_count()
+        self._timeout = timeout
+        self._directory = directory
+        self._keep_directories = keep_directories
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Cancel the pending jobs and kill the running ones (can be called from another thread)."""
+        self._cancelled.set()
+
+    @staticmethod
+    def _kill(process):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+        process.join()
+
+    def run(self, jobs: List[SimulatorJob]) -> List[SimulatorJobResult]:
+        """
+        Run the jobs and wait for their completion.
+
+        Each job sends its result through its own pipe: a job killed while sending its result can only corrupt its
+        own pipe, which is then discarded.
+        :param jobs: list of jobs
+        :return: the list of results (in the same order as the jobs)
+        """
+        self._cancelled.clear()
+        results = [None] * len(jobs)
+        pending = list(range(len(jobs)))[::-1]
+        running = {}
+
+        def collect(i):
+            """Receive the result of a job (or detect that it exited without result) and release it."""
+            p, reader, workdir, start = running.pop(i)
+            try:
+                _, status, value, error, duration = reader.recv()
+                results[i] = SimulatorJobResult(jobs[i].name, status, value, error, duration)
+                p.join()
+            except (EOFError, OSError):
+                self._kill(p)
+                results[i] = SimulatorJobResult(jobs[i].name, 'failed',
+                                                error=f"Job failed (exit code {p.exitcode}).",
+                                                duration=time.time() - start)
+            reader.close()
+            self._cleanup(workdir)
+
+        try:
+            while pending or running:
+                # Start new jobs
+                while pending and len(running) < self._max_workers and not self._cancelled.is_set():
+                    i = pending.pop()
+                    workdir = tempfile.mkdtemp(prefix='georges_job_', dir=self._directory)
+                    reader, writer = multiprocessing.Pipe(duplex=False)
+                    p = multiprocessing.Process(target=_run_job, args=(i, jobs[i], workdir, writer), daemon=True)
+                    p.start()
+                    writer.close()
+                    running[i] = (p, reader, workdir, time.time())
+
+                # Collect all the available results before checking the timeouts
+                ready = multiprocessing.connection.wait([r for _, r, _, _ in running.values()], timeout=0.05)
+                for i in [i for i, (_, r, _, _) in running.items() if r in ready]:
+                    collect(i)
+
+                # Timeouts, cancellations and crashes
+                for i, (p, reader, workdir, start) in list(running.items()):
+                    if reader.poll():
+                        # The job has (started to) send its result: it is received rather than killed
+                        collect(i)
+                        continue
+                    status = None
+                    if self._cancelled.is_set():
+                        status = 'cancelled'
+                    elif self._timeout is not None and time.time() - start > self._timeout:
+                        status = 'timeout'
+                    elif not p.is_alive() and p.exitcode != 0:
+                        status = 'failed'
+                    if status is not None:
+                        self._kill(p)
+                        results[i] = SimulatorJobResult(jobs[i].name, status,
+                                                        error=f"Job {status} (exit code {p.exitcode}).",
+                                                        duration=time.time() - start)
+                        running.pop(i, None)
+                        reader.close()
+                        self._cleanup(workdir)
+                if self._cancelled.is_set():
+                    for i in pending:
+                        results[i] = SimulatorJobResult(jobs[i].name, 'cancelled')
+                    pending = []
+        finally:
+            for i, (p, reader, workdir, start) in running.items():
+                self._kill(p)
+                reader.close()
+                self._cleanup(workdir)
+        return results
+
+    def _cleanup(self, workdir: str):
+        if not self._keep_directories:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,297 @@
+from typing import Optional, List, Iterator
+import os
+import numpy as np
+import pandas as pd
+from .beam import Beam, PHASE_SPACE_DIMENSIONS
+from .beamline import Beamline
+
+try:
+    import pyarrow as _pa
+    import pyarrow.parquet as _pq
+except ModuleNotFoundError:
+    _pa = None
+    _pq = None
+
+PARTICLES_FILENAME = 'particles.parquet'
+INDEX_FILENAME = 'index.parquet'
+SUMMARY_FILENAME = 'summary.parquet'
+TABLES_DIRECTORY = 'tables'
+DEFAULT_COLUMNS = PHASE_SPACE_DIMENSIONS[:5]
+DEFAULT_ROW_GROUP_SIZE = 1000000
+
+
+class TrackingStoreException(Exception):
+    """Exception raised for errors in the TrackingStore module."""
+
+    def __init__(self, m):
+        self.message = m
+
+
+class TrackingStore:
+    """On-disk store of tracking results.
+
+    The particles observed at each element (and turn) are written as blocks of row groups in a single compressed
+    Parquet file, next to an index of the blocks and a summary table (number of particles, first and second order
+    moments). Reads are lazy: a single element can be loaded on demand, a subset of columns can be projected across
+    all elements, and predicates are pushed down to the row groups (for example to read only the surviving particles).
+
+    The store is a directory:
+        - particles.parquet: ELEMENT, TURN, ALIVE, ID and coordinates columns;
+        - index.parquet: row groups of each (ELEMENT, TURN) block;
+        - summary.parquet: per block sums of the coordinates (to compute the statistics);
+        - tables/*.parquet: additional user tables.
+    """
+
+    def __init__(self,
+                 path: str,
+                 mode: str = 'r',
+                 columns: Optional[List[str]] = None,
+                 dtype=np.float64,
+                 compression: str = 'snappy',
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 ):
+        """
+        :param path: path of the store directory
+        :param mode: 'r' to read an existing store, 'w' to create (or overwrite) a store
+        :param columns: names of the coordinates columns (default: X, PX, Y, PY, DPP)
+        :param dtype: floating point type of the coordinates on disk (default: float64)
+        :param compression: Parquet compression codec (default: 'snappy')
+        :param row_group_size: maximum number of particles per row group
+        """
+        if _pq is None:
+            raise TrackingStoreException("The 'pyarrow' package is required to use a TrackingStore.")
+        if mode not in ('r', 'w'):
+            raise TrackingStoreException("Invalid mode, must be 'r' or 'w'.")
+        self._path = path
+        self._mode = mode
+        self._compression = compression
+        self._row_group_size = int(row_group_size)
+        self._writer = None
+        self._file = None
+        if mode == 'w':
+            os.makedirs(os.path.join(path, TABLES_DIRECTORY), exist_ok=True)
+            self._columns = list(columns or DEFAULT_COLUMNS)
+            self._dtype = np.dtype(dtype)
+            self._schema = _pa.schema(
+                [
+                    ('ELEMENT', _pa.string()),
+                    ('TURN', _pa.int32()),
+                    ('ALIVE', _pa.bool_()),
+                    ('ID', _pa.int64()),
+                ] + [(c, _pa.from_numpy_dtype(self._dtype)) for c in self._columns]
+            )
+            self._writer = _pq.ParquetWriter(os.path.join(path, PARTICLES_FILENAME),
+                                             self._schema,
+                                             compression=compression)
+            self._row_groups = 0
+            self._index = []
+            self._summary = []
+        else:
+            if not os.path.isfile(os.path.join(path, PARTICLES_FILENAME)):
+                raise TrackingStoreException(f"No tracking store found at '{path}'.")
+            self._file = _pq.ParquetFile(os.path.join(path, PARTICLES_FILENAME))
+            self._schema = self._file.schema.to_arrow_schema()
+            self._columns = [c for c in self._schema.names if c not in ('ELEMENT', 'TURN', 'ALIVE', 'ID')]
+            self._dtype = np.dtype(self._schema.field(self._columns[0]).type.to_pandas_dtype())
+            self._index = _pq.read_table(os.path.join(path, INDEX_FILENAME)).to_pandas().to_dict('records')
+            self._summary = _pq.read_table(os.path.join(path, SUMMARY_FILENAME)).to_pandas().to_dict('records')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def path(self) -> str:
+        """Return the path of the store directory."""
+        return self._path
+
+    @property
+    def columns(self) -> List[str]:
+        """Return the names of the coordinates columns."""
+        return self._columns
+
+    @property
+    def index(self) -> pd.DataFrame:
+        """Return the index of the blocks (element, turn, number of particles and row groups)."""
+        return pd.DataFrame(self._index, columns=['ELEMENT', 'TURN', 'N', 'ROW_GROUP_START', 'ROW_GROUP_STOP'])
+
+    @property
+    def elements(self) -> List[str]:
+        """Return the names of the stored elements (in order of observation)."""
+        return list(dict.fromkeys(b['ELEMENT'] for b in self._index))
+
+    @property
+    def summary(self) -> pd.DataFrame:
+        """Return the summary table (statistics of the surviving particles) indexed by element and turn."""
+        if len(self._summary) == 0:
+            return pd.DataFrame(columns=['ELEMENT', 'TURN', 'N', 'N_ALIVE']).set_index(['ELEMENT', 'TURN'])
+        sums = pd.DataFrame(self._summary).groupby(['ELEMENT', 'TURN'], sort=False).sum()
+        summary = sums[['N', 'N_ALIVE']].copy()
+        for c in self._columns:
+            mean = sums[f"{c}_SUM"] / sums['N_ALIVE']
+            summary[f"{c}_MEAN"] = mean
+            summary[f"{c}_STD"] = np.sqrt(np.maximum(sums[f"{c}_SUM2"] / sums['N_ALIVE'] - mean ** 2, 0.0))
+        return summary
+
+    def write(self,
+              element,
+              particles,
+              turn: int = 0,
+              alive: Optional[np.ndarray] = None,
+              ids: Optional[np.ndarray] = None,
+              ):
+        """
+        Append a block of particles observed at an element.
+        :param element: name (or index) of the element
+        :param particles: particles coordinates (numpy array, DataFrame or Beam), one column per store column
+        :param turn: turn number
+        :param alive: optional boolean mask of the surviving particles (default: all particles are alive)
+        :param ids: optional particles identifiers (default: -1)
+        """
+        if self._writer is None:
+            raise TrackingStoreException("The tracking store is not opened for writing.")
+        if isinstance(particles, Beam):
+            particles = particles.distribution
+        if isinstance(particles, pd.DataFrame):
+            particles = particles[self._columns].values
+        particles = np.asarray(particles)
+        n = particles.shape[0]
+        if n > 0 and particles.shape[1] != len(self._columns):
+            raise TrackingStoreException(f"Invalid number of columns, {len(self._columns)} expected.")
+        element = str(element)
+        alive = np.ones(n, dtype=bool) if alive is None else np.asarray(alive, dtype=bool)
+        ids = np.full(n, -1, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+
+        start = self._row_groups
+        if n > 0:
+            arrays = [
+                _pa.array(np.full(n, element, dtype=object), type=_pa.string()),
+                _pa.array(np.full(n, turn, dtype=np.int32)),
+                _pa.array(alive),
+                _pa.array(ids),
+            ] + [_pa.array(particles[:, i].astype(self._dtype, copy=False)) for i in range(len(self._columns))]
+            self._writer.write_table(_pa.Table.from_arrays(arrays, schema=self._schema),
+                                     row_group_size=self._row_group_size)
+            self._row_groups += -(-n // self._row_group_size)
+        self._index.append({
+            'ELEMENT': element,
+            'TURN': int(turn),
+            'N': int(n),
+            'ROW_GROUP_START': start,
+            'ROW_GROUP_STOP': self._row_groups,
+        })
+        summary = {'ELEMENT': element, 'TURN': int(turn), 'N': int(n), 'N_ALIVE': int(alive.sum())}
+        selected = particles[alive] if n > 0 else np.empty((0, len(self._columns)))
+        for i, c in enumerate(self._columns):
+            summary[f"{c}_SUM"] = selected[:, i].sum()
+            summary[f"{c}_SUM2"] = (selected[:, i] ** 2).sum()
+        self._summary.append(summary)
+
+    def write_table(self, name: str, table: pd.DataFrame):
+        """Store an additional (summary) table."""
+        if self._mode != 'w':
+            raise TrackingStoreException("The tracking store is not opened for writing.")
+        _pq.write_table(_pa.Table.from_pandas(table),
+                        os.path.join(self._path, TABLES_DIRECTORY, f"{name}.parquet"),
+                        compression=self._compression)
+
+    def read_table(self, name: str) -> pd.DataFrame:
+        """Read an additional (summary) table."""
+        return _pq.read_table(os.path.join(self._path, TABLES_DIRECTORY, f"{name}.parquet")).to_pandas()
+
+    def close(self):
+        """Flush the data and write the index and summary tables."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            _pq.write_table(_pa.Table.from_pandas(self.index, preserve_index=False),
+                            os.path.join(self._path, INDEX_FILENAME))
+            _pq.write_table(_pa.Table.from_pandas(pd.DataFrame(self._summary), preserve_index=False),
+                            os.path.join(self._path, SUMMARY_FILENAME))
+            self._file = _pq.ParquetFile(os.path.join(self._path, PARTICLES_FILENAME))
+            self._mode = 'r'
+
+    def _check_readable(self):
+        if self._file is None:
+            raise TrackingStoreException("The tracking store must be closed before being read.")
+
+    def read_element(self,
+                     element,
+                     turn: int = 0,
+                     columns: Optional[List[str]] = None,
+                     alive_only: bool = False,
+                     ) -> pd.DataFrame:
+        """
+        Read the particles of a single element, only the row groups of that element are loaded.
+        :param element: name of the element
+        :param turn: turn number
+        :param columns: columns to be read (default: all coordinates columns)
+        :param alive_only: only return the surviving particles
+        :return: a DataFrame with one row per particle
+        """
+        self._check_readable()
+        columns = list(columns or self._columns)
+        blocks = [b for b in self._index if b['ELEMENT'] == str(element) and b['TURN'] == turn]
+        if len(blocks) == 0:
+            raise TrackingStoreException(f"Element '{element}' (turn {turn}) not found in the tracking store.")
+        row_groups = [i for b in blocks for i in range(b['ROW_GROUP_START'], b['ROW_GROUP_STOP'])]
+        if len(row_groups) == 0:
+            return pd.DataFrame(columns=columns, dtype=self._dtype)
+        if alive_only:
+            table = self._file.read_row_groups(row_groups, columns=columns + ['ALIVE'])
+            df = table.to_pandas()
+            return df[df['ALIVE']].drop(columns='ALIVE').reset_index(drop=True)
+        return self._file.read_row_groups(row_groups, columns=columns).to_pandas()
+
+    def iter_elements(self,
+                      columns: Optional[List[str]] = None,
+                      turn: int = 0,
+                      alive_only: bool = False,
+                      ) -> Iterator:
+        """Lazily iterate over the elements, yielding (name, particles) tuples."""
+        for e in self.elements:
+            yield e, self.read_element(e, turn=turn, columns=columns, alive_only=alive_only)
+
+    def read(self,
+             columns: Optional[List[str]] = None,
+             elements: Optional[List[str]] = None,
+             turns: Optional[List[int]] = None,
+             alive_only: bool = False,
+             filters: Optional[List] = None,
+             ) -> pd.DataFrame:
+        """
+        Read a projection of the particles across all the elements.
+
+        Predicates are pushed down to the Parquet row groups: blocks that can not match are not read.
+        :param columns: coordinates columns to be read (default: all)
+        :param elements: restrict to these elements
+        :param turns: restrict to these turns
+        :param alive_only: only return the surviving particles
+        :param filters: additional predicates in the `pyarrow` DNF format, e.g. [('X', '<', 0.01)]
+        :return: a 'long' DataFrame with ELEMENT and TURN columns
+        """
+        self._check_readable()
+        columns = ['ELEMENT', 'TURN'] + list(columns or self._columns)
+        predicates = list(filters or [])
+        if elements is not None:
+            predicates.append(('ELEMENT', 'in', set(map(str, elements))))
+        if turns is not None:
+            predicates.append(('TURN', 'in', set(turns)))
+        if alive_only:
+            predicates.append(('ALIVE', '=', True))
+        return _pq.read_table(os.path.join(self._path, PARTICLES_FILENAME),
+                              columns=columns,
+                              filters=predicates or None,
+                              ).to_pandas()
+
+    def to_beamline(self, line: Beamline, turn: int = 0, alive_only: bool = False) -> Beamline:
+        """Load the stored particles as a beamline with a 'BEAM' column (as returned by the tracking functions)."""
+        beams = {
+            e: Beam(self.read_element(e, turn=turn, alive_only=alive_only))
+            for e in self.elements if e in line.line.index
+        }
+        l = line.line.copy()
+        l['BEAM'] = pd.Series(beams)
+        return Beamline(l)
@@ -0,0 +1,42 @@
+"""Benchmark of the sequence expansion (row-wise fixed point vs column-wise solver).
+
+Usage: python tests/benchmark_sequence_geometry.py [number of elements]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from georges.sequence_geometry import compute_derived_data, expand_sequence_data
+
+
+def synthetic_line(n):
+    types = np.array(['DRIFT', 'QUADRUPOLE', 'SBEND', 'MARKER'])[np.arange(n) % 4]
+    length = np.where(types == 'MARKER', np.nan, 0.5)
+    return pd.DataFrame({
+        'NAME': [f"E{i}" for i in range(n)],
+        'TYPE': types,
+        'AT_CENTER': np.arange(n) * 1.0,
+        'LENGTH': length,
+        'ANGLE': np.where(types == 'SBEND', 0.01, np.nan),
+    }).set_index('NAME')
+
+
+def row_wise(line):
+    tmp = line.apply(compute_derived_data, axis=1)
+    tmp2 = tmp
+    while True:
+        tmp, tmp2 = tmp2, tmp.apply(compute_derived_data, axis=1)
+        if tmp.equals(tmp2):
+            break
+    return tmp2
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    line = synthetic_line(n)
+    t0 = time.perf_counter()
+    expand_sequence_data(line)
+    t1 = time.perf_counter()
+    row_wise(line)
+    t2 = time.perf_counter()
+    print(f"{n} elements: column-wise {t1 - t0:.3f}s, row-wise {t2 - t1:.3f}s")
@@ -0,0 +1,80 @@
+import os
+import sys
+import stat
+import tempfile
+import textwrap
+import unittest
+
+# Minimal MAD-X stand-in reading the commands on its standard input:
+#   - 'NAME = value;' assignments are logged in assignments.log, 'NAME:=value;' deferred assignments are not;
+#   - 'PRINT, TEXT="...";' prints the text;
+#   - 'FATAL_TEST' prints a fatal error, 'FATAL' prints a fatal error and hangs;
+#   - 'SLEEP' sleeps for 0.5 s;
+#   - 'TWISS' prints a progress line and a warning; with a FILE it writes a TFS table (BETX of Q1 is the value of B1G)
+#     and logs the run in runs.log;
+#   - 'STOP;' ends the run.
+FAKE_MADX = textwrap.dedent('''
+    import re
+    import sys
+    import time
+    variables = {}
+    for line in sys.stdin:
+        line = line.strip()
+        m = re.match(r'^(\\w+)\\s*=\\s*([^;]+);$', line)
+        if m:
+            variables[m.group(1)] = float(m.group(2))
+            with open('assignments.log', 'a') as log:
+                log.write(line + '\\n')
+            continue
+        m = re.match(r'^(\\w+):=([^;]+);$', line)
+        if m:
+            variables[m.group(1)] = float(m.group(2))
+            continue
+        m = re.match(r'^PRINT, TEXT="(.*)";$', line)
+        if m:
+            print(m.group(1), flush=True)
+            continue
+        if 'FATAL_TEST' in line:
+            print('+=+=+= fatal: test error', flush=True)
+            continue
+        if line.startswith('FATAL'):
+            print('+=+=+= fatal: fake error', flush=True)
+            time.sleep(30)
+        if line.startswith('SLEEP'):
+            time.sleep(0.5)
+        if line.startswith('TWISS'):
+            print('  enter Twiss module', flush=True)
+            print('++++++ warning: fake warning', flush=True)
+            m = re.match(r'^TWISS,.*FILE=([^,;]+),', line)
+            if m:
+                with open('runs.log', 'a') as log:
+                    log.write('run\\n')
+                with open(m.group(1), 'w') as f:
+                    for i in range(45):
+                        f.write(f'@ HEADER{i} %le 0.0\\n')
+                    f.write('* NAME KEYWORD S BETX\\n')
+                    f.write('$ %s %s %le %le\\n')
+                    f.write(f'Q1 QUADRUPOLE 1.0 {variables.get("B1G", 0.0)}\\n')
+        if line == 'STOP;':
+            break
+    print('done', flush=True)
+''')
+
+
+class FakeMadxTestCase(unittest.TestCase):
+    """Test case with the fake MAD-X executable in `self.bin` and a working directory `self.workdir`, both in a
+    temporary directory removed after each test."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bin = os.path.join(self.tmp.name, 'bin')
+        os.makedirs(self.bin)
+        executable = os.path.join(self.bin, 'madx')
+        with open(executable, 'w') as f:
+            f.write(f"#!{sys.executable}\n" + FAKE_MADX)
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        self.workdir = os.path.join(self.tmp.name, 'work')
+        os.makedirs(self.workdir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import pandas as pd
+from georges import physics
+from georges.bdsim import sampler
+from georges.bdsim import samplers_to_beams
+
+
+def jagged(values_per_event):
+    counts = np.array([len(v) for v in values_per_event])
+    content = np.array([x for v in values_per_event for x in v], dtype=float)
+    return counts, content
+
+
+def fake_chunk(samplers, n_events=4):
+    """Sampler data with an empty event for each sampler and a secondary particle in the last event."""
+    chunk = {}
+    for k, s in enumerate(samplers):
+        values = {
+            'x': [[0.001 * (k + 1) * (i + 1), 9.0] if i != 1 else [] for i in range(n_events)],
+            'y': [[0.0, 9.0] if i != 1 else [] for i in range(n_events)],
+            'energy': [[1.0 + physics.PROTON_MASS / 1000, 9.0] if i != 1 else [] for i in range(n_events)],
+            'partID': [[2212 if i != 3 else 11, 2212] if i != 1 else [] for i in range(n_events)],
+        }
+        for branch in sampler.SAMPLER_BRANCHES.keys():
+            chunk[f"{s}.{branch}"] = jagged(values.get(branch, values['y']))
+    return chunk
+
+
+class TestSampler(unittest.TestCase):
+    def setUp(self):
+        self.line = pd.DataFrame({
+            'TYPE': ['QUADRUPOLE', 'MARKER', 'RECTANGULARCOLLIMATOR'],
+            'APERTYPE': ['CIRCLE', None, 'RECTANGLE'],
+            'APERTURE': ['0.05', None, '0.005,0.1'],
+        }, index=['Q1', 'M1', 'C1'])
+        self.samplers = ['Q1', 'C1']
+
+    def test_first_entries(self):
+        values = sampler.first_entries(*jagged([[1.0, 2.0], [], [3.0]]))
+        self.assertEqual(values[0], 1.0)
+        self.assertTrue(np.isnan(values[1]))
+        self.assertEqual(values[2], 3.0)
+
+    def test_sampler_frame(self):
+        df = sampler.sampler_frame(fake_chunk(self.samplers), self.samplers, first_event=10)
+        self.assertEqual(len(df), 6)
+        self.assertEqual(list(df['SAMPLER'].cat.categories), self.samplers)
+        self.assertEqual(list(df['EVENT'][df['SAMPLER'] == 'Q1']), [10, 12, 13])
+        self.assertAlmostEqual(df['X'].iloc[1], 0.003)
+
+    def test_select_particles(self):
+        df = sampler.sampler_frame(fake_chunk(self.samplers), self.samplers)
+        selected = sampler.select_particles(df, self.line)
+        self.assertEqual(list(selected['SAMPLER']), ['Q1', 'Q1', 'C1'])
+        self.assertTrue(np.allclose(selected['E'], 1000.0))
+        self.assertTrue(np.allclose(selected['P'], physics.energy_to_momentum(1000.0)))
+        self.assertEqual(len(sampler.select_particles(df, self.line, with_aperture=False)), 4)
+        self.assertEqual(len(sampler.select_particles(df, self.line, pdg_id=None, with_aperture=False)), 6)
+
+    def test_samplers_to_beams(self):
+        df = sampler.select_particles(sampler.sampler_frame(fake_chunk(self.samplers), self.samplers), self.line)
+        beams = samplers_to_beams(df, self.line)
+        self.assertEqual(list(beams.index), ['Q1', 'M1', 'C1'])
+        self.assertIsNone(beams['M1'])
+        self.assertEqual(beams['Q1'].n_particles, 2)
+        self.assertEqual(beams['C1'].n_particles, 1)
+        self.assertAlmostEqual(beams['C1'].distribution['X'].iloc[0], 0.002)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(sampler.SamplerException):
+            list(sampler.iter_sampler_chunks('output.root', self.samplers, backend='invalid'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import georges
+from georges import beam_io
+from georges import manzoni
+
+
+class TestBeamIO(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        self.particles = np.random.normal(size=(1001, 5))
+        self.df = pd.DataFrame(self.particles, columns=['X', 'PX', 'Y', 'PY', 'DPP'])
+        self.df['E'] = 1.0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_beam_file_roundtrip(self):
+        fname = os.path.join(self.path, 'beam.beam')
+        beam_io.write_beam_file(fname, self.df, columns=['X', 'PX', 'Y', 'PY', 'DPP'], metadata={'energy': 230.0})
+        f = beam_io.BeamFile(fname)
+        self.assertEqual(f.n_particles, 1001)
+        self.assertEqual(f.metadata['energy'], 230.0)
+        self.assertIsInstance(f.array().base, np.memmap)
+        np.testing.assert_array_equal(f.array(), self.particles)
+        np.testing.assert_array_equal(np.concatenate(list(f.iter_chunks(100, columns=['Y', 'X']))),
+                                      self.particles[:, [2, 0]])
+
+    def test_float32_beam_file(self):
+        fname = os.path.join(self.path, 'beam.beam')
+        beam_io.write_beam_file(fname, self.particles, dtype=np.float32)
+        self.assertEqual(os.path.getsize(fname) - beam_io.BeamFile(fname)._header['offset'], 1001 * 5 * 4)
+        np.testing.assert_allclose(beam_io.read_beam_file(fname), self.particles, rtol=1e-6)
+
+    def test_csv_and_parquet_streaming(self):
+        csv = os.path.join(self.path, 'beam.csv')
+        self.df.to_csv(csv, index=False)
+        self.assertEqual(beam_io.count_particles(csv), 1001)
+        chunks = list(beam_io.iter_beam_chunks(csv, chunk_size=300))
+        self.assertEqual([c.shape for c in chunks], [(300, 5), (300, 5), (300, 5), (101, 5)])
+        np.testing.assert_allclose(beam_io.load(csv), self.particles)
+        parquet = os.path.join(self.path, 'beam.parquet')
+        self.df.to_parquet(parquet)
+        np.testing.assert_allclose(beam_io.load(parquet, chunk_size=100), self.particles)
+        np.testing.assert_allclose(georges.Beam().from_parquet(parquet).distribution.values, self.particles)
+        np.testing.assert_allclose(georges.Beam().from_csv(csv).distribution.values, self.particles)
+
+    def test_explicit_formats(self):
+        csv = os.path.join(self.path, 'beam')
+        self.df.to_csv(csv, index=False)
+        parquet = os.path.join(self.path, 'beam.parq')
+        self.df.to_parquet(parquet)
+        np.testing.assert_allclose(georges.Beam().from_csv(csv).distribution.values, self.particles)
+        np.testing.assert_allclose(georges.Beam().from_parquet(parquet).distribution.values, self.particles)
+        self.assertEqual(beam_io.count_particles(parquet, fmt='parquet'), 1001)
+        with self.assertRaises(beam_io.BeamIOException):
+            beam_io.load(parquet)
+
+    def test_beam_from_file(self):
+        fname = os.path.join(self.path, 'beam.beam')
+        georges.Beam(self.df[['X', 'PX', 'Y', 'PY', 'DPP']], energy=230.0).to_beam_file(fname)
+        b = georges.Beam(filename='beam.beam', path=self.path)
+        np.testing.assert_array_equal(b.distribution.values, self.particles)
+
+    def test_track_chunks(self):
+        fname = os.path.join(self.path, 'beam.beam')
+        beam_io.write_beam_file(fname, 1e-3 * self.particles)
+        line = georges.Beamline(pd.DataFrame([
+            {'NAME': 'D1', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 0.0},
+            {'NAME': 'Q1', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.2, 'K1': 2.0, 'AT_ENTRY': 1.0},
+        ]))
+        r = manzoni.track_chunks(line,
+                                 beam_io.iter_beam_chunks(fname, chunk_size=250),
+                                 os.path.join(self.path, 'store'),
+                                 context={'ENERGY': 230.0})
+        self.assertEqual(r.line.at['Q1', 'N'], 1001)
+        self.assertAlmostEqual(r.line.at['D1', 'Y_MEAN'],
+                               (1e-3 * self.particles[:, 2] + 1e-3 * self.particles[:, 3]).mean())
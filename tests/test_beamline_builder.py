@@ -0,0 +1,20 @@
+import unittest
+import numpy as np
+from georges import BeamlineBuilder
+
+
+class TestBeamlineBuilder(unittest.TestCase):
+    def test_add_element(self):
+        bb = BeamlineBuilder()
+        for i in range(100):
+            bb.add_element({'NAME': f"Q{i}", 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.1})
+        self.assertEqual(bb.line.shape[0], 100)
+        self.assertListEqual(list(bb.line.index[:2]), ['Q0', 'Q1'])
+
+    def test_flatten(self):
+        q = {'NAME': 'Q', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.2}
+        s = BeamlineBuilder.build_sequence([q, q, q], start_drift=1.0, end_drift=0.5, inter_drift=0.3)
+        bb = BeamlineBuilder().add_sequence(s).flatten()
+        line = bb.line
+        self.assertListEqual(list(line['NAME']), ['Q_0', 'Q_1', 'Q_2', 'END_BUILDER_MARKER'])
+        np.testing.assert_allclose(line['AT_ENTRY'].values, [1.0, 1.5, 2.0, 2.7])
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+import numpy as np
+from georges import BeamlineBuilder, BeamlineCache
+
+
+SEQUENCE = """NAME,TYPE,AT_CENTER,CIRCUIT,PLUG
+D1,DRIFT,0.5,,
+Q1,QUAD,1.25,B1G,K1
+D2,DRIFT,2.0,,
+"""
+
+ELEMENTS = """NAME,CLASS,LENGTH
+DRIFT,DRIFT,1.0
+QUAD,QUADRUPOLE,0.5
+"""
+
+
+class TestBeamlineCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        with open(os.path.join(self.path, 'line.csv'), 'w') as f:
+            f.write(SEQUENCE)
+        with open(os.path.join(self.path, 'elements.csv'), 'w') as f:
+            f.write(ELEMENTS)
+        self.cache = BeamlineCache(os.path.join(self.path, 'cache'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self, cache):
+        return BeamlineBuilder(path=self.path, cache=cache)\
+            .define_elements_from_file('elements')\
+            .add_from_file('line')\
+            .build(extra_length=0.1)
+
+    def test_line_cache(self):
+        reference = self.build(None)
+        cold = self.build(self.cache)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache.path, 'lines'))), 1)
+        warm = self.build(self.cache)
+        for b in (cold, warm):
+            self.assertAlmostEqual(b.length, reference.length)
+            np.testing.assert_allclose(b.line['AT_EXIT'].values, reference.line['AT_EXIT'].values)
+            self.assertListEqual(list(b.line.index), list(reference.line.index))
+
+        # Modified input file: new entry
+        with open(os.path.join(self.path, 'elements.csv'), 'a') as f:
+            f.write("MARKER,MARKER,0.0\n")
+        self.build(self.cache)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache.path, 'lines'))), 2)
+
+    def test_manzoni_cache(self):
+        line = self.build(self.cache)
+        a = self.cache.convert_line(line, {'ENERGY': 230.0, 'B1G': 2.0, 'UNUSED': 1.0})
+        b = self.cache.convert_line(line, {'ENERGY': 230.0, 'B1G': 2.0, 'UNUSED': 3.0})
+        np.testing.assert_array_equal(a, b)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache.path, 'manzoni'))), 2)
+        c = self.cache.convert_line(line, {'ENERGY': 230.0, 'B1G': 3.0})
+        self.assertFalse(np.array_equal(a, c))
+
+    def test_manzoni_key_layout(self):
+        # Arrays cached with another layout of the manzoni columns are not reused
+        line = self.build(None).line
+        key = self.cache.manzoni_key(line, {'ENERGY': 230.0})
+        with unittest.mock.patch.dict('georges.manzoni.constants.INDEX', {'EXTRA': 99}):
+            self.assertNotEqual(self.cache.manzoni_key(line, {'ENERGY': 230.0}), key)
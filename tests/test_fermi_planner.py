@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges import fermi
+from georges import physics
+from georges.fermi import MaterialsDB, DifferentialMoliere
+
+
+class TestPlanner(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = MaterialsDB()
+
+    def setUp(self):
+        self.line = georges.Beamline(pd.DataFrame([
+            {'NAME': 'D1', 'CLASS': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 0.0},
+            {'NAME': 'DEG', 'CLASS': 'DEGRADER', 'LENGTH': 0.0, 'MATERIAL': 'graphite', 'AT_ENTRY': 1.0},
+            {'NAME': 'D2', 'CLASS': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 1.0},
+            {'NAME': 'SC', 'CLASS': 'SCATTERER', 'LENGTH': 0.001, 'MATERIAL': 'beryllium', 'AT_ENTRY': 2.0},
+            {'NAME': 'Q1', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'AT_ENTRY': 2.001},
+        ]))
+        self.energies = np.array([70.0, 150.0, 230.0])
+
+    def test_residual_energies(self):
+        thickness = np.array([1.0, 5.0, 20.0, 100.0])
+        energies = fermi.residual_energies('graphite', thickness, 230.0, self.db)
+        for t, e in zip(thickness[:3], energies[:3]):
+            self.assertAlmostEqual(e, fermi.residual_energy('graphite', t, 230.0, db=self.db), places=6)
+        self.assertTrue(np.isnan(energies[3]))
+
+    def test_fermi_eyges_parameters(self):
+        fe = fermi.fermi_eyges_parameters('graphite', np.array([230.0, 150.0]), np.array([10.0, 0.0]), self.db)
+        reference = fermi.compute_fermi_eyges('graphite', 230.0, 10.0, self.db, DifferentialMoliere)
+        np.testing.assert_allclose([fe['A0'][0], fe['A1'][0], fe['A2'][0]], reference['A'], rtol=1e-3)
+        self.assertAlmostEqual(fe['DPP'][0], reference['DPP'])
+        self.assertEqual(fe['A0'][1], 0.0)
+
+    def test_plan_layers(self):
+        plan = fermi.plan_layers(self.line, self.energies, 230.0, 'DEG', db=self.db, ess_slits=0.01,
+                                 ess_dispersion=1.5)
+        layers = plan['layers']
+        self.assertEqual(len(layers), 3)
+        self.assertAlmostEqual(layers['THICKNESS'].iloc[2], 0.0)
+        e = fermi.residual_energy('graphite', layers['THICKNESS'].iloc[0] * 100, 230.0, db=self.db)
+        self.assertAlmostEqual(e, 70.0, places=6)
+        np.testing.assert_allclose(plan['elements']['BRHO']['D2'], physics.energy_to_brho(self.energies))
+        np.testing.assert_allclose(plan['elements']['BRHO']['D1'], physics.energy_to_brho(230.0))
+        self.assertTrue(np.all(plan['elements']['FE_A0']['SC'] > 0))
+        self.assertTrue(np.all(plan['elements']['FE_A0']['Q1'] == 0))
+        self.assertTrue(np.all(np.diff(layers['TRANSMISSION']) > 0))
+        with self.assertRaises(fermi.PlannerException):
+            fermi.plan_layers(self.line, [240.0], 230.0, 'DEG', db=self.db)
+        with self.assertRaises(fermi.PlannerException):
+            fermi.plan_layers(self.line, [100.0], 230.0, 'Q1', db=self.db)
+
+    def test_ess_transmission(self):
+        t = physics.compute_ess_transmission(0.5, 0.01, 0.02)
+        self.assertEqual(t.shape, (10000,))
+        self.assertAlmostEqual(t.max(), physics.ess_transmission(0.0, 0.5 / 2.8, 0.01, 0.02), places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from georges.g4beamline import read_detectors, read_g4beamline_tracking
+from georges.g4beamline.tracking import detectors_to_beams
+from georges.simulator import SimulatorJob, SimulatorJobRunner
+
+HEADER = "#BLTrackFile2 G4beamline output\n" \
+         "#x y z Px Py Pz t PDGid EventID TrackID ParentID Weight\n" \
+         "#mm mm mm MeV/c MeV/c MeV/c ns - - - - -\n"
+
+
+def detector_file(filename, n, secondaries=True):
+    with open(filename, 'w') as f:
+        f.write(HEADER)
+        for i in range(n):
+            f.write(f"{i} {-i} 1000.0 3.0 0.0 4.0 0.0 2212 {i + 1} 1 1 1.0\n")
+            if secondaries:
+                f.write(f"9 9 1000.0 1.0 1.0 1.0 0.0 11 {i + 1} 2 1 1.0\n")
+
+
+def read_length(files, max_workers, cwd='.'):
+    return len(read_detectors(files, max_workers=max_workers))
+
+
+class TestG4BeamlineTracking(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = {name: os.path.join(self.tmp.name, f"Detector{name}.txt") for name in ['D1', 'Q1', 'M1']}
+        detector_file(self.files['D1'], 5)
+        detector_file(self.files['Q1'], 3)
+        self.line = pd.DataFrame({'TYPE': ['DRIFT', 'QUADRUPOLE', 'MARKER']}, index=['D1', 'Q1', 'M1'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_detectors(self):
+        for max_workers in (1, 2):
+            data = read_detectors(self.files, max_workers=max_workers)
+            self.assertEqual(len(data), 8)
+            self.assertEqual(list(data['DETECTOR'].cat.categories), ['D1', 'Q1', 'M1'])
+            d1 = data[data['DETECTOR'] == 'D1']
+            self.assertTrue(np.allclose(d1['X'], np.arange(5) / 1000))
+            self.assertTrue(np.allclose(d1['S'], 1.0))
+            self.assertTrue(np.allclose(d1['P'], 5.0))
+            self.assertTrue(np.allclose(d1['PX'], 0.6))
+
+    def test_read_detectors_in_job(self):
+        # The jobs are daemonic processes, the files are read in the job process (default number of workers)
+        results = SimulatorJobRunner(max_workers=1).run([SimulatorJob(read_length, self.files, None)])
+        self.assertEqual(results[0].status, 'done', results[0].error)
+        self.assertEqual(results[0].value, 8)
+
+    def test_detectors_to_beams(self):
+        beams = detectors_to_beams(read_detectors(self.files, max_workers=1), self.line)
+        self.assertEqual(beams['D1'].distribution.shape, (5, 5))
+        self.assertEqual(beams['Q1'].distribution.shape, (3, 5))
+        self.assertTrue(np.isnan(beams['M1']))
+
+    def test_read_g4beamline_tracking(self):
+        b = read_g4beamline_tracking(self.files['Q1'])
+        self.assertTrue(np.allclose(b.distribution['Y'], -np.arange(3) / 1000))
+        self.assertTrue(np.isnan(read_g4beamline_tracking(self.files['M1'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
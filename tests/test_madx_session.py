@@ -0,0 +1,33 @@
+import os
+import unittest
+import pandas as pd
+from georges import Beamline
+from georges.madx.session import MadxSession, MadxSessionException
+from tests.fake_madx import FakeMadxTestCase
+
+
+class TestMadxSession(FakeMadxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.line = Beamline(pd.DataFrame([
+            {'NAME': 'Q1', 'TYPE': 'QUADRUPOLE', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.5, 'AT_CENTER': 1.0,
+             'CIRCUIT': 'B1G', 'PLUG': 'K1', 'BRHO': 2.0},
+        ]), name='LINE')
+        self.context = {'PARTICLE': 'PROTON', 'PC': 700.0, 'B1G': 1.0}
+
+    def test_scan(self):
+        with MadxSession(self.line, context=self.context, path=self.bin, workdir=self.workdir) as s:
+            for k in [1.0, 2.0, 2.0, 3.0]:
+                t = s.twiss(context={**self.context, 'B1G': k})
+                self.assertAlmostEqual(t.line.loc['Q1', 'BETX'], k)
+            self.assertTrue(s.running)
+        self.assertFalse(s.running)
+        with open(os.path.join(self.workdir, 'assignments.log')) as f:
+            self.assertListEqual(f.read().split('\n')[:-1], ['B1G = 2.0;', 'B1G = 3.0;'])
+        self.assertListEqual([f for f in os.listdir(self.workdir) if f.endswith('.tfs')], [])
+
+    def test_fatal(self):
+        with MadxSession(self.line, context=self.context, path=self.bin, workdir=self.workdir) as s:
+            with self.assertRaises(MadxSessionException):
+                s.execute("FATAL_TEST;")
+            self.assertEqual(len(s.fatals), 1)
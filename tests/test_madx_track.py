@@ -1,6 +1,31 @@
+import os
+import tempfile
 import unittest
 
+import georges
 from georges import madx
+from georges.madx import TrackingFile, read_tracking
+
+PTC_TRACKONE = """@ NAME             %07s "TRACKONE"
+@ TYPE             %08s "TRACKONE"
+@ TITLE            %08s "no-title"
+* NUMBER TURN X PX Y PY T PT S E
+$ %d %d %le %le %le %le %le %le %le %le
+#segment 1 2 3 1 start
+ 1 0 0.001 0.0 0.002 0.0 0.0 0.0 0.0 0.1
+ 2 0 0.003 0.0 0.004 0.0 0.0 0.0 0.0 0.1
+ 3 0 0.005 0.0 0.006 0.0 0.0 0.0 0.0 0.1
+#segment 1 2 3 2 quad1
+ 1 0 0.011 0.0 0.012 0.0 0.0 0.0 1.0 0.1
+ 2 0 0.013 0.0 0.014 0.0 0.0 0.0 1.0 0.1
+ 3 0 0.015 0.0 0.016 0.0 0.0 0.0 1.0 0.1
+#segment 2 2 2 1 start
+ 1 1 0.021 0.0 0.022 0.0 0.0 0.0 0.0 0.1
+ 2 1 0.023 0.0 0.024 0.0 0.0 0.0 0.0 0.1
+#segment 2 2 2 2 quad1
+ 1 1 0.031 0.0 0.032 0.0 0.0 0.0 1.0 0.1
+ 2 1 0.033 0.0 0.034 0.0 0.0 0.0 1.0 0.1
+"""
 
 
 class TestMadxTrack(unittest.TestCase):
@@ -9,3 +34,51 @@ class TestMadxTrack(unittest.TestCase):
         with self.assertRaisesRegex(georges.madx.tracking.TrackException,
                                     "Beamline, Beam and MAD-X objects need to be defined."):
             madx.track()
+
+
+class TestTrackingFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'ptctrackone.tfs')
+        with open(self.file, 'w') as f:
+            f.write(PTC_TRACKONE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index(self):
+        for block_size in (7, 64, 1 << 20):
+            t = TrackingFile(self.file, block_size=block_size)
+            self.assertEqual(t.locations, ['START', 'QUAD1'])
+            self.assertEqual(list(t.segments['ROWS']), [3, 3, 2, 2])
+            self.assertEqual(t.columns[2], 'X')
+
+    def test_lazy_read(self):
+        t = TrackingFile(self.file)
+        quad = t['quad1']
+        self.assertEqual(len(quad), 5)
+        self.assertEqual(list(quad['TURN']), [0, 0, 0, 1, 1])
+        self.assertAlmostEqual(quad['X'].iloc[-1], 0.033)
+        with self.assertRaises(madx.tracking.TrackException):
+            t.read('DRIFT')
+
+    def test_read_all(self):
+        t = TrackingFile(self.file)
+        segments = t.read_all()
+        self.assertEqual([len(s) for s in segments], [3, 3, 2, 2])
+        for i, s in enumerate(segments):
+            self.assertTrue(s.equals(t.read_segment(i)))
+
+    def test_read_tracking(self):
+        df = read_tracking(self.file)
+        self.assertEqual(list(df.index), ['START', 'QUAD1'])
+        self.assertEqual(df.index.name, 'NAME')
+        self.assertEqual(len(df.at['QUAD1', 'BEAM'].distribution), 2)
+        self.assertAlmostEqual(df.at['QUAD1', 'BEAM'].distribution['X'].iloc[0], 0.031)
+        selected = read_tracking(self.file, locations=['quad1'])
+        self.assertEqual(list(selected.index), ['QUAD1'])
+        self.assertTrue(selected.at['QUAD1', 'BEAM'].distribution.equals(df.at['QUAD1', 'BEAM'].distribution))
+
+
+if __name__ == '__main__':
+    unittest.main()
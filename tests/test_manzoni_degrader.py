@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import pandas as pd
+from georges import fermi
+from georges.manzoni import fe
+from georges.manzoni.common import convert_line, FERMI_DB, MATERIALS
+from georges.manzoni.constants import *
+
+
+class TestManzoniDegrader(unittest.TestCase):
+    def setUp(self):
+        line = pd.DataFrame({
+            'CLASS': ['DRIFT', 'DEGRADER'],
+            'TYPE': ['DRIFT', 'slab'],
+            'LENGTH': [1.0, 0.1],
+            'MATERIAL': ['', 'graphite'],
+        }, index=['D1', 'DEG'])
+        self.degrader = convert_line(line, context={'ENERGY': 230.0})[1]
+        np.random.seed(1)
+
+    def test_material_code(self):
+        self.assertEqual(MATERIALS[int(self.degrader[INDEX_MATERIAL_CODE]) - 1], 'graphite')
+
+    def test_stepped_degrader(self):
+        beam = fe.mc_degrader(self.degrader, np.zeros((20000, 5)), degrader='stepped')
+        e = self.degrader
+        self.assertLess(beam.shape[0], 20000)
+        self.assertGreater(beam.shape[0], 15000)
+        self.assertLess(abs(np.mean(beam[:, DPP])), 1e-3)
+        self.assertAlmostEqual(np.var(beam[:, PX]) / e[INDEX_FE_A0], 1.0, delta=0.05)
+        self.assertAlmostEqual(np.var(beam[:, X]) / e[INDEX_FE_A2], 1.0, delta=0.05)
+        self.assertAlmostEqual(np.mean(beam[:, X] * beam[:, PX]) / e[INDEX_FE_A1], 1.0, delta=0.05)
+        self.assertAlmostEqual(np.var(beam[:, DPP]) / e[INDEX_FE_DPP], 1.0, delta=0.2)
+
+    def test_stopping(self):
+        e = self.degrader.copy()
+        e[INDEX_LENGTH] = 0.01 * fermi.get_range_from_energy('graphite', 230.0, db=FERMI_DB) * 1.05
+        self.assertEqual(fe.mc_degrader_stepped(e, np.zeros((1000, 5))).shape[0], 0)
+
+    def test_default_model(self):
+        beam = fe.mc_degrader(self.degrader, np.zeros((1000, 5)))
+        self.assertEqual(beam.shape[0], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges import manzoni
+from georges.manzoni.errors import error_study, ErrorsException
+
+
+def _line():
+    rows = []
+    for i in range(6):
+        rows += [
+            {'NAME': f'QF{i}', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': 1.0},
+            {'NAME': f'D{i}', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+            {'NAME': f'QD{i}', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': -1.0},
+            {'NAME': f'C{i}', 'CLASS': 'HKICKER', 'LENGTH': 0.0},
+            {'NAME': f'M{i}', 'CLASS': 'DRIFT', 'LENGTH': 1.0, 'APERTYPE': 'RECTANGLE', 'APERTURE': '0.004,0.01'},
+        ]
+    return georges.Beamline(pd.DataFrame([{**r, 'TYPE': r['CLASS']} for r in rows]))
+
+
+class TestManzoniErrors(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.line = _line()
+        self.beam = georges.Beam(pd.DataFrame(np.random.randn(5000, 5) * [2e-3, 1e-3, 2e-3, 1e-3, 0.0],
+                                              columns=['X', 'PX', 'Y', 'PY', 'DPP']))
+        self.context = {'ENERGY': 230.0}
+        self.errors = [
+            {'class': 'QUADRUPOLE', 'parameter': 'MISALIGNEMENT_X', 'sigma': 5e-4, 'cut': 2.0},
+            {'class': 'QUADRUPOLE', 'parameter': 'K1', 'sigma': 1e-2, 'relative': True},
+            {'elements': ['C2'], 'parameter': 'KICK', 'distribution': 'uniform', 'sigma': 1e-4},
+        ]
+
+    def test_errors(self):
+        study = error_study(line=self.line, beam=self.beam, context=self.context, errors=self.errors, seeds=20,
+                            seed=1, max_workers=1)
+        errors = study['errors']
+        self.assertEqual(errors.shape, (20, 25))
+        self.assertLessEqual(errors.xs('MISALIGNEMENT_X', level='PARAMETER', axis=1).abs().values.max(), 1e-3)
+        self.assertLessEqual(np.abs(errors[('C2', 'KICK')]).max(), 1e-4)
+        self.assertEqual(study['elements'].shape, (20, 5 * 30))
+        self.assertEqual(list(study['statistics'].loc['M5', 'TRANSMISSION'].index), ['MEAN', 'STD', 'Q5', 'Q50', 'Q95'])
+        self.assertTrue(np.all(study['elements']['TRANSMISSION'].values <= 1.0))
+        self.assertLess(study['statistics'].loc['M5', ('TRANSMISSION', 'MEAN')], 1.0)
+
+    def test_no_errors(self):
+        """Without errors, all the seeds reproduce the tracking of the beam."""
+        study = error_study(line=self.line, beam=self.beam, context=self.context, seeds=2, max_workers=1)
+        tracked = manzoni.track(line=self.line, beam=self.beam, context=self.context)
+        for name in ['D0', 'M3', 'M5']:
+            d = tracked.line.at[name, 'BEAM'].distribution
+            self.assertAlmostEqual(study['elements'].at[0, ('X', name)], d['X'].mean(), delta=1e-12)
+            self.assertAlmostEqual(study['elements'].at[1, ('SIGMA_Y', name)], d['Y'].std(ddof=0), delta=1e-12)
+            self.assertAlmostEqual(study['elements'].at[0, ('TRANSMISSION', name)], len(d) / 5000)
+
+    def test_sigma_and_parallel(self):
+        parameters = dict(line=self.line, beam=self.beam, context=self.context, errors=self.errors[:1], seeds=8,
+                          seed=2)
+        particles = error_study(max_workers=2, **parameters)
+        serial = error_study(max_workers=1, **parameters)
+        sigma = error_study(method='sigma', max_workers=1, **parameters)
+        pd.testing.assert_frame_equal(particles['errors'], sigma['errors'])
+        np.testing.assert_allclose(particles['elements'].values, serial['elements'].values)
+        # Linear line: same centroids before the first losses
+        np.testing.assert_allclose(sigma['elements']['X']['D0'], particles['elements']['X']['D0'], atol=1e-12)
+
+    def test_invalid(self):
+        with self.assertRaises(ErrorsException):
+            error_study(line=self.line, beam=self.beam, context=self.context, errors=[{'parameter': 'K1'}], seeds=2)
+        with self.assertRaises(ErrorsException):
+            error_study(line=self.line, beam=self.beam, context=self.context, method='foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
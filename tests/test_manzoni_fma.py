@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+from georges.manzoni.common import convert_line
+from georges.manzoni.constants import X, PX, Y, PY
+from georges.manzoni.match import _element_matrix, _cumulative_maps, _periodic_initial
+from georges.manzoni.henon import track_turns, polar_grid
+from georges.manzoni.fma import tunes, frequency_map, FMAException
+from tests.test_manzoni_henon import _ring
+
+
+class TestManzoniFMA(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.q = np.random.uniform(0.05, 0.45, 100)
+        self.phase = np.random.uniform(0, 2 * np.pi, 100)
+        self.t = np.arange(512)[:, None]
+
+    def test_tunes(self):
+        z = np.exp(2j * np.pi * self.q * self.t + 1j * self.phase)
+        for method in ('interpolation', 'naff'):
+            np.testing.assert_allclose(tunes(z, method), self.q, atol=1e-9)
+            np.testing.assert_allclose(tunes(np.cos(2 * np.pi * self.q * self.t + self.phase), method), self.q,
+                                       atol=1e-8)
+            np.testing.assert_allclose(tunes(np.conj(z), method), 1 - self.q, atol=1e-9)
+        z[10, 3] = np.nan
+        self.assertTrue(np.isnan(tunes(z)[3]))
+        self.assertEqual(np.count_nonzero(np.isnan(tunes(z))), 1)
+        with self.assertRaises(FMAException):
+            tunes(z, method='foo')
+
+    def test_frequency_map(self):
+        line = _ring(k2=20.0)
+        context = {'ENERGY': 230.0}
+        elements = convert_line(line.line, context)
+        m = _cumulative_maps(np.array([_element_matrix(e) for e in elements]))[-1]
+        initial = _periodic_initial(m)
+        data = track_turns(line, polar_grid(np.linspace(1e-5, 4e-3, 20), [np.pi / 4]), context, turns=1024)
+        self.assertEqual(data.shape, (1024, 20, 5))
+        fm = frequency_map(data[..., [X, PX]], data[..., [Y, PY]],
+                           beta_x=initial['BETX'], alpha_x=initial['ALFX'],
+                           beta_y=initial['BETY'], alpha_y=initial['ALFY'], method='naff')
+        self.assertEqual(list(fm.columns), ['X', 'Y', 'QX', 'QY', 'QX2', 'QY2', 'DIFFUSION'])
+
+        # Small amplitudes: tunes of the linear one-turn map
+        qx = np.arccos(0.5 * (m[0, 0] + m[1, 1])) / (2 * np.pi)
+        qy = np.arccos(0.5 * (m[2, 2] + m[3, 3])) / (2 * np.pi)
+        qx, qy = (qx if m[0, 1] > 0 else 1 - qx), (qy if m[2, 3] > 0 else 1 - qy)
+        self.assertAlmostEqual(fm['QX'][0], qx, delta=1e-5)
+        self.assertAlmostEqual(fm['QY'][0], qy, delta=1e-5)
+        # Amplitude detuning and larger diffusion at large amplitudes
+        self.assertGreater(np.abs(fm['QX'].iloc[-1] - qx), 1e-5)
+        self.assertGreater(np.nanmax(fm['DIFFUSION']), fm['DIFFUSION'][0])
+
+    def test_invalid(self):
+        with self.assertRaises(FMAException):
+            frequency_map(np.zeros((16, 3)), np.zeros((16, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
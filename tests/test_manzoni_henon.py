@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges.manzoni.common import convert_line
+from georges.manzoni.match import _element_matrix, _cumulative_maps
+from georges.manzoni.henon import dynamic_aperture, compile_line, polar_grid, cartesian_grid, HenonException, _kick
+
+
+def _ring(k2=0.0):
+    rows = []
+    for i in range(4):
+        rows += [
+            {'NAME': f'QF{i}', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': 2.0},
+            {'NAME': f'D{i}', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+            {'NAME': f'B{i}', 'CLASS': 'SBEND', 'LENGTH': 1.0, 'ANGLE': np.pi / 4},
+            {'NAME': f'QD{i}', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': -2.0},
+            {'NAME': f'E{i}', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+        ]
+    rows.append({'NAME': 'S1', 'CLASS': 'SEXTUPOLE', 'LENGTH': 0.0, 'K2': k2})
+    return georges.Beamline(pd.DataFrame([{**r, 'TYPE': r['CLASS']} for r in rows]))
+
+
+class TestManzoniHenon(unittest.TestCase):
+    def setUp(self):
+        self.context = {'ENERGY': 230.0}
+
+    def test_grids(self):
+        grid = polar_grid([1.0, 2.0], [0.0, np.pi / 2])
+        np.testing.assert_allclose(grid[:, [0, 2]], [[1, 0], [0, 1], [2, 0], [0, 2]], atol=1e-15)
+        self.assertEqual(cartesian_grid([1, 2, 3], [4, 5], dpp=0.01).shape, (6, 5))
+
+    def test_compile(self):
+        elements = convert_line(_ring().line, self.context)
+        operations = compile_line(elements)
+        self.assertEqual([o[0] for o in operations], ['map'])
+        m = _cumulative_maps(np.array([_element_matrix(e) for e in elements]))[-1]
+        np.testing.assert_allclose(operations[0][1], m, atol=1e-12)
+
+        elements = convert_line(_ring(k2=10.0).line, self.context)
+        self.assertEqual([o[0] for o in compile_line(elements)], ['map', 'kick'])
+
+    def test_kick(self):
+        brho = georges.physics.energy_to_brho(230.0)
+        line = georges.Beamline(pd.DataFrame([{'NAME': 'S', 'CLASS': 'SEXTUPOLE', 'TYPE': 'SEXTUPOLE',
+                                               'LENGTH': 0.0, 'K2': 4.0}]))
+        da = dynamic_aperture(line, np.array([[1e-2, 0.0, 2e-2, 0.0, 0.0]]), self.context, turns=1)
+        self.assertEqual(da['particles']['TURNS'][0], 1)
+        operations = compile_line(convert_line(line.line, self.context))
+        b = np.array([[1e-2, 0.0, 2e-2, 0.0, 0.0]])
+        _kick(b, *operations[0][1:])
+        k2 = 4.0 / brho
+        self.assertAlmostEqual(b[0, 1], -k2 / 2 * (1e-4 - 4e-4))
+        self.assertAlmostEqual(b[0, 3], k2 * 1e-2 * 2e-2)
+
+    def test_dynamic_aperture(self):
+        grid = polar_grid(np.linspace(1e-3, 0.2, 40), np.linspace(0, np.pi / 2, 5))
+        linear = dynamic_aperture(_ring(), grid, self.context, turns=200, limit=0.5)
+        self.assertFalse(linear['particles']['LOST'].any())
+        self.assertEqual(linear['turns'], 200)
+
+        da = dynamic_aperture(_ring(k2=20.0), grid, self.context, turns=500, limit=0.5)
+        particles = da['particles']
+        self.assertTrue(particles['LOST'].any())
+        self.assertFalse(particles['LOST'][particles['AMPLITUDE'] < da['dynamic_aperture']].any())
+        self.assertTrue(np.all(particles['TURNS'][particles['LOST']] < 500))
+        self.assertEqual(len(da['boundary']), 5)
+        self.assertTrue(np.all(da['boundary'] < da['particles']['AMPLITUDE'].max()))
+
+        early = dynamic_aperture(_ring(k2=20.0), grid, self.context, turns=500, limit=0.5, check_interval=10,
+                                 patience=3)
+        self.assertLess(early['turns'], 500)
+        self.assertGreaterEqual(early['dynamic_aperture'], da['dynamic_aperture'])
+
+    def test_invalid(self):
+        with self.assertRaises(HenonException):
+            dynamic_aperture(_ring(), np.zeros((3, 4)), self.context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges import manzoni
+from georges.manzoni.match import _Matcher, quadrupole_derivative, MatchException
+from georges.manzoni.matrices import quadrupole
+from georges.manzoni.constants import INDEX_K1, INDEX_LENGTH, INDEX_BRHO, INDEX
+
+
+def _line():
+    return georges.Beamline(pd.DataFrame([
+        {'NAME': 'D1', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 0.0},
+        {'NAME': 'Q1', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.3, 'AT_ENTRY': 1.0, 'PLUG': 'K1', 'CIRCUIT': 'Q1K1'},
+        {'NAME': 'D2', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 1.3},
+        {'NAME': 'Q2', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.3, 'AT_ENTRY': 2.3, 'PLUG': 'K1', 'CIRCUIT': 'Q2K1'},
+        {'NAME': 'D3', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 2.6},
+        {'NAME': 'B1', 'CLASS': 'SBEND', 'TYPE': 'SBEND', 'LENGTH': 1.0, 'ANGLE': 0.2, 'AT_ENTRY': 3.6},
+        {'NAME': 'Q3', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.3, 'AT_ENTRY': 4.6, 'PLUG': 'K1', 'CIRCUIT': 'Q3K1'},
+        {'NAME': 'D4', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 4.9},
+    ]))
+
+
+class TestManzoniMatch(unittest.TestCase):
+    def setUp(self):
+        self.line = _line()
+        self.context = {'ENERGY': 230.0, 'BETAX': 5.0, 'BETAY': 5.0, 'Q1K1': 1.0, 'Q2K1': -1.0, 'Q3K1': 0.5}
+
+    def test_quadrupole_derivative(self):
+        e = np.zeros(len(INDEX))
+        e[INDEX_LENGTH] = 0.3
+        e[INDEX_BRHO] = 2.0
+        for k1 in (3.0, -3.0, 1e-9):
+            e[INDEX_K1] = k1
+            h = 1e-6
+            e_plus, e_minus = e.copy(), e.copy()
+            e_plus[INDEX_K1] += h
+            e_minus[INDEX_K1] -= h
+            numeric = (quadrupole(e_plus) - quadrupole(e_minus)) / (2 * h)
+            np.testing.assert_allclose(quadrupole_derivative(e), numeric, atol=1e-7)
+
+    def test_jacobian(self):
+        m = _Matcher(self.line, self.context, ['Q1K1', 'Q2K1', 'Q3K1'],
+                     [{'range': 'D4', 'constraint': 'betx=3.0, alfx=0.0, bety=3.0, mux=0.1, dx=0.0, dpx=0.0'}],
+                     [], periodic=False)
+        x = m.x0()
+        jac = m.jacobian(x)
+        numeric = np.zeros_like(jac)
+        for k in range(len(x)):
+            h = np.zeros(len(x))
+            h[k] = 1e-6
+            numeric[:, k] = (m.residuals(x + h) - m.residuals(x - h)) / 2e-6
+        np.testing.assert_allclose(jac, numeric, rtol=1e-5, atol=1e-6)
+
+    def test_optics(self):
+        context = {**self.context, 'ALPHAX': 0.5, 'ALPHAY': -0.3, 'DX': 0.1, 'DPX': 0.01}
+        m = _Matcher(self.line, context, [], [], [], periodic=False)
+        optics = m.optics(np.array([]))[2]
+        for plane, (i, j) in (('X', (0, 1)), ('Y', (2, 3))):
+            beta, alpha = m.initial[f'BET{plane}'], m.initial[f'ALF{plane}']
+            twiss = np.array([[beta, -alpha], [-alpha, (1 + alpha ** 2) / beta]])
+            d = np.array([m.initial[f'D{plane}'], m.initial[f'DP{plane}'], 1.0])
+            mu = 0.0
+            for k, r in enumerate(m.matrices):
+                # Exact element by element propagation: T = B T0 B^T and D = B D0
+                b = r[np.ix_([i, j], [i, j])]
+                mu += np.arctan2(b[0, 1], b[0, 0] * twiss[0, 0] + b[0, 1] * twiss[0, 1]) / (2 * np.pi)
+                twiss = b @ twiss @ b.T
+                d = r[np.ix_([i, j, 4], [i, j, 4])] @ d
+                self.assertAlmostEqual(optics[f'BET{plane}'][k + 1], twiss[0, 0])
+                self.assertAlmostEqual(optics[f'ALF{plane}'][k + 1], -twiss[0, 1])
+                self.assertAlmostEqual(optics[f'MU{plane}'][k + 1], mu)
+                self.assertAlmostEqual(optics[f'D{plane}'][k + 1], d[0])
+                self.assertAlmostEqual(optics[f'DP{plane}'][k + 1], d[1])
+
+        # Drift: alpha = -L / beta0
+        self.assertAlmostEqual(_Matcher(self.line, self.context, [], [], [], periodic=False).optics(
+            np.array([]))[2]['ALFX'][1], -1.0 / 5.0)
+
+    def test_match_line(self):
+        r = manzoni.match(line=self.line,
+                          context=self.context,
+                          vary=['Q1K1', {'variable': 'Q2K1', 'lower': -10.0, 'upper': 0.0}],
+                          constraints=[{'range': 'D3', 'constraint': 'betx=3.0, bety=4.0'}],
+                          periodic=False)
+        self.assertLess(r['penalty'], 1e-12)
+        self.assertAlmostEqual(r['constraints']['D3']['betx']['final'], 3.0)
+        self.assertAlmostEqual(r['constraints']['D3']['bety']['final'], 4.0)
+        self.assertEqual(r['variables']['Q1K1']['initial'], 1.0)
+        self.assertLessEqual(r['context']['Q2K1'], 0.0)
+        self.assertEqual(r['context']['Q3K1'], 0.5)
+
+        # The matched context reproduces the constraints
+        m = _Matcher(self.line, r['context'], [], [{'range': 'D3', 'constraint': 'betx=3.0'}], [], periodic=False)
+        self.assertAlmostEqual(m.residuals(np.array([]))[0], 0.0)
+
+    def test_inequality(self):
+        r = manzoni.match(line=self.line, context=self.context, vary=['Q1K1'],
+                          constraints=[{'range': 'D2', 'constraint': 'betx<100.0'}], periodic=False)
+        self.assertEqual(r['penalty'], 0.0)
+        self.assertEqual(r['context']['Q1K1'], 1.0)
+
+    def test_match_ring(self):
+        cell = [
+            {'NAME': 'QF', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'PLUG': 'K1', 'CIRCUIT': 'KF'},
+            {'NAME': 'D1', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+            {'NAME': 'B1', 'CLASS': 'SBEND', 'LENGTH': 1.0, 'ANGLE': np.pi / 4},
+            {'NAME': 'QD', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'PLUG': 'K1', 'CIRCUIT': 'KD'},
+            {'NAME': 'D2', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+        ]
+        rows = [{**e, 'NAME': f"{e['NAME']}{i}", 'TYPE': e['CLASS']} for i in range(4) for e in cell]
+        r = manzoni.match(line=georges.Beamline(pd.DataFrame(rows)),
+                          context={'ENERGY': 230.0, 'KF': 1.0, 'KD': -1.0},
+                          vary=['KF', 'KD'],
+                          global_constraints=['Q1=1.2', 'Q2=1.1'])
+        self.assertLess(r['penalty'], 1e-12)
+        self.assertAlmostEqual(r['constraints']['#E']['q1']['final'], 1.2)
+
+    def test_invalid(self):
+        with self.assertRaises(MatchException):
+            manzoni.match(line=self.line, context=self.context, vary=['UNKNOWN'],
+                          constraints=[{'range': 'D3', 'constraint': 'betx=3.0'}], periodic=False)
+        with self.assertRaises(MatchException):
+            manzoni.match(line=self.line, context=self.context, vary=['Q1K1'],
+                          constraints=[{'range': 'D3', 'constraint': 'foo=3.0'}], periodic=False)
+        with self.assertRaises(MatchException):
+            manzoni.match(line=self.line, context=self.context, vary=['Q1K1'],
+                          constraints=[{'range': 'NONE', 'constraint': 'betx=3.0'}], periodic=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges import manzoni
+from georges.manzoni.common import convert_line
+from georges.manzoni.constants import X
+from georges.manzoni.observers import Observer, ArrayObserver, ObserverException
+
+
+def _line():
+    return georges.Beamline(pd.DataFrame([
+        {'NAME': 'D1', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0},
+        {'NAME': 'Q1', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': 1.0},
+        {'NAME': 'C1', 'CLASS': 'COLLIMATOR', 'TYPE': 'COLLIMATOR', 'LENGTH': 0.1, 'APERTYPE': 'RECTANGLE',
+         'APERTURE': '0.004,0.004'},
+        {'NAME': 'D2', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0},
+    ]))
+
+
+class TestManzoniObservers(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.line = convert_line(_line().line, {'ENERGY': 230.0})
+        self.beam = np.random.randn(1000, 5) * [2e-3, 1e-3, 2e-3, 1e-3, 0.0]
+
+    def test_array_observer(self):
+        elements = [0, 2, 3]
+        reference = Observer(turns=3, elements=elements)
+        manzoni.manzoni.track1(self.line, self.beam.copy(), reference)
+        o = ArrayObserver(n_particles=1000, turns=3, elements=elements)
+        manzoni.manzoni.track1(self.line, self.beam.copy(), o)
+        self.assertEqual(o.data.shape, (3, 3, 1000, 5))
+        self.assertTrue(np.all(o.alive[0, 0]))
+        for turn in range(3):
+            for k in range(3):
+                alive = o.alive[turn, k]
+                self.assertEqual(np.count_nonzero(alive), reference.data[turn, k].shape[0])
+                np.testing.assert_array_equal(o.data[turn, k][alive], reference.data[turn, k])
+        # Lost particles stay lost
+        self.assertTrue(np.all(o.alive[2, 2] <= o.alive[0, 1]))
+        self.assertLess(np.count_nonzero(o.alive[2, 2]), 1000)
+
+    def test_memory_map(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'observer.npy')
+            o = ArrayObserver(n_particles=1000, elements=[1, 3], dims=4, dtype=np.float32, filename=filename)
+            manzoni.manzoni.track1(self.line, self.beam.copy(), o)
+            o.flush()
+            data = np.load(filename, mmap_mode='r')
+            self.assertEqual(data.dtype, np.float32)
+            self.assertEqual(data.shape, (1, 2, 1000, 4))
+            np.testing.assert_array_equal(np.isfinite(data[..., 0]), o.alive)
+            del data, o
+
+    def test_stepped_degrader(self):
+        line = convert_line(pd.DataFrame({
+            'CLASS': ['DRIFT', 'DEGRADER', 'DRIFT'],
+            'TYPE': ['DRIFT', 'slab', 'DRIFT'],
+            'LENGTH': [1.0, 0.1, 1.0],
+            'MATERIAL': ['', 'graphite', ''],
+        }, index=['D1', 'DEG', 'D2']), {'ENERGY': 230.0})
+        beam = self.beam.copy()
+        beam[:, X] = np.linspace(-0.5, 0.5, 1000)
+        np.random.seed(1)
+        reference = Observer(elements=[0, 2])
+        manzoni.manzoni.track1(line, beam.copy(), reference, degrader='stepped')
+        np.random.seed(1)
+        o = ArrayObserver(n_particles=1000, elements=[0, 2])
+        manzoni.manzoni.track1(line, beam.copy(), o, degrader='stepped')
+        alive = o.alive[0, 1]
+        self.assertLess(np.count_nonzero(alive), 1000)
+        np.testing.assert_array_equal(o.data[0, 1][alive], reference.data[0, 1])
+        # The surviving particles keep their initial index
+        self.assertGreater(np.corrcoef(o.data[0, 0][alive, X], o.data[0, 1][alive, X])[0, 1], 0.99)
+
+    def test_unknown_ids(self):
+        o = ArrayObserver(n_particles=10, elements=[0])
+        with self.assertRaises(ObserverException):
+            o(0, 0, np.zeros((5, 5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+import pandas as pd
+import georges
+from georges import manzoni
+from georges.manzoni.common import convert_line
+from georges.manzoni.constants import *
+from georges.manzoni.match import _element_matrix, _cumulative_maps, _periodic_initial, _optics
+from georges.manzoni.observers import Observer
+from georges.manzoni.orbit import response_matrix, correct_orbit, OrbitException
+
+
+def _ring(cells=4):
+    cell = [
+        {'NAME': 'QF', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': 1.2},
+        {'NAME': 'BPMF', 'CLASS': 'MONITOR', 'LENGTH': 0.0},
+        {'NAME': 'HC', 'CLASS': 'HKICKER', 'LENGTH': 0.0, 'PLUG': 'KICK', 'CIRCUIT': 'HC'},
+        {'NAME': 'D1', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+        {'NAME': 'B1', 'CLASS': 'SBEND', 'LENGTH': 1.0, 'ANGLE': np.pi / cells},
+        {'NAME': 'QD', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.3, 'K1': -1.2},
+        {'NAME': 'BPMD', 'CLASS': 'MONITOR', 'LENGTH': 0.0},
+        {'NAME': 'VC', 'CLASS': 'VKICKER', 'LENGTH': 0.0, 'PLUG': 'KICK', 'CIRCUIT': 'VC'},
+        {'NAME': 'D2', 'CLASS': 'DRIFT', 'LENGTH': 1.0},
+    ]
+    rows = [{**e, 'NAME': f"{e['NAME']}{i}", 'TYPE': e['CLASS'],
+             'CIRCUIT': f"{e['CIRCUIT']}{i}" if 'CIRCUIT' in e else np.nan} for i in range(cells) for e in cell]
+    return georges.Beamline(pd.DataFrame(rows))
+
+
+class TestManzoniOrbit(unittest.TestCase):
+    def setUp(self):
+        self.line = _ring()
+        self.context = {'ENERGY': 230.0}
+
+    def _track(self, kicks):
+        """Trajectory of a reference particle tracked through the line with the given kicks."""
+        elements = convert_line(self.line.line, {**self.context, **kicks})
+        o = Observer(elements=list(range(len(elements))))
+        manzoni.manzoni.track1(elements, np.zeros((1, 5)), o)
+        names = list(self.line.line.index.values)
+        return pd.DataFrame([b[0, [X, Y]] for b in o.data[0]], index=names, columns=['X', 'Y'])
+
+    def test_line_response(self):
+        r = response_matrix(self.line, self.context)
+        self.assertEqual(r.shape, (16, 8))
+        kicks = {c: k for c, k in zip(r.columns, np.random.uniform(-1e-3, 1e-3, len(r.columns)))}
+        trajectory = self._track(kicks)
+        predicted = r.values @ np.array(list(kicks.values()))
+        bpms = list(r.loc['X'].index)
+        np.testing.assert_allclose(predicted[:8], trajectory.loc[bpms, 'X'], atol=1e-12)
+        np.testing.assert_allclose(predicted[8:], trajectory.loc[bpms, 'Y'], atol=1e-12)
+        self.assertEqual(r.loc[('X', 'BPMF0'), 'HC1'], 0.0)
+
+    def test_ring_response(self):
+        r = response_matrix(self.line, self.context, correctors=['HC0', 'HC2'], periodic=True)
+        elements = convert_line(self.line.line, self.context)
+        m = _cumulative_maps(np.array([_element_matrix(e) for e in elements]))
+        optics = _optics(m, _periodic_initial(m[-1]))
+        names = list(self.line.line.index.values)
+        q = optics['MUX'][-1]
+        for c in ['HC0', 'HC2']:
+            i = names.index(c) + 1
+            for b in ['BPMF0', 'BPMD1', 'BPMF3']:
+                j = names.index(b) + 1
+                expected = np.sqrt(optics['BETX'][i] * optics['BETX'][j]) / (2 * np.sin(np.pi * q)) \
+                    * np.cos(2 * np.pi * np.abs(optics['MUX'][j] - optics['MUX'][i]) - np.pi * q)
+                self.assertAlmostEqual(r.loc[('X', b), c], expected, delta=1e-9)
+
+    def test_correction(self):
+        r = response_matrix(self.line, self.context)
+        errors = {c: k for c, k in zip(r.columns, np.random.uniform(-1e-3, 1e-3, len(r.columns)))}
+        trajectory = self._track(errors).loc[r.loc['X'].index]
+        correction = correct_orbit(self.line, trajectory, response=r)
+        self.assertLess(np.max(np.abs(correction['orbit'])), 1e-12)
+        # The last corrector has no downstream monitor
+        self.assertEqual(correction['context']['VC3'], 0.0)
+        for c in r.columns[:-1]:
+            self.assertAlmostEqual(correction['context'][c], -errors[c], delta=1e-12)
+        corrected = self._track({c: errors[c] + correction['kicks'][c] for c in r.columns})
+        self.assertLess(np.max(np.abs(corrected.loc[r.loc['X'].index].values)), 1e-12)
+
+        regularized = correct_orbit(self.line, trajectory, response=r, n_singular=4, alpha=1.0)
+        self.assertLess(np.linalg.norm(regularized['kicks']), np.linalg.norm(correction['kicks']))
+
+    def test_invalid(self):
+        with self.assertRaises(OrbitException):
+            response_matrix(self.line, self.context, correctors=['QF0'])
+        with self.assertRaises(OrbitException):
+            correct_orbit(self.line, pd.DataFrame({'PX': [0.0]}, index=['BPMF0']), self.context)
+
+
+if __name__ == '__main__':
+    unittest.main()
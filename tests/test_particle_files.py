@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from georges import physics
+from georges.particle_files import encode_fixed, encode_rows, ParticleFileWriter, ParticleFileException
+from georges.bdsim import BDSim
+from georges.lib.pybdsim import pybdsim
+from georges.g4beamline.g4beamline import G4Beamline
+
+
+class TestParticleFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.distribution = pd.DataFrame(np.random.randn(1003, 5) * 1e-3, columns=['X', 'PX', 'Y', 'PY', 'DPP'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encode_fixed(self):
+        values = np.array([0.0, -0.001234, 12.5, -123.456789, -1e-13, 7])
+        lines = [bytes(r).decode() for r in encode_fixed(values, 6)]
+        self.assertEqual(lines, ['   0.000000', '  -0.001234', '  12.500000', '-123.456789', '   0.000000',
+                                 '   7.000000'])
+        self.assertEqual([bytes(r).decode() for r in encode_fixed(np.array([3, -12]), None)], ['  3', '-12'])
+        with self.assertRaises(ParticleFileException):
+            encode_fixed(np.array([np.nan]))
+
+    def test_encode_rows(self):
+        values = np.random.randn(100) * 10
+        text = encode_rows([values, np.arange(100)], [9, None], separator='\t').decode()
+        data = np.array([line.split('\t') for line in text.splitlines()], dtype=float)
+        self.assertTrue(np.allclose(data[:, 0], values, atol=1e-9))
+        self.assertTrue(np.array_equal(data[:, 1], np.arange(100)))
+
+    def test_writer_chunks_and_background(self):
+        filename = os.path.join(self.tmp.name, 'particles.dat')
+        w = ParticleFileWriter(filename,
+                               columns=[('X', 'X'), ('TWICE', lambda c: 2 * c['PX']), ('ID', lambda c: c['INDEX'] + 1)],
+                               decimals={'ID': None},
+                               header='# header\n',
+                               chunk_size=100)
+        w.start(self.distribution).wait()
+        data = pd.read_csv(filename, comment='#', header=None, delim_whitespace=True).values
+        self.assertEqual(data.shape, (1003, 3))
+        self.assertTrue(np.allclose(data[:, 0], self.distribution['X'], atol=1e-12))
+        self.assertTrue(np.allclose(data[:, 1], 2 * self.distribution['PX'], atol=1e-12))
+        self.assertTrue(np.array_equal(data[:, 2], np.arange(1, 1004)))
+
+    def test_bdsim_beam_file(self):
+        p0 = physics.energy_to_momentum(230)
+        bd = BDSim(beamlines=[])
+        bd._bdsim_machine = pybdsim.Builder.Machine()
+        before = self.distribution.copy()
+        bd.track(self.distribution, p0, cwd=self.tmp.name)
+        bd._wait_input_files()
+        self.assertTrue(self.distribution.equals(before))
+        data = pd.read_csv(os.path.join(self.tmp.name, 'input_beam.dat'), sep='\t', header=None).values
+        energy = (physics.momentum_to_energy(p0 * (before['DPP'] + 1)) + physics.PROTON_MASS) / 1000
+        self.assertTrue(np.allclose(data[:, 4], energy, atol=1e-12))
+        self.assertTrue(np.allclose(data[:, 1], before['PX'], atol=1e-12))
+
+    def test_g4beamline_beam_file(self):
+        p0 = physics.energy_to_momentum(230)
+        g4 = G4Beamline(beamlines=[])
+        g4.track(self.distribution, cwd=self.tmp.name, p0=p0)
+        g4._wait_input_files()
+        filename = os.path.join(self.tmp.name, 'input_beam.dat')
+        with open(filename) as f:
+            self.assertEqual(f.readline(), '#BLTrackFile\n')
+        data = pd.read_csv(filename, comment='#', header=None, delim_whitespace=True).values
+        self.assertTrue(np.allclose(data[:, 0], self.distribution['X'] * 1000, atol=1e-5))
+        self.assertTrue(np.allclose(data[:, 5], np.sqrt(p0 ** 2 - (self.distribution['PX'] * p0) ** 2
+                                                        - (self.distribution['PY'] * p0) ** 2), atol=1e-5))
+        self.assertTrue(np.array_equal(data[:, 8], np.arange(1, 1004)))
+        self.assertTrue(np.all(data[:, 7] == 2212))
+
+
+if __name__ == '__main__':
+    unittest.main()
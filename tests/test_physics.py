@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+from georges import physics
+
+
+class TestPhysics(unittest.TestCase):
+    def test_kinematics_array(self):
+        energy = np.array([70.0, 150.0, 230.0])
+        k = physics.kinematics_array(energy=energy)
+        self.assertEqual(k.dtype, physics.KINEMATICS_DTYPE)
+        np.testing.assert_allclose(k['momentum'], physics.energy_to_momentum(energy))
+        np.testing.assert_allclose(k['brho'], physics.energy_to_brho(energy))
+        np.testing.assert_allclose(k['beta'], physics.energy_to_beta(energy))
+        np.testing.assert_allclose(k['gamma'], physics.beta_to_gamma(k['beta']))
+        np.testing.assert_allclose(k['pv'], physics.energy_to_pv(energy))
+        np.testing.assert_allclose(k['range'], physics.energy_to_range(energy))
+        for q in physics.KINEMATICS_QUANTITIES:
+            rtol = 1e-2 if q == 'range' else 1e-9  # The range fits are not exact inverses
+            np.testing.assert_allclose(physics.kinematics_array(**{q: k[q]})['energy'], energy, rtol=rtol)
+        k = physics.kinematics_array(momentum=k['momentum'], quantities=['energy', 'brho'])
+        self.assertEqual(k.dtype.names, ('energy', 'brho'))
+        np.testing.assert_allclose(k['energy'], energy)
+
+    def test_mass(self):
+        k = physics.kinematics_array(mass=physics.ELECTRON_MASS, momentum=1.0)
+        self.assertAlmostEqual(float(k['energy']), np.sqrt(1 + physics.ELECTRON_MASS ** 2) - physics.ELECTRON_MASS)
+        self.assertAlmostEqual(physics.momentum_to_energy(1.0, mass=physics.ELECTRON_MASS), float(k['energy']))
+
+    def test_kinematics(self):
+        k = physics.kinematics(energy=230.0)
+        self.assertAlmostEqual(k['momentum'], 696.0, places=0)
+        self.assertAlmostEqual(physics.kinematics(brho=k['brho'])['energy'], 230.0)
+        self.assertEqual(physics.kinematics(energy=0)['gamma'], 1)
+        with self.assertRaises(Exception):
+            physics.kinematics(energy=230.0, momentum=600.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
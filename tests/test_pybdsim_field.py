@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from georges.lib.pybdsim.pybdsim import Field
+from georges.lib.pybdsim.pybdsim.Field._Field import EncodeScientific
+
+
+def field_4d(nx=4, ny=3, nz=5, nt=2):
+    """Field map with the (t, z, y, x, value) dimension order."""
+    t, z, y, x = np.meshgrid(np.linspace(0, 1e-9, nt), np.linspace(0, 3, nz), np.linspace(-2, 2, ny),
+                             np.linspace(-1, 1, nx), indexing='ij')
+    values = [x, y, z, t, np.sin(x) * 1e-3, -np.cos(y) * 123.456, x * y * z + 1e-120]
+    return np.stack(values, axis=-1)
+
+
+class TestField(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encode_scientific(self):
+        values = np.array([0.0, 1.0, -1234.5678912345, 9.999999999e-5, 1000.0, 0.1 + 0.2])
+        strings = [bytes(r).decode() for r in EncodeScientific(values, 8)]
+        self.assertEqual([s.strip() for s in strings], ['%.8E' % v for v in values])
+        strings = [bytes(r).decode() for r in EncodeScientific(values, 16)]
+        self.assertEqual([s.strip() for s in strings], ['%.16E' % v for v in values])
+        np.testing.assert_array_equal(np.array(strings, dtype=float), values)
+        strings = [bytes(r).decode() for r in EncodeScientific(np.array([1e-120, -2.5e200, 1.0]), 8)]
+        self.assertEqual(strings, [' 1.00000000E-120', '-2.50000000E+200', ' 1.00000000E+000'])
+
+    def test_write_and_load(self):
+        data = field_4d()
+        for name in ('field.dat', 'field.dat.gz'):
+            filename = os.path.join(self.tmp.name, name)
+            Field.Field4D(data, flip=False, doublePrecision=True).Write(filename, chunkSize=7)
+            loaded = Field.Load(filename, chunkBytes=100)
+            self.assertEqual(loaded.shape, (2, 5, 3, 4, 7))
+            np.testing.assert_array_equal(loaded, data)
+        Field.Field4D(data).Write(filename)
+        np.testing.assert_allclose(Field.Load(filename).reshape(-1, 7),
+                                   np.transpose(data, (3, 2, 1, 0, 4)).reshape(-1, 7), rtol=1e-8)
+
+    def test_cache(self):
+        filename = os.path.join(self.tmp.name, 'field.dat')
+        Field.Field3D(field_4d()[0][..., [0, 1, 2, 4, 5, 6]]).Write(filename)
+        loaded = Field.Load(filename, cache=True)
+        self.assertTrue(os.path.exists(filename + '.npz'))
+        np.testing.assert_array_equal(Field.Load(filename, cache=True), loaded)
+        Field.Field3D(2 * field_4d()[0][..., [0, 1, 2, 4, 5, 6]]).Write(filename)
+        os.utime(filename, ns=(0, 0))
+        np.testing.assert_allclose(Field.Load(filename, cache=True), 2 * loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+import pandas as pd
+from georges.sequence_geometry import compute_derived_data, expand_sequence_data
+
+
+def _row_wise(line):
+    tmp = line.apply(compute_derived_data, axis=1)
+    tmp2 = tmp
+    while True:
+        tmp, tmp2 = tmp2, tmp.apply(compute_derived_data, axis=1)
+        if tmp.equals(tmp2):
+            break
+    return tmp2
+
+
+class TestSequenceGeometry(unittest.TestCase):
+    def setUp(self):
+        self.line = pd.DataFrame({
+            'NAME': ['Q1', 'B1', 'B2', 'M1', 'D1'],
+            'TYPE': ['QUADRUPOLE', 'SBEND', 'RBEND', np.nan, 'DRIFT'],
+            'CLASS': ['QUADRUPOLE', np.nan, np.nan, np.nan, np.nan],
+            'AT_CENTER': [0.5, np.nan, np.nan, 10.0, np.nan],
+            'AT_EXIT': [np.nan, 4.0, np.nan, np.nan, 12.0],
+            'AT_ENTRY': [np.nan, np.nan, 5.0, np.nan, np.nan],
+            'LENGTH': [1.0, np.nan, 2.0, np.nan, np.nan],
+            'LENGTH_ELEMENT': [np.nan, np.nan, np.nan, np.nan, 0.5],
+            'ANGLE': [np.nan, 0.1, 0.2, np.nan, np.nan],
+            'RHO': [np.nan, 1500.0, np.nan, np.nan, np.nan],
+        }).set_index('NAME')
+
+    def test_equivalence(self):
+        expected = _row_wise(self.line)
+        result = expand_sequence_data(self.line)
+        for c in ['AT_ENTRY', 'AT_CENTER', 'AT_EXIT', 'LENGTH', 'ORBIT_LENGTH']:
+            np.testing.assert_allclose(result[c].astype(float).values, expected[c].astype(float).values)
+        self.assertListEqual(list(result['CLASS'].fillna('')), list(expected['CLASS'].fillna('')))
+
+    def test_values(self):
+        result = expand_sequence_data(self.line)
+        self.assertAlmostEqual(result.loc['B1', 'ORBIT_LENGTH'], 0.15)
+        self.assertAlmostEqual(result.loc['B1', 'AT_ENTRY'], 3.85)
+        self.assertAlmostEqual(result.loc['D1', 'AT_ENTRY'], 11.5)
+        self.assertEqual(result.loc['M1', 'ORBIT_LENGTH'], 0.0)
+        self.assertEqual(result.loc['B1', 'CLASS'], 'SBEND')
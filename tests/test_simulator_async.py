@@ -0,0 +1,42 @@
+import time
+import asyncio
+import unittest
+from georges.madx import Madx
+from georges.simulator import gather_runs
+from tests.fake_madx import FakeMadxTestCase
+
+
+class TestSimulatorAsync(FakeMadxTestCase):
+    def madx(self, commands):
+        m = Madx(beamlines=[], path=self.bin)
+        for c in commands:
+            m.raw(c)
+        return m
+
+    def test_events(self):
+        events = []
+        m = asyncio.get_event_loop().run_until_complete(
+            self.madx(['TWISS;']).run_async(on_event=lambda kind, line: events.append(kind))
+        )
+        self.assertListEqual(events, ['progress', 'warning'])
+        self.assertEqual(len(m.warnings), 1)
+        self.assertEqual(len(m.fatals), 0)
+        self.assertIn('done', m.output)
+
+    def test_abort_on_fatal(self):
+        start = time.time()
+        m = asyncio.get_event_loop().run_until_complete(self.madx(['FATAL;']).run_async())
+        self.assertLess(time.time() - start, 10.0)
+        self.assertEqual(len(m.fatals), 1)
+
+    def test_gather(self):
+        start = time.time()
+        runs = [(self.madx(['SLEEP;', 'TWISS;']), {}) for _ in range(6)]
+        results = asyncio.get_event_loop().run_until_complete(gather_runs(runs, max_concurrency=3))
+        self.assertLess(time.time() - start, 2.5)
+        self.assertTrue(all(len(m.warnings) == 1 for m in results))
+        self.assertListEqual(results, [r[0] for r in runs])
+
+    def test_sync_run(self):
+        m = self.madx(['TWISS;']).run()
+        self.assertEqual(len(m.warnings), 1)
@@ -0,0 +1,50 @@
+import os
+import unittest
+import pandas as pd
+from georges import Beamline
+from georges import madx
+from georges.simulator import SimulatorCache
+from tests.fake_madx import FakeMadxTestCase
+
+
+class TestSimulatorCache(FakeMadxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.line = Beamline(pd.DataFrame([
+            {'NAME': 'Q1', 'TYPE': 'QUADRUPOLE', 'CLASS': 'QUADRUPOLE', 'LENGTH': 0.5, 'AT_CENTER': 1.0,
+             'CIRCUIT': 'B1G', 'PLUG': 'K1', 'BRHO': 2.0},
+        ]), name='LINE')
+        self.cache = SimulatorCache(os.path.join(self.tmp.name, 'cache'))
+
+    def twiss(self, k):
+        path = os.environ['PATH']
+        os.environ['PATH'] = self.bin + os.pathsep + path
+        try:
+            return madx.twiss(line=self.line,
+                              context={'PARTICLE': 'PROTON', 'PC': 700.0, 'B1G': k},
+                              cwd=self.workdir,
+                              cache=self.cache)
+        finally:
+            os.environ['PATH'] = path
+
+    def runs(self):
+        with open(os.path.join(self.workdir, 'runs.log')) as f:
+            return len(f.readlines())
+
+    def test_cache_hit(self):
+        for k in [1.0, 1.0, 2.0, 1.0]:
+            t = self.twiss(k)
+            self.assertAlmostEqual(t.line.loc['Q1', 'BETX'], k)
+        self.assertEqual(self.runs(), 2)
+
+    def test_eviction(self):
+        cache = SimulatorCache(os.path.join(self.tmp.name, 'small'), max_size=3000)
+        keys = [cache.key(f"input {i}") for i in range(4)]
+        for i, k in enumerate(keys[:3]):
+            cache.put(k, {'value': 'x' * 900})
+            os.utime(os.path.join(cache.path, k + '.pkl'), (i, i))
+        cache.get(keys[0])  # Most recently used
+        cache.put(keys[3], {'value': 'x' * 900})
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertLessEqual(cache.size, 3000)
@@ -0,0 +1,58 @@
+import os
+import time
+import unittest
+from georges.simulator import Simulator, SimulatorJob, SimulatorJobRunner
+
+
+def write_output(value, cwd='.'):
+    with open(os.path.join(cwd, 'output.txt'), 'w') as f:
+        f.write(str(value))
+
+
+def read_output(workdir):
+    with open(os.path.join(workdir, 'output.txt')) as f:
+        return float(f.read()), workdir
+
+
+def sleep(duration, cwd='.'):
+    time.sleep(duration)
+    return cwd
+
+
+def fail(cwd='.'):
+    raise ValueError("Simulator error.")
+
+
+class TestSimulatorJobs(unittest.TestCase):
+    def test_isolated_jobs(self):
+        results = Simulator.run_jobs([SimulatorJob(write_output, i, collect=read_output) for i in range(6)],
+                                     max_workers=3)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertListEqual([r.value[0] for r in results], list(range(6)))
+        workdirs = [r.value[1] for r in results]
+        self.assertEqual(len(set(workdirs)), 6)
+        self.assertFalse(any(os.path.exists(w) for w in workdirs))
+
+    def test_concurrency(self):
+        start = time.time()
+        results = SimulatorJobRunner(max_workers=4).run([SimulatorJob(sleep, 0.5) for _ in range(4)])
+        self.assertTrue(all(r.ok for r in results))
+        self.assertLess(time.time() - start, 1.9)
+
+    def test_timeout_and_failure(self):
+        results = SimulatorJobRunner(max_workers=2, timeout=0.5).run([
+            SimulatorJob(sleep, 30.0),
+            SimulatorJob(fail),
+            SimulatorJob(sleep, 0.0),
+        ])
+        self.assertListEqual([r.status for r in results], ['timeout', 'failed', 'done'])
+        self.assertIn('Simulator error', results[1].error)
+
+    def test_results_at_the_timeout(self):
+        # Jobs completing around the timeout are either done or timed out, and never break the other jobs
+        for _ in range(3):
+            results = SimulatorJobRunner(max_workers=4, timeout=0.2).run(
+                [SimulatorJob(sleep, 0.19 + 0.005 * k) for k in range(4)] + [SimulatorJob(sleep, 0.0)]
+            )
+            self.assertTrue(all(r.status in ('done', 'timeout') for r in results))
+            self.assertEqual(results[-1].status, 'done')
@@ -0,0 +1,129 @@
+import unittest
+import tempfile
+import numpy as np
+import pandas as pd
+import georges
+from georges import manzoni
+from georges.store import TrackingStore, TrackingStoreException
+from georges.manzoni.common import convert_line
+from georges.manzoni.observers import AsyncStoreObserver, ArrayObserver, ObserverException
+
+
+def _line():
+    return georges.Beamline(pd.DataFrame([
+        {'NAME': 'D1', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 0.0},
+        {'NAME': 'Q1', 'CLASS': 'QUADRUPOLE', 'TYPE': 'QUADRUPOLE', 'LENGTH': 0.2, 'K1': 2.0, 'AT_ENTRY': 1.0,
+         'APERTYPE': 'CIRCLE', 'APERTURE': 0.01},
+        {'NAME': 'D2', 'CLASS': 'DRIFT', 'TYPE': 'DRIFT', 'LENGTH': 1.0, 'AT_ENTRY': 1.2},
+    ]))
+
+
+class TestTrackingStore(unittest.TestCase):
+
+    def test_write_and_read_blocks(self):
+        path = tempfile.mkdtemp()
+        particles = np.random.normal(size=(2500, 5))
+        alive = particles[:, 0] > 0
+        with TrackingStore(path, mode='w', row_group_size=1000) as s:
+            s.write('A', particles)
+            s.write('B', particles[:10], alive=alive[:10])
+            s.write('C', np.empty((0, 5)))
+        s = TrackingStore(path)
+        self.assertEqual(s.elements, ['A', 'B', 'C'])
+        self.assertEqual(s._file.num_row_groups, 4)
+        np.testing.assert_allclose(s.read_element('A').values, particles)
+        self.assertEqual(len(s.read_element('B', alive_only=True)), alive[:10].sum())
+        self.assertEqual(len(s.read_element('C')), 0)
+        self.assertEqual(list(s.read(columns=['X', 'Y']).columns), ['ELEMENT', 'TURN', 'X', 'Y'])
+        self.assertEqual(len(s.read(elements=['B'], alive_only=True)), alive[:10].sum())
+        self.assertEqual(s.summary.loc[('A', 0), 'N'], 2500)
+
+    def test_invalid_store(self):
+        with self.assertRaises(TrackingStoreException):
+            TrackingStore(tempfile.mkdtemp())
+
+    def test_track_to_store(self):
+        path = tempfile.mkdtemp()
+        beam = georges.Beam().from_5d_multigaussian_distribution(n=1000, XRMS=0.005, YRMS=0.005)
+        line = _line()
+        r = manzoni.track(line=line, beam=beam, context={'ENERGY': 230.0}, store=path)
+        self.assertEqual(r.line.at['D1', 'N'], 1000)
+        s = TrackingStore(path)
+        self.assertEqual(s.elements, ['D1', 'Q1', 'D2'])
+        self.assertEqual(len(s.read_element('D2')), r.line.at['D2', 'N'])
+        self.assertEqual(len(s.to_beamline(line).line.at['Q1', 'BEAM'].distribution), r.line.at['Q1', 'N'])
+
+    def test_reuse_store(self):
+        # A store given as a TrackingStore is left open by the tracking
+        path = tempfile.mkdtemp()
+        beam = georges.Beam().from_5d_multigaussian_distribution(n=1000, XRMS=0.005, YRMS=0.005)
+        with TrackingStore(path, mode='w') as store:
+            manzoni.track(line=_line(), beam=beam, context={'ENERGY': 230.0}, store=store)
+            manzoni.track(line=_line(), beam=beam, context={'ENERGY': 230.0}, store=store, asynchronous=True)
+            manzoni.track_chunks(_line(), [beam.distribution.values], store, context={'ENERGY': 230.0})
+        s = TrackingStore(path)
+        self.assertEqual(len(s.index), 9)
+        self.assertEqual(s.summary.loc[('D1', 0), 'N'], 3000)
+
+    def test_particle_ids(self):
+        path = tempfile.mkdtemp()
+        particles = np.random.normal(size=(1000, 5)) * [5e-3, 1e-3, 5e-3, 1e-3, 0.0]
+        manzoni.track_chunks(_line(), np.array_split(particles, 3), path, context={'ENERGY': 230.0})
+        s = TrackingStore(path)
+        np.testing.assert_array_equal(s.read_element('D1', columns=['ID'])['ID'].values, np.arange(1000))
+        ids = s.read_element('D2', columns=['ID'])['ID'].values
+        self.assertLess(len(ids), 1000)
+        o = ArrayObserver(n_particles=1000, elements=[0, 1, 2])
+        manzoni.manzoni.track1(convert_line(_line().line, {'ENERGY': 230.0}), particles.copy(), o)
+        np.testing.assert_array_equal(ids, np.flatnonzero(o.alive[0, 2]))
+
+    def test_asynchronous_track_to_store(self):
+        beam = georges.Beam().from_5d_multigaussian_distribution(n=1000, XRMS=0.005, YRMS=0.005)
+        line = _line()
+        synchronous, asynchronous = tempfile.mkdtemp(), tempfile.mkdtemp()
+        manzoni.track(line=line, beam=beam, context={'ENERGY': 230.0}, store=synchronous)
+        r = manzoni.track(line=line, beam=beam, context={'ENERGY': 230.0}, store=asynchronous, asynchronous=True)
+        self.assertEqual(r.line.at['D1', 'N'], 1000)
+        s, a = TrackingStore(synchronous), TrackingStore(asynchronous)
+        self.assertEqual(a.elements, s.elements)
+        for e in s.elements:
+            np.testing.assert_array_equal(a.read_element(e).values, s.read_element(e).values)
+
+    def test_asynchronous_observer(self):
+        path = tempfile.mkdtemp()
+        store = TrackingStore(path, mode='w')
+        o = AsyncStoreObserver(store, turns=2, elements=[0, 1], names=['A', 'B'], func=lambda b: b[::2].copy(),
+                               maxsize=1)
+        particles = np.random.normal(size=(100, 5))
+        for turn in range(2):
+            for element in range(2):
+                o(turn, element, particles)
+                particles[:] = 0.0  # The snapshots are taken before returning
+        o.close()
+        store.close()
+        self.assertEqual(len(store.index), 4)
+        self.assertEqual(len(store.read_element('A', turn=0)), 50)
+        self.assertNotEqual(store.read_element('A', turn=0).values.std(), 0.0)
+        with self.assertRaises(ObserverException):
+            o(0, 0, particles)
+
+    def test_asynchronous_observer_error(self):
+        store = TrackingStore(tempfile.mkdtemp(), mode='w')
+        o = AsyncStoreObserver(store, elements=[0], names=['A'])
+        o(0, 0, np.zeros((10, 3)))
+        with self.assertRaises(TrackingStoreException):
+            o.close()
+
+    def test_asynchronous_tracking_error(self):
+        # The writer fails (wrong number of columns) and so does the tracking: the tracking error is raised
+        path = tempfile.mkdtemp()
+        store = TrackingStore(path, mode='w', columns=['X', 'PX'])
+
+        def chunks():
+            yield np.zeros((10, 5))
+            raise ValueError("Tracking error.")
+
+        with self.assertRaises(ValueError):
+            manzoni.track_chunks(_line(), chunks(), store, context={'ENERGY': 230.0}, asynchronous=True)
+        store.close()
+        self.assertEqual(len(TrackingStore(path).index), 0)
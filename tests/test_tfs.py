@@ -0,0 +1,100 @@
+import os
+import gzip
+import tempfile
+import unittest
+import numpy as np
+from georges.madx import read_tfs, iter_tfs, read_madx_twiss, TfsException
+from georges.lib.pymadx.pymadx.Data import Tfs
+
+
+def tfs_content(n=10, extra_headers=3):
+    lines = ['@ NAME             %05s "TWISS"\n',
+             '@ TITLE            %20s "a title with spaces"\n',
+             '@ NPART            %d   12\n',
+             '@ GAMMA            %le  1.2\n']
+    lines += [f'@ HEADER{i} %le {i}.0\n' for i in range(extra_headers)]
+    lines.append('* NAME KEYWORD S BETX NUMBER\n')
+    lines.append('$ %s %s %le %le %d\n')
+    for i in range(n):
+        name = 'DRIFT' if i % 2 else f'Q{i}'
+        lines.append(f' "{name}" "QUADRUPOLE" {0.1 * i:.6e} {1.0 + i:.6e} {i}\n')
+    return ''.join(lines)
+
+
+class TestTfs(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'twiss.outx')
+        with open(self.filename, 'w') as f:
+            f.write(tfs_content())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read(self):
+        df, header, formats = read_tfs(self.filename, with_header=True)
+        self.assertEqual(df.index.name, 'NAME')
+        self.assertEqual(list(df.columns), ['KEYWORD', 'S', 'BETX', 'NUMBER'])
+        self.assertEqual(len(df), 10)
+        self.assertEqual(df.index[0], 'Q0')
+        self.assertEqual(df['KEYWORD'].iloc[0], 'QUADRUPOLE')
+        self.assertEqual(df['S'].dtype, np.float64)
+        self.assertEqual(df['NUMBER'].dtype, np.int64)
+        self.assertAlmostEqual(df['BETX'].iloc[3], 4.0)
+        self.assertEqual(header['NAME'], 'TWISS')
+        self.assertEqual(header['TITLE'], 'a title with spaces')
+        self.assertEqual(header['NPART'], 12)
+        self.assertAlmostEqual(header['GAMMA'], 1.2)
+        self.assertEqual(formats, ['%s', '%s', '%le', '%le', '%d'])
+
+    def test_header_length_independent(self):
+        filename = os.path.join(self.tmp.name, 'long.outx')
+        with open(filename, 'w') as f:
+            f.write(tfs_content(extra_headers=80))
+        self.assertTrue(read_tfs(filename).equals(read_tfs(self.filename)))
+        self.assertTrue(read_madx_twiss(filename).equals(read_tfs(self.filename)))
+
+    def test_columns_and_index(self):
+        df = read_tfs(self.filename, index=None, columns=['S'])
+        self.assertEqual(list(df.columns), ['S'])
+        self.assertEqual(list(df.index), list(range(10)))
+
+    def test_gzip(self):
+        filename = self.filename + '.gz'
+        with gzip.open(filename, 'wt') as f:
+            f.write(tfs_content())
+        self.assertTrue(read_tfs(filename).equals(read_tfs(self.filename)))
+
+    def test_iter(self):
+        chunks = list(iter_tfs(self.filename, chunksize=4))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        self.assertEqual(chunks[1].index[0], 'Q4')
+
+    def test_sidecar(self):
+        df = read_tfs(self.filename, cache=True)
+        self.assertTrue(os.path.exists(self.filename + '.pkl'))
+        self.assertTrue(read_tfs(self.filename, cache=True).equals(df))
+        with open(self.filename, 'w') as f:
+            f.write(tfs_content(n=3))
+        self.assertEqual(len(read_tfs(self.filename, cache=True)), 3)
+
+    def test_segmented(self):
+        filename = os.path.join(self.tmp.name, 'track.one')
+        with open(filename, 'w') as f:
+            f.write('* NUMBER X\n$ %d %le\n#segment 1 1 1 1 start\n 1 0.0\n')
+        with self.assertRaises(TfsException):
+            read_tfs(filename)
+
+    def test_pymadx(self):
+        t = Tfs(self.filename)
+        self.assertEqual(len(t), 10)
+        self.assertEqual(t.header['NAME'], 'TWISS')
+        self.assertEqual(t.sequence[:4], ['Q0', 'DRIFT', 'Q2', 'DRIFT_1'])
+        self.assertAlmostEqual(t['Q2']['BETX'], 3.0)
+        self.assertEqual(t['Q2']['KEYWORD'], 'QUADRUPOLE')
+        self.assertAlmostEqual(t.smax, 0.9)
+        self.assertIn('SMID', t.columns)
+
+
+if __name__ == '__main__':
+    unittest.main()